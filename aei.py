@@ -5,14 +5,11 @@ natural language models and APIs, programming interfaces, etc."""
 from __future__ import print_function
 
 import os.path
+import threading
+from datetime import datetime, timedelta
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+from types import SimpleNamespace
 from email.message import EmailMessage
-import google.auth
 
 import mimetypes
 
@@ -23,41 +20,124 @@ from email.mime.text import MIMEText
 
 import base64
 
+import plugins
+from calcache import CalendarCache
+from dispatch import Arg
+
 email_from = 'SENDER'
 my_email = 'YOUR_GMAIL'
 
 # If modifying these scopes, delete the file token.json.
 SCOPES = ['https://www.googleapis.com/auth/gmail.modify', 'https://www.googleapis.com/auth/calendar.events']
 
-# lists of AEI commands the agent can call, and arguments it can pass
-aeiCommands = {'/;SENDMAIL;/':None, '/;GOOGSEARCH;/':None, '/;CALENDAR;/':{'/;VIEW;/':''}}
+# AEI commands the agent can call, and the arguments each passes to its handler (see dispatch.Arg)
+aeiCommands = {
+    '/;GOOGSEARCH;/': (Arg('query', 'rest'),),
+    '/;SENDMAIL;/': (Arg('recipient', 0, required=True), Arg('subject', 1, required=True), Arg('content', 2, required=True)),
+    '/;CALENDAR;/': (Arg('action', 'action', required=True), Arg('start', 'START'), Arg('end', 'END'), Arg('maxResults', 'MAX', int, 10),
+                     Arg('loc', 'LOC'), Arg('name', 'NAME', default='Autogenerated Event'),
+                     Arg('desc', 'DESCRIPTION', default='This even was autogenerated by AI.'), Arg('eventId', 'EVENTID')),
+    '/;INBOX;/': (Arg('query', 'rest', str.strip),),
+    '/;WTEXT;/': (Arg('text', 'value'), Arg('fid', 'after', required=True)),
+    '/;RTEXT;/': (Arg('fid', 'rest'),),
+}
+
+# refresh access tokens this long before they expire, so no AEI call pays for a refresh
+REFRESH_MARGIN = timedelta(minutes=5)
+
+
+def loadGoogle():
+    """Import the Google API client stack. It is registered as the 'google'
+    plugin, so it is only imported by the first AEI that talks to Google.
+    """
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from googleapiclient.discovery import build
+    from googleapiclient.errors import HttpError
+    from google_auth_httplib2 import AuthorizedHttp
+    import httplib2
+    return SimpleNamespace(Request=Request, Credentials=Credentials, InstalledAppFlow=InstalledAppFlow, build=build,
+                           HttpError=HttpError, AuthorizedHttp=AuthorizedHttp, httplib2=httplib2)
+
+
+plugins.register('google', loadGoogle)
+google = plugins.Lazy('google')
+
+_creds = None
+_credsLock = threading.Lock()
+# services and their HTTP connections are per thread, since httplib2 connections are not thread-safe
+_local = threading.local()
+_calendarCache = None
+
+
+def getCredentials():
+    """Load user credentials once per process and refresh them before they expire.
+    The file token.json stores the user's access and refresh tokens, and is
+    created automatically when the authorization flow completes for the first
+    time. It is only re-written when the credentials change.
+    """
+    global _creds
+    with _credsLock:
+        creds = _creds
+        if creds is None and os.path.exists('token.json'):
+            creds = google.Credentials.from_authorized_user_file('token.json', SCOPES)
+        expiring = creds and creds.expiry and creds.expiry - datetime.utcnow() < REFRESH_MARGIN
+        # If there are no (valid) credentials available, let the user log in.
+        if not creds or not creds.valid or expiring:
+            if creds and creds.refresh_token:
+                creds.refresh(google.Request())
+            else:
+                flow = google.InstalledAppFlow.from_client_secrets_file(
+                    'credentials.json', SCOPES)
+                creds = flow.run_local_server(port=0)
+            # Save the credentials for the next run
+            with open('token.json', 'w') as token:
+                token.write(creds.to_json())
+        _creds = creds
+        return creds
+
+
+def getService(name, version):
+    """Return a cached Google API service, e.g. getService('gmail', 'v1').
+    Services are built once per thread from the discovery documents bundled
+    with google-api-python-client (no discovery fetch), over a persistent
+    authorized HTTP connection. Credentials are checked for upcoming expiry
+    on every call.
+    """
+    creds = getCredentials()
+    # refreshes update the credentials in place; a new login replaces them, so rebuild on a new object
+    if getattr(_local, 'creds', None) is not creds:
+        _local.creds = creds
+        _local.services = {}
+    key = (name, version)
+    if key not in _local.services:
+        http = google.AuthorizedHttp(creds, http=google.httplib2.Http())
+        _local.services[key] = google.build(name, version, http=http, static_discovery=True, cache_discovery=False)
+    return _local.services[key]
+
+
+def getCalendarCache():
+    """Return the process-wide local mirror of the primary calendar, created
+    on first use. It syncs through getService, so each thread uses its own
+    connection.
+    """
+    global _calendarCache
+    with _credsLock:
+        if _calendarCache is None:
+            _calendarCache = CalendarCache(lambda: getService('calendar', 'v3'))
+        return _calendarCache
 
-def sendMail(recipient, subject, content):
+
+def sendMail(recipient, subject, content, show=print):
     """Create and send an email message
-    Print the returned  message id
+    Report the returned message id with show, e.g. a session's output
     Returns: Message object, including message id
 
-    Load pre-authorized user credentials from the environment.
-    TODO(developer) - See https://developers.google.com/identity
-    for guides on implementing OAuth2 for the application.
+    Uses the shared Gmail service from getService.
     """
-    creds=None
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                'credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
-
     try:
-        service = build('gmail', 'v1', credentials=creds)
+        service = getService('gmail', 'v1')
         message = EmailMessage()
 
         message.set_content(content)
@@ -75,99 +155,136 @@ def sendMail(recipient, subject, content):
         }
         # pylint: disable=E1101
         send_message = (service.users().messages().send(userId="me", body=create_message).execute())
-        print(F'Message Id: {send_message["id"]}')
-    except HttpError as error:
-        print(F'An error occurred: {error}')
+        show(F'Message Id: {send_message["id"]}')
+    except google.HttpError as error:
+        show(F'An error occurred: {error}')
         send_message = None
     return send_message
 
 
-def loadInbox(): #incomplete function
-    """Display threads with long conversations(>= 3 messages)
-    Return: None
+def iterInbox(query=None, maxThreads=None, pageSize=50, service=None, failed=None):
+    """Yield inbox threads page by page, following nextPageToken.
+    Each page of thread ids is resolved with one Gmail batch request that
+    fetches only the Subject header (format=metadata), instead of one
+    threads().get call per thread. Threads whose part of the batch fails
+    are requested once more in a second batch. The caller can stop iterating
+    at any time and no further pages are fetched.
+    Yields: dicts with id, subject, snippet and message count
 
-    Load pre-authorized user credentials from the environment.
-    TODO(developer) - See https://developers.google.com/identity
-    for guides on implementing OAuth2 for the application.
+    Pass service to use a specific Gmail service, e.g. one built on a
+    googleapiclient.http.HttpMockSequence for tests. Pass a list as failed
+    to get the ids of threads that could not be loaded after the retry
+    appended to it; they are left out of the results.
     """
-    creds=None
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                'credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
-
-    try:
-        # create gmail api client
-        service = build('gmail', 'v1', credentials=creds)
+    service = service or getService('gmail', 'v1')
+    pageToken = None
+    remaining = maxThreads
+    while remaining is None or remaining > 0:
+        size = pageSize if remaining is None else min(pageSize, remaining)
+        page = service.users().threads().list(userId='me', q=query, maxResults=size, pageToken=pageToken).execute()
+        threads = page.get('threads', [])
+        if not threads:
+            return
+
+        found = {}
+        errors = {}
+
+        def collect(requestId, response, exception):
+            if exception is None:
+                found[requestId] = response
+                errors.pop(requestId, None)
+            else:
+                errors[requestId] = exception
+
+        def fetch(ids):
+            # gmail batches hold at most 100 calls
+            for i in range(0, len(ids), 100):
+                batch = service.new_batch_http_request(callback=collect)
+                for threadId in ids[i:i+100]:
+                    batch.add(service.users().threads().get(userId='me', id=threadId, format='metadata', metadataHeaders=['Subject']), request_id=threadId)
+                batch.execute()
+
+        fetch([thread['id'] for thread in threads])
+        if errors:
+            # one retry for the threads whose part of the batch failed, e.g. on a rate limit
+            fetch(list(errors))
+        if failed is not None:
+            failed.extend(thread['id'] for thread in threads if thread['id'] in errors)
 
-        # pylint: disable=maybe-no-member
-        # pylint: disable:R1710
-        threads = service.users().threads().list(userId='me').execute().get('threads', [])
         for thread in threads:
-            tdata = service.users().threads().get(userId='me', id=thread['id']).execute()
-            nmsgs = len(tdata['messages'])
-
-            # skip if <3 msgs in thread
-            if nmsgs == 1:
-                msg = tdata['messages'][0]['payload']
-                subject = ''
-                for header in msg['headers']:
+            tdata = found.get(thread['id'])
+            if not tdata:
+                continue
+            messages = tdata.get('messages', [])
+            subject = ''
+            if messages:
+                for header in messages[0].get('payload', {}).get('headers', []):
                     if header['name'] == 'Subject':
                         subject = header['value']
                         break
-                if subject:  # skip if no Subject line
-                    print(F'- {subject}, {nmsgs}')
-        return threads
+            yield {'id': thread['id'], 'subject': subject, 'snippet': thread.get('snippet', ''), 'messages': len(messages)}
 
-    except HttpError as error:
-        print(F'An error occurred: {error}')
+        if remaining is not None:
+            remaining -= len(threads)
+        pageToken = page.get('nextPageToken')
+        if not pageToken:
+            return
 
 
-def calendar(action, start, end=None, maxResults=10, loc=None, name='Autogenerated Event', desc='This even was autogenerated by AI.', eventId=None):
+def loadInbox(maxThreads=10, query=None, show=print):
+    """Summarize the most recent inbox threads for the agent
+    Returns: string listing the subject, message count and threadId of each
+    thread, like calendar(action='view'), and how many threads could not be
+    loaded, if any. Errors are also reported with show
+    """
+    try:
+        lines = []
+        failed = []
+        for thread in iterInbox(query=query, maxThreads=maxThreads, failed=failed):
+            lines.append(F"{thread['subject'] or '(no subject)'} ({thread['messages']} messages)\n{thread['snippet']}\nthreadId: {thread['id']}")
+
+        # threads that failed to load are reported, so the agent knows the list is incomplete
+        missing = F"\n{len(failed)} matching thread{'s' if len(failed) != 1 else ''} could not be loaded." if failed else ''
+        if not lines:
+            if failed:
+                return 'You checked the inbox, but no matching thread could be loaded.' + missing
+            return 'You have successfully checked the inbox. There are no matching threads.'
+        return 'You have successfully checked the inbox. Matching threads:\n' + '\n'.join(lines) + missing
+
+    except google.HttpError as error:
+        show(F'An error occurred: {error}')
+        return F'An error occurred: {error}'
+
+
+def calendar(action, start, end=None, maxResults=10, loc=None, name='Autogenerated Event', desc='This even was autogenerated by AI.', eventId=None, confirm=None, show=print):
     """Shows basic usage of the Google Calendar API.
     Prints the start and name of the next 10 events on the user's calendar.
+
+    Views are answered from the local calendar cache after an incremental
+    sync; created and deleted events are written through to the cache.
+    Deletions are confirmed with confirm(question), which asks the user
+    through input() when not given. Created events and errors are reported
+    with show, e.g. a session's output.
     """
     action = str(action).lower()
-
-    creds = None
-    # The file token.json stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                'credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
+    if confirm is None:
+        confirm = lambda question: input(f'\n{question} Enter "y" to delete it. Any other string to abort.')
 
     try:
-        service = build('calendar', 'v3', credentials=creds)
+        service = getService('calendar', 'v3')
 
         # Call the Calendar API
         if action == 'view':
 
             #print('Getting the upcoming 10 events')
-            events_result = service.events().list(calendarId='primary', timeMin=start, timeMax=end,
-                                                  maxResults=maxResults, singleEvents=True,
-                                                  orderBy='startTime').execute()
-            #print(events_result)
-            events = events_result.get('items', [])
+            events = getCalendarCache().view(start, end, maxResults)
+            if events is None:
+                # bounds the cache cannot parse: let the API interpret them
+                events_result = service.events().list(calendarId='primary', timeMin=start, timeMax=end,
+                                                      maxResults=maxResults, singleEvents=True,
+                                                      orderBy='startTime').execute()
+                #print(events_result)
+                events = events_result.get('items', [])
 
             if not events:
                 #print('No upcoming events found.')
@@ -176,7 +293,7 @@ def calendar(action, start, end=None, maxResults=10, loc=None, name='Autogenerat
             eventsText = ''
             for event in events:
                 eventStart = event['start'].get('dateTime', event['start'].get('date'))
-                eventSummary = event['summary']
+                eventSummary = event.get('summary', '')
                 eventId = event['id']
                 if eventsText:
                     eventsText+='\n'
@@ -192,13 +309,14 @@ def calendar(action, start, end=None, maxResults=10, loc=None, name='Autogenerat
                 eventName = event['summary']
                 eventId = event['id']
 
-                if input(f'\nEnter "y" to delete event "{eventName}". Any other string to abort.'):
+                if confirm(f'Delete event "{eventName}"?'):
                     service.events().delete(calendarId='primary', eventId=eventId).execute()
+                    getCalendarCache().remove(eventId)
                     return f'You deleted the event "{eventName}".'
                 else:
                     return 'User aborted the deletion.'
             except Exception as e:
-                print(f'An error occurred: {e}')
+                show(f'An error occurred: {e}')
                 return f'An error occurred: {e}'
 
         elif action == 'create':
@@ -227,33 +345,37 @@ def calendar(action, start, end=None, maxResults=10, loc=None, name='Autogenerat
             }
 
             event = service.events().insert(calendarId='primary', body=event).execute()
-            print ('Event created by Assistant: %s' % (event.get('htmlLink')))
+            getCalendarCache().put(event)
+            show('Event created by Assistant: %s' % (event.get('htmlLink')))
             return 'You have successfully created the event.'
 
 
 
 
-    except HttpError as error:
-        print('An error occurred: %s' % error)
+    except google.HttpError as error:
+        show('An error occurred: %s' % error)
 
 
-def wtxt(text, fid):
-    """/;WTEXT;/<Text to write>/;PATH;/<Path to write to>"""
+def wtxt(text, fid, show=print):
+    """/;WTEXT;/<Text to write>/;PATH;/<Path to write to>
+    Reports the write with show, e.g. a session's output"""
     try:
         with open('./'+fid+'.txt', 'w') as f:
             f.write(text)
-        print(f'\nText written to {fid}.txt.')
+        show(f'\nText written to {fid}.txt.')
         return 'You successfully wrote the text file.'
     except:
-        print('\nAn error occurred in writing the text file.')
+        show('\nAn error occurred in writing the text file.')
         return 'An error occurred in writing the text file.'
 
-def rtxt(fid):
+def rtxt(fid, show=print):
+    """/;RTEXT;/<Path to read>
+    Reports the read with show, e.g. a session's output"""
     try:
         with open('./'+fid+'.txt', 'r') as f:
             text = f.read()
-        print(f'\nAssistant read {fid}.txt.')
+        show(f'\nAssistant read {fid}.txt.')
         return 'You successfully read the text file. Its content is as follows:\n\n'+text
     except:
-        print(f'\nAn error occurred in reading {fid}.txt.')
+        show(f'\nAn error occurred in reading {fid}.txt.')
         return 'An error occurred in reading the text file.'
\ No newline at end of file
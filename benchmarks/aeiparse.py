@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" AEI command parser fuzz test and benchmark
+Checks the registry in dispatch.py against the string-splitting parsers the
+main loop used to have, on random well- and ill-formed AEI responses, then
+times both on typical commands.
+
+    python -m benchmarks.aeiparse [--cases 20000] [--seed 0] [--repeat 20000]
+"""
+
+import argparse
+import random
+import time
+
+from aei import aeiCommands
+from dispatch import AeiRegistry, AeiError, commandName, tokenize
+
+
+def calParse(text):
+    # the previous calendar argument parser, without its debug prints
+
+    code = text
+    parsed = {'action':None, 'start':None, 'end':None, 'max':10, 'loc':None, 'name':'Autogenerated Event', 'description':'This even was autogenerated by AI.', 'eventid': None}
+    parsing = True
+
+    actionSplit = code.split('/;', maxsplit=1)[-1].split(';/', maxsplit=1)
+    parsed['action'] = actionSplit[0].lower()
+
+    code = actionSplit[-1].split('/;', maxsplit=1)[-1]
+
+    while parsing:
+
+        firstSplit = code.split(';/', maxsplit=1)
+        if len(firstSplit) == 1:
+            parsing = False
+            break
+
+        first = firstSplit[0].lower()
+        secondSplit = firstSplit[-1].split('/;', maxsplit=1)
+        second = secondSplit[0]
+        parsed[str(first)]=str(second)
+
+        code = secondSplit[-1]
+
+    return parsed
+
+
+def legacyParse(responseText):
+    # the previous if/elif chain, returning what each branch passed on
+    # returns: (command name, args dict), (command name, None) where the branch failed, or None for no command
+
+    responseCheck = responseText.split(';/', maxsplit=1)
+    if len(responseCheck) == 1:
+        return None
+    if responseCheck[0] == '/;GOOGSEARCH':
+        return '/;GOOGSEARCH;/', {'query': responseCheck[1]}
+
+    elif responseCheck[0] == '/;SENDMAIL':
+        try:
+            mailRecipient = responseCheck[1].split(';/', maxsplit=1)[1].split('/;', maxsplit=1)
+            mailSubject = mailRecipient[1].split(';/', maxsplit=1)[1].split('/;', maxsplit=1)
+            mailContent = mailSubject[1].split(';/', maxsplit=1)[1].split('/;', maxsplit=1)
+        except:
+            return '/;SENDMAIL;/', None
+        return '/;SENDMAIL;/', {'recipient': mailRecipient[0], 'subject': mailSubject[0], 'content': mailContent[0]}
+
+    elif responseCheck[0] == '/;CALENDAR':
+        args = calParse(responseCheck[1])
+        try:
+            maxResults = int(args['max'])
+        except ValueError:
+            return '/;CALENDAR;/', None
+        return '/;CALENDAR;/', {'action': args['action'], 'start': args['start'], 'end': args['end'], 'maxResults': maxResults,
+                                'loc': args['loc'], 'name': args['name'], 'desc': args['description'], 'eventId': args['eventid']}
+
+    elif responseCheck[0] == '/;INBOX':
+        return '/;INBOX;/', {'query': responseCheck[1].strip()}
+
+    elif responseCheck[0] == '/;WTEXT':
+        return '/;WTEXT;/', {'text': responseCheck[1].split('/;', maxsplit=1)[0], 'fid': responseCheck[1].split(';/', maxsplit=1)[-1]}
+
+    elif responseCheck[0] == '/;RTEXT':
+        return '/;RTEXT;/', {'fid': responseCheck[-1]}
+
+    return None
+
+
+def newParse(registry, text):
+    # the registry's result in legacyParse's shape
+    try:
+        call = registry.parse(text)
+    except AeiError:
+        return commandName(text), None
+    return call and (call.name, call.args)
+
+
+names = [c[2:-2] for c in aeiCommands]
+tagNames = ['TO', 'SUBJECT', 'CONTENT', 'VIEW', 'CREATE', 'DELETE', 'START', 'END', 'MAX', 'LOC', 'NAME', 'DESCRIPTION', 'EVENTID', 'FID', 'view', 'Max']
+valueParts = ['', ' ', 'a', 'Hello there', 'bob@example.com', '2023-04-04T10:03:45-07:00', '10', ' 7 ', 'x', '\n', ',', '/', ';', '//', ';;', 'a/b', 'a;b']
+
+
+def randomValue(rng):
+    # values never contain the tag delimiters, or end in a ';' that would run into the next '/;'
+    while True:
+        value = ''.join(rng.choice(valueParts) for _ in range(rng.randint(0, 3)))
+        if '/;' not in value and ';/' not in value and not value.endswith(';'):
+            return value
+
+
+def randomResponse(rng):
+    # a command with a random run of tags, or occasionally plain text or a broken tag
+    roll = rng.random()
+    if roll < 0.05:
+        return randomValue(rng)
+    text = '/;' + rng.choice(names) + ';/' + randomValue(rng)
+    for _ in range(rng.randint(0, 6)):
+        text += '/;' + rng.choice(tagNames) + ';/' + randomValue(rng)
+    if roll > 0.9:
+        text += rng.choice(['/;', ';/', '/;END', '/;;/'])
+    return text
+
+
+def registry():
+    reg = AeiRegistry(aeiCommands)
+    for name in aeiCommands:
+        reg.register(name, lambda **args: None)
+    return reg
+
+
+def fuzz(cases, seed):
+    # compare both parsers on random responses
+    # returns: number of mismatches. legacy branches that produced unusable arguments (missing WTEXT file id,
+    # calendar without an action tag) are reported separately: the registry rejects them on purpose
+
+    rng = random.Random(seed)
+    reg = registry()
+    mismatches = rejected = 0
+    for _ in range(cases):
+        text = randomResponse(rng)
+        old, new = legacyParse(text), newParse(reg, text)
+        if old == new:
+            continue
+        if new is not None and new[1] is None and old is not None and old[0] == new[0] and _unusable(text, old[1]):
+            rejected += 1
+            continue
+        mismatches += 1
+        if mismatches <= 10:
+            print(f'mismatch on {text!r}:\n  legacy   {old}\n  registry {new}')
+    print(f'{cases} cases, {mismatches} mismatches, {rejected} rejected on purpose')
+    return mismatches
+
+
+def _unusable(text, args):
+    # argument sets the old parsers let through although the command had no tag to take them from
+    if text.startswith('/;WTEXT;/') or text.startswith('/;CALENDAR;/'):
+        return len(tokenize(text)) < 2
+    return False
+
+
+def bench(repeat):
+    reg = registry()
+    samples = [
+        '/;GOOGSEARCH;/weather in paris tomorrow',
+        '/;SENDMAIL;/ /;TO;/bob@example.com/;SUBJECT;/Lunch/;CONTENT;/Are we still on for noon tomorrow?',
+        '/;CALENDAR;/ /;CREATE;/ /;START;/2023-04-04T10:03:45-07:00/;END;/2023-04-06T10:03:45-07:00/;MAX;/10/;LOC;/800 Howard St., San Francisco, CA 94103/;NAME;/Team offsite, /;DESCRIPTION;/Planning.',
+        '/;CALENDAR;/ /;VIEW;/ /;START;/2023-04-04T00:00:00-07:00/;END;/2023-04-05T00:00:00-07:00',
+        'Sure, the capital of France is Paris.',
+    ]
+    for name, parse in (('legacy', legacyParse), ('registry', lambda t: newParse(reg, t))):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for text in samples:
+                parse(text)
+        elapsed = time.perf_counter() - start
+        print(f'{name:<10} {elapsed / (repeat * len(samples)) * 1e6:>8.2f} us per response')
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Fuzz test and benchmark the AEI command parser.')
+    parser.add_argument('--cases', type=int, default=20000, help='random responses to compare')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=20000, help='benchmark iterations over the sample responses')
+    args = parser.parse_args()
+
+    failed = fuzz(args.cases, args.seed)
+    bench(args.repeat)
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" Search page text extraction benchmark
+Compares the recursive per-element extraction the search AEI used to do
+against the single-script extraction in browser.py, counting WebDriver round
+trips and wall time on the same loaded results page.
+
+    python -m benchmarks.extract [--query "weather in paris"] [--url file:///page.html] [--length 1000] [--repeat 5]
+"""
+
+import argparse
+import time
+from urllib.parse import quote_plus
+
+from browser import startBrowser, extractText, extractResults
+
+
+def getElementText(element, searchLength):
+    # the previous extraction: recursively reads .text and child elements, one round trip per call
+
+    text = element.text.strip()
+    for child in element.find_elements('xpath','./*'):
+        text += '\n' + getElementText(child, searchLength).strip()
+        if len(text) >= searchLength:
+            return text[:searchLength+1]
+    return text[:searchLength+1]
+
+
+def countRoundTrips(driver):
+    # wrap the driver's command executor so every WebDriver HTTP command is counted
+    # returns: one-element list holding the running count
+
+    calls = [0]
+    execute = driver.command_executor.execute
+
+    def counted(command, params):
+        calls[0] += 1
+        return execute(command, params)
+
+    driver.command_executor.execute = counted
+    return calls
+
+
+def measure(name, extract, container, calls, repeat):
+    times = []
+    before = calls[0]
+    for _ in range(repeat):
+        start = time.perf_counter()
+        text = extract(container)
+        times.append(time.perf_counter() - start)
+    trips = (calls[0] - before) / repeat
+    print(f'{name:<12} {trips:>8.0f} round trips {min(times)*1000:>10.1f} ms best {sum(times)/len(times)*1000:>10.1f} ms mean {len(text):>6} chars')
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark search page text extraction.')
+    parser.add_argument('--query', default='weather in paris', help='Google query to load')
+    parser.add_argument('--url', default=None, help='page to load instead of a Google search, e.g. a saved results page')
+    parser.add_argument('--length', type=int, default=1000, help='characters to extract (searchLength)')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per extraction method')
+    args = parser.parse_args()
+
+    driver = startBrowser()
+    try:
+        driver.get(args.url or 'https://www.google.com/search?q=' + quote_plus(args.query))
+        container = driver.find_element('id', 'rcnt') if not args.url else driver.find_element('tag name', 'body')
+        calls = countRoundTrips(driver)
+
+        measure('recursive', lambda c: getElementText(c, args.length), container, calls, args.repeat)
+        measure('script', lambda c: extractText(c, args.length), container, calls, args.repeat)
+        measure('structured', lambda c: extractResults(c, args.length), container, calls, args.repeat)
+    finally:
+        driver.quit()
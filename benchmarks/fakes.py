@@ -0,0 +1,254 @@
+""" Local stand-ins for the chat loop's remote backends
+Fake OpenAI, Pinecone, Selenium and Google API objects with the same call
+surface chat.py, browser.py and aei.py use, each sleeping a configurable
+latency with jitter and counting its calls. The fake model follows a script:
+it calls the search, calendar and mail AEIs when the newest user message asks
+for them, and answers in prose once it has seen their results."""
+
+import hashlib
+import random
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+# calls made to each fake backend, e.g. calls['openai.chat']
+calls = Counter()
+_callsLock = threading.Lock()
+
+
+def count(name, n=1):
+    with _callsLock:
+        calls[name] += n
+
+
+class Latency:
+    # sleeps mean seconds, plus or minus up to jitter seconds
+    # takes: mean seconds, jitter seconds, seed
+
+    def __init__(self, mean=0.0, jitter=0.0, seed=0):
+        self.mean = mean
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            delay = self.mean + self.rng.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+
+def scriptedReply(messages):
+    # what the fake model answers: an AEI call for a request it recognizes, prose otherwise
+    # takes: list of message dicts
+    # returns: string
+
+    if messages and messages[0]['role'] == 'system' and messages[0]['content'].startswith('Summarize'):
+        # a summarization request: the first words of what it summarizes
+        return 'Summary: ' + ' '.join(messages[-1]['content'].split()[:30])
+
+    newest = max((i for i, m in enumerate(messages) if m['role'] == 'user'), default=None)
+    if newest is None:
+        return 'Hello! How can I help you today?'
+    text = messages[newest]['content'].split(': ', 1)[-1]
+    lowered = text.lower()
+    answered = any(m['role'] == 'system' for m in messages[newest+1:])
+
+    if not answered:
+        if 'search for ' in lowered:
+            return '/;GOOGSEARCH;/' + text[lowered.index('search for ') + len('search for '):]
+        if 'calendar' in lowered:
+            return '/;CALENDAR;/ /;VIEW;/ /;START;/2023-04-04T00:00:00-07:00/;END;/2023-04-11T00:00:00-07:00'
+        if lowered.startswith('email '):
+            return '/;SENDMAIL;/ /;TO;/bob@example.com/;SUBJECT;/Note/;CONTENT;/' + text
+    words = ('Sure, here is what I found about that. ' + text + ' ') * 3
+    return words.strip()
+
+
+class FakeOpenAI:
+    # stands in for the openai module: ChatCompletion.create (streamed or not) and Embedding.create
+    # takes: Latency before the first token, seconds between streamed tokens, Latency of an embedding request, embedding dimension
+
+    def __init__(self, latency=None, tokenDelay=0.0, embedLatency=None, dim=1536):
+        self.latency = latency or Latency()
+        self.tokenDelay = tokenDelay
+        self.embedLatency = embedLatency or Latency()
+        self.dim = dim
+        self.ChatCompletion = SimpleNamespace(create=self.complete)
+        self.Embedding = SimpleNamespace(create=self.embed)
+
+    def complete(self, model, messages, stream=False, **kwargs):
+        count('openai.chat')
+        self.latency()
+        text = scriptedReply(messages)
+        tokens = text.split(' ')
+        usage = {'prompt_tokens': sum(len(m['content']) // 4 for m in messages), 'completion_tokens': len(tokens)}
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+        if stream:
+            return self._stream(tokens)
+        message = SimpleNamespace(content=text, role='assistant')
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+    def _stream(self, tokens):
+        for i, token in enumerate(tokens):
+            if i and self.tokenDelay:
+                time.sleep(self.tokenDelay)
+            yield {'choices': [{'delta': {'content': token if i == 0 else ' ' + token}}]}
+
+    def vector(self, text):
+        # deterministic pseudo-random unit-ish vector for text
+        rng = random.Random(hashlib.sha256(text.encode()).digest())
+        return [rng.uniform(-1, 1) for _ in range(self.dim)]
+
+    def embed(self, input, engine=None):
+        count('openai.embedding')
+        self.embedLatency()
+        texts = [input] if isinstance(input, str) else list(input)
+        return {'data': [{'index': i, 'embedding': self.vector(t)} for i, t in enumerate(texts)]}
+
+
+class FakeIndex:
+    # stands in for a Pinecone index. queries return top_k stored ids picked pseudo-randomly from the query vector.
+    # ids and known hold the default namespace, and namespaces the others
+    # takes: initial ids, Latency of each request
+
+    def __init__(self, ids=(), latency=None):
+        self.ids = list(ids)
+        self.known = set(self.ids)
+        self.latency = latency or Latency()
+        self.lock = threading.Lock()
+        self.namespaces = {}
+
+    def namespace(self, name):
+        # returns: the FakeIndex holding a namespace: this one for ''
+        if not name:
+            return self
+        with self.lock:
+            return self.namespaces.setdefault(name, FakeIndex(latency=self.latency))
+
+    def query(self, vector, top_k=10, namespace='', **kwargs):
+        if namespace:
+            return self.namespace(namespace).query(vector, top_k)
+        count('index.query')
+        self.latency()
+        rng = random.Random(repr(vector[:4]))
+        with self.lock:
+            picked = rng.sample(self.ids, min(top_k, len(self.ids)))
+        return {'matches': [{'id': i, 'score': 1.0 - n / (top_k + 1)} for n, i in enumerate(picked)]}
+
+    def upsert(self, vectors, namespace='', **kwargs):
+        if namespace:
+            return self.namespace(namespace).upsert(vectors)
+        count('index.upsert')
+        self.latency()
+        with self.lock:
+            for v in vectors:
+                if v[0] not in self.known:
+                    self.known.add(v[0])
+                    self.ids.append(v[0])
+
+    def delete(self, ids, namespace='', **kwargs):
+        if namespace:
+            return self.namespace(namespace).delete(ids)
+        count('index.delete')
+        self.latency()
+        with self.lock:
+            gone = set(ids)
+            self.known -= gone
+            self.ids = [i for i in self.ids if i not in gone]
+
+    def describe_index_stats(self):
+        return {'total_vector_count': len(self.ids)}
+
+
+_pageText = 'Result one\nhttps://example.com/one\nThe venue is at 800 Howard St., San Francisco.\n\n' * 20
+
+
+class FakeElement:
+    def __init__(self, driver):
+        self.parent = driver
+
+
+class FakeDriver:
+    # stands in for a selenium Chrome session: page loads sleep, script execution returns canned result text
+    # takes: Latency of a page load, Latency of a script execution
+
+    def __init__(self, latency=None, scriptLatency=None):
+        count('browser.start')
+        self.latency = latency or Latency()
+        self.scriptLatency = scriptLatency or Latency()
+        self.title = 'Google'
+
+    def get(self, url):
+        count('browser.get')
+        self.latency()
+
+    def find_element(self, by=None, value=None):
+        return FakeElement(self)
+
+    def execute_script(self, script, element=None, limit=1000, *args):
+        count('browser.script')
+        self.scriptLatency()
+        return _pageText[:limit]
+
+    def quit(self):
+        pass
+
+
+class _Request:
+    def __init__(self, name, latency, result):
+        self.name = name
+        self.latency = latency
+        self.result = result
+
+    def execute(self):
+        count('google.' + self.name)
+        self.latency()
+        return self.result
+
+
+class _Events:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, **kwargs):
+        items = [] if kwargs.get('syncToken') else self.service.items
+        return _Request('calendar.list', self.service.latency, {'items': items, 'nextSyncToken': 'sync-token'})
+
+    def insert(self, calendarId, body):
+        event = dict(body, id='event%d' % len(self.service.items), htmlLink='https://calendar.google.com/')
+        self.service.items.append(event)
+        return _Request('calendar.insert', self.service.latency, event)
+
+    def get(self, calendarId, eventId):
+        event = next((e for e in self.service.items if e['id'] == eventId), {'id': eventId, 'summary': ''})
+        return _Request('calendar.get', self.service.latency, event)
+
+    def delete(self, calendarId, eventId):
+        return _Request('calendar.delete', self.service.latency, {})
+
+
+class _Messages:
+    def __init__(self, service):
+        self.service = service
+
+    def send(self, userId, body):
+        return _Request('gmail.send', self.service.latency, {'id': 'message1'})
+
+
+class FakeGoogleService:
+    # stands in for the Calendar and Gmail services getService builds
+    # takes: Latency of each request, number of calendar events to serve
+
+    def __init__(self, latency=None, events=20):
+        self.latency = latency or Latency()
+        self.items = [{'id': 'event%d' % i, 'summary': 'Meeting %d' % i,
+                        'start': {'dateTime': '2023-04-%02dT10:00:00-07:00' % (4 + i % 7)},
+                        'end': {'dateTime': '2023-04-%02dT11:00:00-07:00' % (4 + i % 7)}} for i in range(events)]
+
+    def events(self):
+        return _Events(self)
+
+    def users(self):
+        return SimpleNamespace(messages=lambda: _Messages(self))
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" Startup time and memory benchmark
+Starts fresh Python processes that import chat.py and open the Backends and a
+ChatSession, i.e. everything the command line does before it shows the first
+YOU: prompt, and reports the wall time from process start to that point, the
+import time and the resident memory there. The lazy mode is how chat.py
+starts; the eager mode loads every plugin (OpenAI, Pinecone, Selenium, the
+Google API client, numpy) before the first prompt, the way chat.py used to
+import them. Lazy runs then load each plugin as its first use would, and
+report what each one costs. Pinecone is only imported, since pinecone.init
+needs the network.
+
+    python -m benchmarks.startup [--runs 5] [--modes lazy,eager] [--json results.json]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the plugins chat.py, browser.py, aei.py and completioncache.py register, in the order a first session meets them
+pluginNames = ['openai', 'pinecone', 'numpy', 'selenium', 'google']
+
+# what each child process runs. it prints one JSON line when the prompt would appear, and one when done
+child = r'''
+import importlib, json, os, resource, sys, time
+start = time.perf_counter()
+
+def rss():
+    # resident memory in MB
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except OSError:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss / 2**20 if sys.platform == 'darwin' else maxrss / 2**10
+
+sys.path.insert(0, sys.argv[1])
+mode, names = sys.argv[2], sys.argv[3].split(',')
+import chat, plugins
+plugins.register('pinecone', lambda: importlib.import_module('pinecone'))
+imported = time.perf_counter()
+if mode == 'eager':
+    for name in names:
+        plugins.load(name)
+backends = chat.Backends()
+session = chat.ChatSession(backends)
+ready = time.perf_counter()
+print(json.dumps({'import': imported - start, 'ready': ready - start, 'rss': rss(), 'loaded': sorted(plugins.loaded())}), flush=True)
+
+firstUse = {}
+if mode == 'lazy':
+    for name in names:
+        before = rss()
+        try:
+            plugins.load(name)
+            firstUse[name] = {'seconds': plugins.loaded()[name], 'rss': rss() - before}
+        except Exception as e:
+            firstUse[name] = {'error': repr(e)}
+session.close()
+backends.close(flush=False)
+print(json.dumps({'firstUse': firstUse}), flush=True)
+'''
+
+
+def median(values):
+    ordered = sorted(values)
+    n = len(ordered)
+    return (ordered[n // 2] + ordered[(n - 1) // 2]) / 2
+
+
+def runOnce(mode, root):
+    # start one process in mode, in the benchmark directory
+    # returns: dict with wall seconds to the prompt, the child's own timings, rss and loaded plugins, first-use costs
+
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, '-c', child, here, mode, ','.join(pluginNames)], cwd=root,
+                            stdout=subprocess.PIPE, text=True)
+    line = proc.stdout.readline()
+    wall = time.perf_counter() - started
+    rest = proc.stdout.read()
+    if proc.wait() != 0 or not line:
+        raise RuntimeError(f'{mode} run failed')
+    result = json.loads(line)
+    result['wall'] = wall
+    result.update(json.loads(rest.strip().splitlines()[-1]))
+    return result
+
+
+def runMode(mode, runs, root):
+    # returns: report dict
+    results = [runOnce(mode, root) for _ in range(runs)]
+    report = {'mode': mode, 'runs': runs, 'loaded': results[0]['loaded']}
+    for key in ('wall', 'import', 'ready', 'rss'):
+        values = [r[key] for r in results]
+        report[key] = {'median': median(values), 'max': max(values)}
+    firstUse = {}
+    for name in pluginNames:
+        costs = [r['firstUse'][name] for r in results if name in r['firstUse']]
+        if costs and all('error' not in c for c in costs):
+            firstUse[name] = {'seconds': median([c['seconds'] for c in costs]), 'rss': median([c['rss'] for c in costs])}
+        elif costs:
+            firstUse[name] = {'error': costs[0]['error']}
+    report['firstUse'] = firstUse
+    return report
+
+
+def printReport(report):
+    print(f"\n{report['mode']}: {report['runs']} runs, plugins loaded at the prompt: {', '.join(report['loaded']) or 'none'}")
+    print(f"  process start to prompt   median {report['wall']['median']*1000:7.0f} ms   max {report['wall']['max']*1000:7.0f} ms")
+    print(f"  import chat               median {report['import']['median']*1000:7.0f} ms   max {report['import']['max']*1000:7.0f} ms")
+    print(f"  import and open session   median {report['ready']['median']*1000:7.0f} ms   max {report['ready']['max']*1000:7.0f} ms")
+    print(f"  resident memory           median {report['rss']['median']:7.1f} MB   max {report['rss']['max']:7.1f} MB")
+    for name, cost in report['firstUse'].items():
+        if 'error' in cost:
+            print(f"  first use of {name:<12} failed: {cost['error']}")
+        else:
+            print(f"  first use of {name:<12} {cost['seconds']*1000:7.0f} ms   +{cost['rss']:6.1f} MB")
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark chat.py startup time and memory.')
+    parser.add_argument('--runs', type=int, default=5, help='processes started per mode')
+    parser.add_argument('--modes', default='lazy,eager', help='comma-separated modes: lazy, eager')
+    parser.add_argument('--json', default=None, help='also write the results to this file')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='chatstartup')
+    shutil.copy(os.path.join(here, 'alignmentPrompt.txt'), root)
+    results = []
+    try:
+        for mode in args.modes.split(','):
+            report = runMode(mode, args.runs, root)
+            results.append(report)
+            printReport(report)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" End-to-end chat turn latency benchmark
+Drives scripted multi-turn ChatSessions (store and retrieve concurrently,
+build the prompt, complete, run AEIs, complete again, persist) against the
+local stand-ins in benchmarks/fakes.py, with configurable latency and jitter. chat.db is filled with synthetic history at
+each requested size first. Reports p50/p95/p99 per stage and per turn, fake
+API calls per turn and SQLite statements per turn for each scenario.
+
+    python -m benchmarks.turns [--sizes 1000,10000] [--turns 20] [--scenarios chat,search,calendar,email,upsert]
+                               [--llm 0.3] [--jitter 0.1] [--json results.json]
+"""
+
+import argparse
+import builtins
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from uuid import uuid4
+
+from benchmarks import fakes
+
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# what the scripted user types in each scenario, cycled for the number of turns
+scenarios = {
+    'chat': ['what did we talk about last week?', 'tell me more about the second point', 'how does that compare to last year?'],
+    'search': ['search for the venue address of the conference {n}', 'search for weather in san francisco on day {n}'],
+    'calendar': ['what is on my calendar this week? ({n})'],
+    'email': ['email bob that I will be late to meeting {n}'],
+    'upsert': ['remember that my locker code is {n}', '/upsert/'],
+}
+
+
+def percentile(values, p):
+    # nearest-rank percentile
+    # takes: list of numbers, percentile 0-100
+    # returns: number
+
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(int(round(p / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def fillHistory(store, rows):
+    # add synthetic messages to chat.db until it holds rows messages
+    # returns: list of all message ids
+
+    have = store.conn.execute('SELECT COUNT(*) FROM ChatHistory').fetchone()[0]
+    words = 'meeting venue calendar lunch project deadline budget travel invoice report error code locker'.split()
+    batch = []
+    now = time.time()
+    with store.conn:
+        for i in range(have, rows):
+            timestamp = now - (rows - i) * 60
+            timestring = str(datetime.fromtimestamp(timestamp))
+            speaker = 'USER' if i % 2 == 0 else 'ASSISTANT'
+            text = f'{words[i % len(words)]} {words[(i * 7) % len(words)]} number {i}'
+            batch.append((str(uuid4()), f'{speaker} at {timestring}: {text}', speaker, timestamp, timestring))
+            if len(batch) == 10000:
+                store.conn.executemany('INSERT INTO ChatHistory (id, message, speaker, timestamp, timestring) VALUES (?, ?, ?, ?, ?)', batch)
+                batch = []
+        if batch:
+            store.conn.executemany('INSERT INTO ChatHistory (id, message, speaker, timestamp, timestring) VALUES (?, ?, ?, ?, ?)', batch)
+    return [r[0] for r in store.conn.execute('SELECT id FROM ChatHistory')]
+
+
+class Bench:
+    # one ChatSession on the fake backends. stage timings come from the session's trace of each turn
+
+    def __init__(self, chat, vecdb, args):
+        browserLatency = fakes.Latency(args.browser, args.jitter * args.browser, args.seed)
+        self.backends = chat.Backends(vecdb, browserFactory=lambda: fakes.FakeDriver(browserLatency))
+        # mail and event deletions are confirmed automatically
+        self.session = chat.ChatSession(self.backends, confirm=lambda question: True)
+
+    def turn(self, userIn):
+        # run one user input
+        # returns: dict of span name -> seconds, summed over the turn
+
+        if userIn == '/upsert/':
+            started = time.perf_counter()
+            self.backends.upserts.flush()
+            seconds = time.perf_counter() - started
+            return {'upsert': seconds, 'turn': seconds}
+
+        self.session.turn(userIn)
+        trace = self.session.lastTrace
+        timings = {}
+        for span in trace['spans']:
+            timings[span['name']] = timings.get(span['name'], 0.0) + span['seconds']
+        timings['turn'] = trace['seconds']
+        return timings
+
+    def close(self):
+        self.session.close()
+        self.backends.close(flush=True)
+
+
+def loadChat(root, args):
+    # import chat.py inside the benchmark directory with its backends replaced by fakes
+    # returns: chat module
+
+    shutil.copy(os.path.join(here, 'alignmentPrompt.txt'), root)
+    os.chdir(root)
+    sys.path.insert(0, here)
+    import aei
+    import chat
+
+    chat.openai = fakes.FakeOpenAI(latency=fakes.Latency(args.llm, args.jitter * args.llm, args.seed), tokenDelay=args.token,
+                                   embedLatency=fakes.Latency(args.embed, args.jitter * args.embed, args.seed + 1))
+    service = fakes.FakeGoogleService(fakes.Latency(args.google, args.jitter * args.google, args.seed + 2))
+    aei.getService = lambda name, version: service
+    chat.stream = not args.no_stream
+    # stage timings are read from the session traces, which are kept in memory only
+    chat.traceOn = True
+    chat.tracePath = None
+    chat.tracer.metricsPath = None
+    # the synthetic history would be summarized day by day in the background, so only session compaction runs
+    chat.memoryCompactInterval = None
+    return chat
+
+
+def countStatements(connections, counter):
+    # count every SQL statement run on the given sqlite connections. statements sqlite runs internally
+    # (FTS5 shadow tables, triggers) are reported with a leading '--' and counted separately
+    def trace(sql):
+        counter['internal' if sql.startswith('--') else 'statements'] += 1
+    for conn in connections:
+        conn.set_trace_callback(trace)
+
+
+def runSize(chat, size, args, results):
+    from store import ChatStore
+    from embedcache import EmbeddingCache
+    import aei
+
+    directory = os.path.join(os.getcwd(), f'size{size}')
+    os.makedirs(directory, exist_ok=True)
+    os.chdir(directory)
+    print(f'\nchat.db with {size} messages')
+    chat.chatStore = ChatStore('chat.db')
+    # a fresh embedding cache per size, so every size starts cold
+    chat.embedCache = EmbeddingCache('embeddings.db', maxEntries=chat.embedCacheSize)
+    start = time.perf_counter()
+    ids = fillHistory(chat.chatStore, size)
+    print(f'  filled in {time.perf_counter() - start:.1f} s')
+    aei._calendarCache = None
+
+    for scenario in args.scenarios:
+        bench = Bench(chat, fakes.FakeIndex(ids, fakes.Latency(args.index, args.jitter * args.index, args.seed + 3)), args)
+        sql = Counter()
+        countStatements([chat.chatStore.conn, bench.backends.searchCache.conn, bench.backends.upserts.conn, chat.embedCache.conn], sql)
+        fakes.calls.clear()
+        stageTimes = defaultdict(list)
+        lines = scenarios[scenario]
+        with contextlib.redirect_stdout(io.StringIO()):
+            for n in range(args.turns):
+                userIn = lines[n % len(lines)].format(n=n)
+                for stage, seconds in bench.turn(userIn).items():
+                    stageTimes[stage].append(seconds)
+            bench.close()
+        for conn in (chat.chatStore.conn, chat.embedCache.conn):
+            conn.set_trace_callback(None)
+
+        turns = args.turns
+        report = {'size': size, 'scenario': scenario, 'turns': turns,
+                  'stages': {stage: {'p50': percentile(v, 50), 'p95': percentile(v, 95), 'p99': percentile(v, 99), 'n': len(v)} for stage, v in stageTimes.items()},
+                  'apiCalls': {name: n / turns for name, n in sorted(fakes.calls.items())},
+                  'sqlStatements': sql['statements'] / turns, 'sqlInternal': sql['internal'] / turns}
+        results.append(report)
+        printReport(report)
+    chat.chatStore.close()
+
+
+def printReport(report):
+    print(f"  {report['scenario']}: {report['turns']} turns, {report['sqlStatements']:.1f} SQL statements per turn "
+          f"(+{report['sqlInternal']:.1f} run internally by sqlite)")
+    for stage, p in report['stages'].items():
+        print(f"    {stage:<20} p50 {p['p50']*1000:>9.1f} ms   p95 {p['p95']*1000:>9.1f} ms   p99 {p['p99']*1000:>9.1f} ms   ({p['n']} samples)")
+    print('    api calls per turn: ' + ', '.join(f'{name} {n:.2f}' for name, n in report['apiCalls'].items()))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark chat turns end to end against fake backends.')
+    parser.add_argument('--sizes', default='1000,10000', help='comma-separated chat.db sizes in messages, e.g. 1000,10000,100000,1000000')
+    parser.add_argument('--turns', type=int, default=20, help='turns per scenario')
+    parser.add_argument('--scenarios', default=','.join(scenarios), help='comma-separated scenarios: ' + ', '.join(scenarios))
+    parser.add_argument('--llm', type=float, default=0.3, help='seconds to the first completion token')
+    parser.add_argument('--token', type=float, default=0.002, help='seconds between streamed tokens')
+    parser.add_argument('--embed', type=float, default=0.1, help='seconds per embedding request')
+    parser.add_argument('--index', type=float, default=0.05, help='seconds per vector index request')
+    parser.add_argument('--browser', type=float, default=0.5, help='seconds per search page load')
+    parser.add_argument('--google', type=float, default=0.15, help='seconds per Google API request')
+    parser.add_argument('--jitter', type=float, default=0.2, help='jitter as a fraction of each latency')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-stream', action='store_true', help='use non-streamed completions')
+    parser.add_argument('--json', default=None, help='also write the results to this file')
+    parser.add_argument('--keep', action='store_true', help='keep the benchmark directory')
+    args = parser.parse_args()
+    args.scenarios = args.scenarios.split(',')
+
+    # email confirmations are answered automatically
+    builtins.input = lambda prompt='': 'Y'
+
+    cwd = os.getcwd()
+    root = tempfile.mkdtemp(prefix='chatbench')
+    results = []
+    try:
+        chat = loadChat(root, args)
+        for size in [int(s) for s in args.sizes.split(',')]:
+            runSize(chat, size, args, results)
+            os.chdir(root)
+    finally:
+        os.chdir(cwd)
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,202 @@
+""" Headless browser pool for the search AEI
+Keeps warm headless Chrome sessions between searches instead of launching a
+new browser per call. Sessions are health-checked when taken from the pool and
+recycled after maxUses searches or on any WebDriver error, and up to size
+searches can run in parallel. Page text is extracted with a single script
+execution, truncated in the browser, rather than one WebDriver round trip
+per element. Selenium itself is only imported when the first browser starts."""
+
+import threading
+from collections import deque
+from contextlib import contextmanager
+from types import SimpleNamespace
+from urllib.parse import quote_plus
+
+import plugins
+
+
+def loadSelenium():
+    # returns: namespace of the selenium parts the pool and searches use
+
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.common.by import By
+    return SimpleNamespace(webdriver=webdriver, Options=Options, WebDriverWait=WebDriverWait, EC=EC, By=By)
+
+
+plugins.register('selenium', loadSelenium)
+selenium = plugins.Lazy('selenium')
+
+
+def startBrowser():
+    # start a headless chrome browser
+    # returns: selenium driver
+
+    chromeOptions = selenium.Options()
+    chromeOptions.add_argument("--headless")
+    return selenium.webdriver.Chrome(options=chromeOptions)
+
+
+class BrowserPool:
+    # reusable, bounded pool of browser sessions, safe to share between threads
+    # takes: max concurrent sessions, searches before a session is recycled, function starting a new session
+
+    def __init__(self, size=2, maxUses=50, factory=startBrowser):
+        self.size = size
+        self.maxUses = maxUses
+        self.factory = factory
+        self.cond = threading.Condition()
+        self.idle = deque()
+        self.uses = {}
+        self.live = 0 # sessions idle, in use or starting
+        self.starting = 0
+        self.closed = False
+
+    @contextmanager
+    def acquire(self):
+        # borrow a healthy session, waiting if all size sessions are busy. a session that raises is discarded
+        # returns: context manager yielding a selenium driver
+
+        driver = self._take()
+        broken = False
+        try:
+            yield driver
+        except Exception:
+            broken = True
+            raise
+        finally:
+            self._release(driver, broken)
+
+    def prewarm(self, count=1):
+        # start sessions in the background until count are idle or starting, within the pool size
+
+        with self.cond:
+            missing = min(count - len(self.idle) - self.starting, self.size - self.live)
+            if self.closed or missing <= 0:
+                return
+            self.live += missing
+            self.starting += missing
+        for _ in range(missing):
+            threading.Thread(target=self._startIdle, daemon=True).start()
+
+    def _startIdle(self):
+        try:
+            driver = self.factory()
+        except Exception:
+            driver = None
+        with self.cond:
+            self.starting -= 1
+            if driver is None:
+                self.live -= 1
+            else:
+                self.uses[driver] = 0
+                self.idle.append(driver)
+            self.cond.notify_all()
+
+    def _take(self):
+        while True:
+            with self.cond:
+                # prefer an idle session, then one that is already starting, then a new one if the pool has room
+                while not self.idle and (self.starting or self.live >= self.size):
+                    self.cond.wait()
+                if self.idle:
+                    driver = self.idle.pop()
+                else:
+                    self.live += 1
+                    driver = None
+            if driver is None:
+                try:
+                    driver = self.factory()
+                except Exception:
+                    with self.cond:
+                        self.live -= 1
+                        self.cond.notify_all()
+                    raise
+                self.uses[driver] = 0
+                return driver
+            if self._healthy(driver):
+                return driver
+            self._discard(driver)
+
+    def _healthy(self, driver):
+        try:
+            driver.title
+            return True
+        except Exception:
+            return False
+
+    def _release(self, driver, broken):
+        self.uses[driver] = self.uses.get(driver, 0) + 1
+        if broken or self.closed or self.uses[driver] >= self.maxUses:
+            self._discard(driver)
+        else:
+            with self.cond:
+                self.idle.append(driver)
+                self.cond.notify_all()
+
+    def _discard(self, driver):
+        self.uses.pop(driver, None)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        with self.cond:
+            self.live -= 1
+            self.cond.notify_all()
+
+    def close(self):
+        # quit all idle sessions. sessions in use are quit when released
+
+        with self.cond:
+            self.closed = True
+            idle, self.idle = list(self.idle), deque()
+        for driver in idle:
+            self._discard(driver)
+
+
+# visible text of an element, cut to a max length before it leaves the browser
+_textScript = 'return arguments[0].innerText.slice(0, arguments[1]);'
+
+# title, link and snippet of each organic result, falling back to the visible text when none are found
+_resultsScript = """
+const root = arguments[0], limit = arguments[1];
+const out = [];
+for (const h of root.querySelectorAll('a h3')) {
+    const a = h.closest('a');
+    const block = a.closest('div.g, div[data-hveid]');
+    const s = block && block.querySelector('[data-sncf], .VwiC3b, [style*="-webkit-line-clamp"]');
+    out.push(h.innerText + '\\n' + a.href + (s ? '\\n' + s.innerText : ''));
+}
+return (out.length ? out.join('\\n\\n') : root.innerText).slice(0, limit);
+"""
+
+
+def extractText(element, limit):
+    # visible text of element and its children in one WebDriver round trip
+    # takes: selenium element, max characters
+    # returns: string
+
+    return element.parent.execute_script(_textScript, element, limit).strip()
+
+
+def extractResults(element, limit):
+    # result titles, links and snippets under element in one WebDriver round trip
+    # takes: selenium element, max characters
+    # returns: string with one blank-line-separated block per result
+
+    return element.parent.execute_script(_resultsScript, element, limit).strip()
+
+
+def googleSearch(pool, query, limit, structured=False, timeout=10):
+    # load the Google results page for query in a pooled session and extract its text
+    # takes: BrowserPool, query string, max characters to extract, whether to extract structured results
+    #        instead of the visible page text, seconds to wait for results
+    # returns: string
+
+    with pool.acquire() as driver:
+        driver.get('https://www.google.com/search?q=' + quote_plus(query))
+        # wait for the results container itself instead of sleeping a fixed time
+        container = selenium.WebDriverWait(driver, timeout).until(selenium.EC.presence_of_element_located((selenium.By.ID, 'rcnt')))
+        return (extractResults if structured else extractText)(container, limit)
@@ -0,0 +1,172 @@
+""" Local Google Calendar event cache
+Mirrors the primary calendar into SQLite and keeps it current with Calendar
+API incremental sync tokens, so calendar views are answered locally after a
+cheap delta call (skipped entirely within minInterval of the last sync).
+Created and deleted events are applied to the cache immediately. All-day
+events are placed in the calendar's own time zone, which every sync response
+carries, so they cover the same hours as in events().list results."""
+
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from sqlite3 import connect
+from zoneinfo import ZoneInfo
+
+import plugins
+
+
+def zone(name):
+    # returns: tzinfo of an IANA time zone name, e.g. 'America/Los_Angeles', or UTC if it is missing or unknown
+
+    if name:
+        try:
+            return ZoneInfo(name)
+        except (ValueError, LookupError):
+            pass
+    return timezone.utc
+
+
+def toTimestamp(value, timeZone=None):
+    # parse an RFC3339 dateTime or an all-day date to a unix timestamp. all-day dates (and times without an offset)
+    # are read in the calendar's time zone, so an all-day event starts at its local midnight
+    # takes: string, IANA time zone name of the calendar (None: UTC)
+    # returns: float, or None if the string cannot be parsed
+
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=zone(timeZone))
+    return parsed.timestamp()
+
+
+class CalendarCache:
+    # SQLite mirror of one calendar, safe to share between threads
+    # takes: function returning a Calendar API service, path to sqlite db, calendar id, min seconds between delta syncs
+
+    def __init__(self, getService, path='chat.db', calendarId='primary', minInterval=30.0):
+        self.getService = getService
+        self.calendarId = calendarId
+        self.minInterval = minInterval
+        self.lastSync = 0.0
+        self.lock = threading.RLock()
+        # the calendar's time zone, from the last sync
+        self.timeZone = None
+
+        self.conn = connect(path, check_same_thread=False)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS CalendarEvent (
+                id TEXT PRIMARY KEY,
+                calendarId TEXT,
+                summary TEXT,
+                start TEXT,
+                startTs REAL,
+                endTs REAL,
+                event TEXT
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS CalendarEventStart ON CalendarEvent (calendarId, startTs)')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS CalendarSync (
+                calendarId TEXT PRIMARY KEY,
+                syncToken TEXT,
+                synced REAL,
+                timeZone TEXT
+            )
+        ''')
+        if 'timeZone' not in [c[1] for c in self.conn.execute('PRAGMA table_info(CalendarSync)')]:
+            self.conn.execute('ALTER TABLE CalendarSync ADD COLUMN timeZone TEXT')
+        row = self.conn.execute('SELECT timeZone FROM CalendarSync WHERE calendarId = ?', (calendarId,)).fetchone()
+        if row:
+            self.timeZone = row[0]
+        self.conn.commit()
+
+    def put(self, event):
+        # add or update one event from an API response. cancelled events are removed
+
+        with self.lock:
+            self._apply([event])
+            self.conn.commit()
+
+    def remove(self, eventId):
+        with self.lock:
+            self.conn.execute('DELETE FROM CalendarEvent WHERE id = ? AND calendarId = ?', (eventId, self.calendarId))
+            self.conn.commit()
+
+    def _apply(self, events):
+        for event in events:
+            if event.get('status') == 'cancelled':
+                self.conn.execute('DELETE FROM CalendarEvent WHERE id = ? AND calendarId = ?', (event['id'], self.calendarId))
+                continue
+            start = event.get('start', {})
+            end = event.get('end', {})
+            startText = start.get('dateTime', start.get('date'))
+            self.conn.execute('INSERT OR REPLACE INTO CalendarEvent (id, calendarId, summary, start, startTs, endTs, event) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                              (event['id'], self.calendarId, event.get('summary', ''), startText, toTimestamp(startText, self.timeZone),
+                               toTimestamp(end.get('dateTime', end.get('date')), self.timeZone), json.dumps(event)))
+
+    def _setTimeZone(self, timeZone):
+        # use the calendar's time zone from a sync response, re-placing cached all-day events if it changed
+
+        if not timeZone or timeZone == self.timeZone:
+            return
+        self.timeZone = timeZone
+        rows = self.conn.execute("SELECT event FROM CalendarEvent WHERE calendarId = ? AND start NOT LIKE '%T%'", (self.calendarId,)).fetchall()
+        self._apply([json.loads(r[0]) for r in rows])
+
+    def sync(self, force=False):
+        # bring the cache up to date: a delta call with the stored sync token, or a full sync without one
+        # (or when Google expires the token). skipped within minInterval seconds of the last sync unless forced
+
+        with self.lock:
+            if not force and time.time() - self.lastSync < self.minInterval:
+                return
+            row = self.conn.execute('SELECT syncToken FROM CalendarSync WHERE calendarId = ?', (self.calendarId,)).fetchone()
+            token = row[0] if row else None
+            try:
+                self._sync(token)
+            except plugins.load('google').HttpError as error:
+                if error.resp.status != 410 or token is None:
+                    raise
+                # sync token expired: start over with a full sync
+                self.conn.execute('DELETE FROM CalendarEvent WHERE calendarId = ?', (self.calendarId,))
+                self._sync(None)
+            self.lastSync = time.time()
+
+    def _sync(self, token):
+        service = self.getService()
+        pageToken = None
+        while True:
+            if token:
+                request = service.events().list(calendarId=self.calendarId, syncToken=token, singleEvents=True, pageToken=pageToken, showDeleted=True)
+            else:
+                request = service.events().list(calendarId=self.calendarId, singleEvents=True, maxResults=2500, pageToken=pageToken)
+            page = request.execute()
+            self._setTimeZone(page.get('timeZone'))
+            self._apply(page.get('items', []))
+            pageToken = page.get('nextPageToken')
+            if not pageToken:
+                break
+        self.conn.execute('INSERT OR REPLACE INTO CalendarSync (calendarId, syncToken, synced, timeZone) VALUES (?, ?, ?, ?)',
+                          (self.calendarId, page.get('nextSyncToken'), time.time(), self.timeZone))
+        self.conn.commit()
+
+    def view(self, start, end=None, maxResults=10):
+        # events overlapping [start, end), ordered by start time, like events().list with timeMin/timeMax
+        # takes: RFC3339 start or None, RFC3339 end or None, max number of events
+        # returns: list of event dicts, or None if start/end cannot be parsed (use the API directly then)
+
+        if (start and toTimestamp(start) is None) or (end and toTimestamp(end) is None):
+            return None
+        self.sync()
+        # times without an offset are read in the calendar's time zone, known after the sync
+        startTs = toTimestamp(start, self.timeZone) if start else float('-inf')
+        endTs = toTimestamp(end, self.timeZone) if end else float('inf')
+        with self.lock:
+            rows = self.conn.execute('SELECT event FROM CalendarEvent WHERE calendarId = ? AND startTs < ? AND COALESCE(endTs, startTs) > ? ORDER BY startTs LIMIT ?',
+                                     (self.calendarId, endTs, startTs, maxResults)).fetchall()
+        return [json.loads(r[0]) for r in rows]
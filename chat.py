@@ -7,35 +7,47 @@
 # idea: try including some recent messages in vector search to handle follow up questions that require context
 
 # Get the agent extension interfaces
-from aei import *
+from aei import aeiCommands, sendMail, calendar, loadInbox, wtxt, rtxt
 
+import ast
 import os
 from typing import List, Tuple
 from datetime import datetime
 import pickle
 import json
-import pinecone
+import sys
 import time
 from uuid import uuid4
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+import threading
 
 from sqlite3 import connect
 
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.by import By
-
-import openai
+from store import ChatStore
+from retrieval import retrieve
+from prompt import PromptBuilder, TurnContext, countTokens
+from pipeline import TurnPipeline, REQUIRED
+from upsertqueue import UpsertQueue
+from embedcache import EmbeddingCache
+from completioncache import CompletionCache
+from tracing import Tracer
+from compaction import ConversationCompactor, MemoryCompactor
+
+from browser import BrowserPool, googleSearch, startBrowser
+from searchcache import SearchCache
+from dispatch import AeiRegistry, commandName
+import plugins
 
 # make sure to set your API keys
 pinecone_key = 'YOUR PINECONE API KEY'
-openai.api_key = "YOUR OPENAI API KEY"
+openai_key = "YOUR OPENAI API KEY"
 
 # GPT API args
 model='gpt-4' # 'gpt-3.5-turbo' also works
 max_tokens=512
+stream=True # print responses token by token as they are generated
 temperature=0.0
 top_p=1.0
 freq_p=0.0
@@ -44,25 +56,134 @@ pres_p=0.0
 # Pinecone vector query limit
 top_k = 20
 
+# LTM retrieval: 'vector', 'hybrid' (vector + full-text, rank-fused) or 'lexical' (full-text only, no API calls)
+retrievalMode = 'hybrid'
+# seconds hybrid retrieval waits for embedding + vector query before answering from full-text results alone
+vectorTimeout = 2.0
+
+# per-stage deadlines in seconds for the concurrent turn pipeline. if memory retrieval (embedding, vector
+# query and LTM lookup) misses its deadline the turn is completed without memories
+stageTimeouts = {'memory': 4.0}
+
+# vector index backend: 'pinecone', or 'local' for the in-process index stored in localIndexPath
+vectorBackend = 'pinecone'
+pineconeIndex = 'chat-test-1'
+localIndexPath = 'vectors'
+# local index first-pass storage: 'none' (float32), 'float16' or 'int8'. quantized searches re-rank exactly against float32
+localIndexQuantize = 'none'
+
+# embedding model, and the on-disk cache in front of it (max number of cached vectors)
+embedModel = 'text-embedding-ada-002'
+embedCachePath = 'embeddings.db'
+embedCacheSize = 100000
+
+# write-behind upsert queue: messages per embedding/upsert batch, and max seconds a partial batch waits
+upsertBatch = 16
+upsertInterval = 10.0
+
+# warm headless browser sessions kept for the search AEI, and searches before a session is restarted
+browserPoolSize = 2
+browserMaxUses = 50
+
 # how many characters to read from Google results page when search AEI is called
 searchLength = 1000
+# read result titles, links and snippets instead of the visible page text
+searchStructured = False
+
+# search result cache: seconds results stay fresh, whether to serve expired results while refreshing them, max entries
+searchCacheTtl = 6*3600
+searchServeStale = True
+searchCacheSize = 1000
+
+# max AEI calls from one response that run at the same time, and threads of the AEI pool every session of a
+# process shares (the server sizes it from its number of turn workers)
+aeiWorkers = 4
+aeiThreads = 4
+
+# threads shared by every session of a process for turn stages (storing, retrieval), and for vector searches
+stageWorkers = 16
+
+# max messages a session keeps in memory (None: no bound). older messages stay in chat.db and the vector index,
+# where retrieval can find them again
+sessionMaxMessages = None
+
+# rolling summarization. once a session's conversation passes compactAt tokens, all but its newest compactKeep
+# messages are folded into one summary message in the background (compactAt None: off, e.g. 3000 to turn it on).
+# each summary is a paid completion call
+compactAt = None
+compactKeep = 8
+# summaries of finished days of chat.db, per topic (split at pauses of topicGap seconds) and per day, made every
+# memoryCompactInterval seconds (None: off, e.g. 3600 to turn it on). each summary is a paid completion call, and
+# the first run summarizes up to a week of past days. retrieved summaries are preferred to the messages they cover
+memoryCompactInterval = None
+topicGap = 1800
+# model and max response tokens of summaries
+summaryModel = 'gpt-3.5-turbo'
+summaryTokens = 256
+
+# opt-in cache of temperature 0 completions: on/off, seconds entries stay valid, max entries, and the min cosine
+# similarity at which a near-duplicate newest user message reuses a cached response (None: exact prompts only)
+completionCacheOn = False
+completionCacheTtl = 24*3600
+completionCacheSize = 1000
+completionCacheSimilarity = None
+
+# per-turn tracing of stage timings, token usage, retrieval counts and cache counters, summarized by /stats/.
+# each turn is appended as a JSON line to tracePath and the session totals rewritten in OpenMetrics text format
+# to metricsPath (None for either: keep them in memory only)
+traceOn = True
+tracePath = None
+metricsPath = None
+
+# the OpenAI client and the Pinecone index (and, in browser.py and aei.py, Selenium and the Google API client) are
+# plugins, imported on first use instead of at startup. see plugins.py
+def loadOpenai():
+    import openai
+    openai.api_key = openai_key
+    return openai
+
+def loadPinecone():
+    import pinecone
+    pinecone.init(api_key=pinecone_key, environment='us-west1-gcp-free')
+    return pinecone
+
+plugins.register('openai', loadOpenai)
+plugins.register('pinecone', loadPinecone)
+openai = plugins.Lazy('openai')
+
+@lru_cache(maxsize=None)
+def readAlignmentPrompt(path='alignmentPrompt.txt'):
+    # read the alignment prompt file, a list of message dicts, once per path. it is parsed as a literal, so the
+    # file cannot run code
+    # takes: path
+    # returns: list of message dicts
+
+    with open(path, 'r') as f:
+        return ast.literal_eval(f.read())
+
+alignmentPrompt = readAlignmentPrompt()
+
+# added to the alignment prompt of sessions of users other than the owner of the install, whose Google account and
+# files the other AEIs act on
+guestPrompt = [{'role':'system', 'content':'In this session only the GOOGSEARCH command is available. The INBOX, CALENDAR, SENDMAIL, WTEXT and RTEXT commands are not available to this user, so do not call them, and tell the user if they ask for them.'}]
 
-with open('alignmentPrompt.txt', 'r') as f:
-    # read the alignment prompt file
+embedCache = EmbeddingCache(embedCachePath, maxEntries=embedCacheSize)
 
-    alignmentPrompt = eval(f.read())
+# long-lived connection to the LTM database
+chatStore = ChatStore('chat.db')
 
-def getElementText(element):
-    # recursively extracts all text content from an HTML element and its children
-    # takes: selenium driver element
-    # returns: string
+# cached deterministic completions. the semantic tier embeds the newest user message through the embedding cache
+completionCache = None
+if completionCacheOn:
+    completionCache = CompletionCache('chat.db', ttl=completionCacheTtl, maxEntries=completionCacheSize,
+                                      embed=(lambda text: embedAda(text)) if completionCacheSimilarity is not None else None,
+                                      threshold=completionCacheSimilarity or 1.0)
 
-    text = element.text.strip()
-    for child in element.find_elements('xpath','./*'):
-        text += '\n' + getElementText(child).strip()
-        if len(text) >= searchLength:
-            return text[:searchLength+1]
-    return text[:searchLength+1]
+# counters whose change over each turn is traced. these are plain attributes, so reading them costs no queries
+traceCounters = {'embedCache': lambda: {'hits': embedCache.hits, 'misses': embedCache.misses}}
+if completionCache is not None:
+    traceCounters['completionCache'] = lambda: completionCache.counts
+tracer = Tracer(traceOn, path=tracePath, metricsPath=metricsPath, counters=traceCounters)
 
 def chatComplete(messages, model=model, max_tokens=max_tokens, temperature=temperature, top_p=top_p, freq_p=freq_p, pres_p=pres_p):
     # call openAI API and generate response
@@ -80,17 +201,166 @@ def chatComplete(messages, model=model, max_tokens=max_tokens, temperature=tempe
     )
     return response
 
+def chatStream(messages, model=model, max_tokens=max_tokens, temperature=temperature, top_p=top_p, freq_p=freq_p, pres_p=pres_p):
+    # call openAI API and stream the response as it is generated
+    # takes: list of message dicts, string, int, float, float, float, float, float
+    # returns: generator of response text fragments
+
+    response = openai.ChatCompletion.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        top_p=top_p,
+        frequency_penalty=freq_p,
+        presence_penalty=pres_p,
+        stream=True
+    )
+    for chunk in response:
+        content = chunk['choices'][0]['delta'].get('content')
+        if content:
+            yield content
+
+def streamResponse(fragments, onAei=None, out=None):
+    # print a streamed response as it arrives. AEI calls are not printed; their name is reported
+    # to onAei as soon as it is complete, so tool setup can start before the stream ends
+    # takes: iterable of text fragments, callback taking an AEI name such as '/;GOOGSEARCH', output stream
+    # returns: full response text, whether it was printed
+
+    out = out or sys.stdout
+    parts = []
+    text = ''
+    shown = False
+    aei = None
+    for piece in fragments:
+        parts.append(piece)
+        if shown:
+            out.write(piece)
+            out.flush()
+            continue
+        text += piece
+        if aei is not None:
+            continue
+        if text.startswith('/;'):
+            # AEI call: wait for the name to close, then report it
+            end = text.find(';/')
+            if end != -1:
+                aei = text[:end]
+                if onAei:
+                    onAei(aei)
+        elif not '/;'.startswith(text):
+            # not an AEI call, so show what has arrived and stream the rest
+            out.write('\nASSISTANT: ' + text)
+            out.flush()
+            shown = True
+    if shown:
+        out.write('\n')
+        out.flush()
+    return ''.join(parts), shown
+
+def respond(messages, onAei=None, cache=True, traceAs='complete', trace=None, out=None, owner='', **kwargs):
+    # create a chat completion, streamed to the terminal when stream is set. with the completion cache on,
+    # temperature 0 completions are served from and stored to it, except AEI calls and completions with cache=False
+    # takes: list of message dicts, AEI callback for streamResponse, whether the cache may be used, trace span name,
+    #        Tracer of the session (None: the process's), output stream for streamResponse, user the completion is
+    #        for, chatComplete args
+    # returns: response text, whether it was already printed
+
+    trace = trace or tracer
+    params = dict(model=model, max_tokens=max_tokens, temperature=temperature, top_p=top_p, freq_p=freq_p, pres_p=pres_p)
+    params.update(kwargs)
+    # responses draw on the user's memories, so each user only gets their own cached responses
+    if owner:
+        params['owner'] = owner
+    cacheable = completionCache is not None and params['temperature'] == 0
+    if cacheable and not cache:
+        completionCache.bypass()
+        trace.count('completionCache.bypassed')
+        cacheable = False
+    if cacheable:
+        # the cache's own counters cover every session, these count this session's lookups
+        start = time.perf_counter()
+        cached, vector = completionCache.lookup(messages, params)
+        if cached is not None:
+            trace.record(traceAs, start, model=params['model'], stream=stream, cached=True)
+            trace.count('completionCache.hits')
+            return cached, False
+        trace.count('completionCache.misses')
+
+    start = time.perf_counter()
+    with trace.span(traceAs, model=params['model'], stream=stream, cached=False):
+        if stream:
+            fragments = trace.firstItem(traceAs + '.firstToken', chatStream(messages, **kwargs))
+            text, shown = streamResponse(fragments, onAei=onAei, out=out)
+            if trace.enabled:
+                # streamed responses carry no usage, so count it the way prompts are packed
+                trace.usage({'prompt_tokens': sum(countTokens(m, params['model']) for m in messages),
+                              'completion_tokens': countTokens({'role':'assistant', 'content':text}, params['model'])}, estimated=True)
+        else:
+            chatResponse = chatComplete(messages, **kwargs)
+            text, shown = chatResponse.choices[0].message.content, False
+            trace.usage(getattr(chatResponse, 'usage', None))
+
+    # an AEI call is not cached, so its tools run again with fresh results
+    if cacheable and commandName(text) not in aeiCommands:
+        completionCache.store(messages, params, text, time.perf_counter() - start, vector)
+    return text, shown
+
+def summarize(instruction, text, model=summaryModel, max_tokens=summaryTokens):
+    # summarize text with a non-streamed completion
+    # takes: instruction saying what to keep, text, model name, max summary tokens
+    # returns: summary text
+
+    response = chatComplete([{'role':'system', 'content':instruction}, {'role':'user', 'content':text}], model=model, max_tokens=max_tokens, temperature=0.0)
+    tracer.usage(getattr(response, 'usage', None))
+    return response.choices[0].message.content.strip()
+
 def embedAda(text):
     # generate text embedding
     # takes: string
     # returns: embedding vector with 1536 dimensions
 
+    # repeated text is served from the embedding cache without an API call
+    vector = embedCache.get(text, embedModel)
+    if vector is not None:
+        return vector
+
     text = text.encode(encoding='ASCII', errors='ignore').decode()
-    response = openai.Embedding.create(input=text, engine='text-embedding-ada-002')
+    response = openai.Embedding.create(input=text, engine=embedModel)
     # create vector list
     vector = response['data'][0]['embedding']
+    embedCache.put(text, vector, embedModel)
     return vector
 
+def embedAdaBatch(texts):
+    # generate text embeddings for several strings in one request
+    # takes: list of strings
+    # returns: list of embedding vectors with 1536 dimensions, in input order
+
+    texts = [text.encode(encoding='ASCII', errors='ignore').decode() for text in texts]
+    vectors = embedCache.getMany(texts, embedModel)
+
+    # only request embeddings for texts the cache missed, each distinct text once
+    missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+    if missing:
+        response = openai.Embedding.create(input=missing, engine=embedModel)
+        data = sorted(response['data'], key=lambda d: d['index'])
+        fetched = [d['embedding'] for d in data]
+        embedCache.putMany(missing, fetched, embedModel)
+        fetched = dict(zip(missing, fetched))
+        vectors = [v if v is not None else fetched[t] for t, v in zip(texts, vectors)]
+    return vectors
+
+def openIndex(backend, name=pineconeIndex):
+    # open the configured vector index. both backends share the upsert/query/delete surface
+    # takes: 'pinecone' or 'local', Pinecone index name
+    # returns: index object
+
+    if backend == 'local':
+        from localindex import LocalIndex
+        return LocalIndex(localIndexPath, quantize=localIndexQuantize)
+    return plugins.load('pinecone').Index(name)
+
 def getRecentChat():
     # not implemented or used. ignore
 
@@ -98,20 +368,34 @@ def getRecentChat():
     cur = conn.cursor()
     cur.execute('')
 
-def loadRes(results):
+def loadRes(results, exclude=(), maxTokens=None, model=model, trace=None, owner=''):
     # load indexed chats from LTM database based on Pinecone vector query
-    # takes: results list from Pinecone vector query
+    # takes: results list from Pinecone vector query, collection of IDs to skip (e.g. messages from the current session),
+    #        token budget for the retrieved messages (None for no limit), model whose tokenizer to count with,
+    #        Tracer of the session (None: the process's), user whose messages may be loaded
     # returns: list containing a conversation snippet with any relevant results and some guiding system messages
 
-    conn = connect('chat.db')
-    cur = conn.cursor()
-    out = []
-    for match in results['matches']:
-        # print(match['id'])
-        cur.execute('SELECT * FROM ChatHistory WHERE id = ?', (match['id'],))
-        msg = cur.fetchone()
-        if msg:
-            out.append(msg)
+    trace = trace or tracer
+    exclude = set(exclude)
+    # one primary key lookup for all matches, returned in match score order
+    with trace.span('loadRes'):
+        out = chatStore.fetch([match['id'] for match in results['matches'] if match['id'] not in exclude], owner=owner)
+        # summaries come first, and messages (or topic summaries) covered by a retrieved summary are left out
+        if any(m[2] == 'SUMMARY' for m in out):
+            covered = chatStore.summaryOf([m[0] for m in out])
+            found = {m[0] for m in out}
+            out = [m for m in out if m[2] == 'SUMMARY' and covered.get(m[0]) not in found] + \
+                  [m for m in out if m[2] != 'SUMMARY' and covered.get(m[0]) not in found]
+
+    if maxTokens is not None:
+        # keep the best matches that fit the budget
+        used = 0
+        for i, m in enumerate(out):
+            used += countTokens({'role':'system', 'content':m[1]}, model)
+            if used > maxTokens:
+                out = out[:i]
+                break
+    trace.count('retrieval.loaded', len(out))
 
     if out:
         # for m in out:
@@ -123,38 +407,6 @@ def loadRes(results):
     else:
         return [{'role':'system', 'content': 'REMEMBER NOT TO INCLUDE "ASSISTANT" OR THE TIMESTAMP AT THE BEGINNING OF YOUR RESPONSE. ONLY INCLUDE YOUR ACTUAL RESPONSE!!!\n\n'}]
 
-def calParse(text):
-    # parse calendar AEI commands
-    # takes: string formatted as a calendar AEI command beginning with an action
-    # returns: a dict of args:values extracted from AEI command
-
-    print('\n',text)
-    code = text
-    parsed = {'action':None, 'start':None, 'end':None, 'max':10, 'loc':None, 'name':'Autogenerated Event', 'description':'This even was autogenerated by AI.', 'eventid': None}
-    parsing = True
-
-    actionSplit = code.split('/;', maxsplit=1)[-1].split(';/', maxsplit=1)
-    parsed['action'] = actionSplit[0].lower()
-
-    code = actionSplit[-1].split('/;', maxsplit=1)[-1]
-
-    while parsing:
-
-        firstSplit = code.split(';/', maxsplit=1)
-        if len(firstSplit) == 1:
-            parsing = False
-            break
-
-        first = firstSplit[0].lower()
-        secondSplit = firstSplit[-1].split('/;', maxsplit=1)
-        second = secondSplit[0]
-        parsed[str(first)]=str(second)
-
-        code = secondSplit[-1]
-
-    print('\nParsed calendar command: ',parsed)
-    return parsed
-
 def makePostPrompt():
     # make a snippet for the end of the completion prompt that contains an assistant 
     # message with a speaker and  dummy timestamp tag, so that the LLM 'believes' it has
@@ -168,16 +420,354 @@ def makePostPrompt():
     return postPrompt
 
 
+class Backends:
+    # clients every session of a process shares: the vector index, the write-behind upsert queue, the browser pool
+    # for the search AEI, the search cache and the worker pools. the chat store and the embedding and completion
+    # caches are module-level, and OpenAI and Google connections are kept per worker thread. sessions share the
+    # clients, not their data: each one only reads and writes its owner's rows and index namespace
+    # takes: vector index (None: the one configured at the top of chat.py, opened on first use), function starting a
+    #        browser session, function reporting notices that belong to no one session, such as a failed day summary
+    #        (None: print), threads of the shared AEI pool (each session runs at most aeiWorkers calls on it at once)
+
+    def __init__(self, vecdb=None, browserFactory=startBrowser, show=None, aeiThreads=aeiThreads):
+        self.vecdb = vecdb if vecdb is not None else plugins.Lazy(lambda: openIndex(vectorBackend))
+
+        # start write-behind upserts. resumes anything an interrupted session left in the journal
+        self.upserts = UpsertQueue(embedAdaBatch, self.vecdb, batchSize=upsertBatch, interval=upsertInterval)
+        self.upserts.start()
+
+        # browsers for the search AEI are started on first use and reused across searches
+        self.browserPool = BrowserPool(size=browserPoolSize, maxUses=browserMaxUses, factory=browserFactory)
+        self.searchCache = SearchCache('chat.db', ttl=searchCacheTtl, serveStale=searchServeStale, maxEntries=searchCacheSize)
+        tracer.counters['searchCache'] = lambda: self.searchCache.counts
+
+        self.stageExecutor = ThreadPoolExecutor(max_workers=stageWorkers, thread_name_prefix='stage')
+        self.retrievalExecutor = ThreadPoolExecutor(max_workers=stageWorkers, thread_name_prefix='retrieval')
+        self.aeiExecutor = ThreadPoolExecutor(max_workers=aeiThreads, thread_name_prefix='aei')
+
+        # summarizes finished days of chat history in the background; summaries are upserted like messages
+        self.memoryCompactor = None
+        if memoryCompactInterval is not None:
+            self.memoryCompactor = MemoryCompactor(chatStore, tracer.wrap('compact.memory', summarize), self.upserts.put,
+                                                   interval=memoryCompactInterval, topicGap=topicGap, model=summaryModel, show=show)
+            self.memoryCompactor.start()
+
+    def prewarm(self):
+        # load the OpenAI client and open the vector index in the background, e.g. while the user types the first
+        # message, so the first turn does not wait for them
+
+        def warm():
+            try:
+                plugins.load('openai')
+                plugins.resolve(self.vecdb)
+            except Exception:
+                # not shown over the prompt. loading is tried again, and fails visibly, in the first turn
+                pass
+        threading.Thread(target=warm, name='prewarm', daemon=True).start()
+
+    def close(self, flush=True):
+        # stop the upsert queue, flushing it first unless flush is False, and release the browsers and threads
+
+        if self.memoryCompactor is not None:
+            self.memoryCompactor.stop()
+        self.upserts.stop(flush=flush)
+        self.browserPool.close()
+        for executor in (self.stageExecutor, self.retrievalExecutor, self.aeiExecutor):
+            executor.shutdown(wait=False)
+
+class ChatSession:
+    # one user's conversation: its messages, generation settings, AEI handlers and the logic of a turn.
+    # sessions share the process's Backends, so one process can host many of them
+    # takes: Backends, session id (None for a new one), stream responses and AEI notices are written to (None: stdout),
+    #        function asking the user a yes/no question (None: decline, e.g. sending mail), max messages kept in
+    #        memory (None: no bound), user whose memories the session reads and writes ('': the owner of the install,
+    #        the only user the mail, calendar and file AEIs act for), overrides of the generation settings at the top
+    #        of chat.py (see settings)
+
+    settings = ('model', 'max_tokens', 'temperature', 'top_p', 'freq_p', 'pres_p', 'top_k', 'searchLength')
+
+    def __init__(self, backends, sessionId=None, out=None, confirm=None, maxMessages=sessionMaxMessages, owner='', **settings):
+        unknown = set(settings) - set(self.settings)
+        if unknown:
+            raise TypeError('unknown session settings: ' + ', '.join(sorted(unknown)))
+        defaults = globals()
+        for name in self.settings:
+            setattr(self, name, settings.get(name, defaults[name]))
+
+        self.backends = backends
+        self.id = sessionId or str(uuid4())
+        self.out = out
+        self.confirm = confirm
+        self.maxMessages = maxMessages
+        self.owner = owner
+        self.lastUsed = time.time()
+
+        # initialize conversation lists
+        self.ids = [] # stores chat/vector IDs
+        self.unsaved = [] # IDs added since the last upsert(), which discard() drops
+        self.currentConvo = [] # conversation snippet containing entire session
+        self.currentText = [] # same as currentConvo, but with timestamps removed for embedding
+
+        # packs prompts into the model's token budget, counting each message once
+        self.prompt = PromptBuilder(alignmentPrompt if not owner else alignmentPrompt + guestPrompt)
+
+        # runs the storage write and memory retrieval of each turn concurrently
+        self.turns = TurnPipeline(stageTimeouts, executor=backends.stageExecutor)
+        # what a turn is completed with when retrieval misses its deadline
+        self.noMemory = loadRes({'matches': []}, trace=Tracer(False))
+
+        # this session's turns, also added up in the process's tracer
+        self.tracer = Tracer(traceOn, path=tracePath, counters=tracer.counters, parent=tracer)
+        self.lastTrace = None
+
+        # folds the oldest messages into a summary in the background once the conversation grows past compactAt
+        self.compactor = None
+        if compactAt is not None:
+            self.compactor = ConversationCompactor(self.tracer.wrap('compact', summarize), backends.stageExecutor, threshold=compactAt, keep=compactKeep, show=self.show)
+
+        # each AEI call is traced as a span named after its command, e.g. aei.CALENDAR, which covers its Google API calls
+        self.aeis = AeiRegistry(aeiCommands, workers=aeiWorkers, executor=backends.aeiExecutor, show=self.show)
+        wrap = self.tracer.wrap
+        self.aeis.register('/;GOOGSEARCH;/', wrap('aei.GOOGSEARCH', self.searchAei))
+        # token.json and the files of the host are the install owner's, so other users only get the search AEI
+        if not owner:
+            self.aeis.register('/;SENDMAIL;/', wrap('aei.SENDMAIL', self.sendMailAei), confirm=True)
+            self.aeis.register('/;CALENDAR;/', wrap('aei.CALENDAR', self.calendarAei), remember=True, confirm=lambda args: args['action'] == 'delete')
+            self.aeis.register('/;INBOX;/', wrap('aei.INBOX', self.inboxAei), remember=True)
+            self.aeis.register('/;WTEXT;/', wrap('aei.WTEXT', partial(wtxt, show=self.show)), remember=True)
+            self.aeis.register('/;RTEXT;/', wrap('aei.RTEXT', partial(rtxt, show=self.show))) # file contents are not kept in the conversation
+
+    def show(self, *parts):
+        # print to the session's output stream
+
+        out = self.out or sys.stdout
+        out.write(' '.join(str(p) for p in parts) + '\n')
+        out.flush()
+
+    def ask(self, question):
+        # returns: whether the user confirmed question
+
+        return bool(self.confirm and self.confirm(question))
+
+    def generation(self):
+        # returns: dict of the session's chatComplete args
+
+        return dict(model=self.model, max_tokens=self.max_tokens, temperature=self.temperature, top_p=self.top_p, freq_p=self.freq_p, pres_p=self.pres_p)
+
+    # AEI handlers. each takes the arguments its aeiCommands schema names, and returns the result text for the agent
+    def searchAei(self, query):
+        # agent passes a query string, then reads the first searchLength characters of text ripped from the first page of results
+        self.show('\nASSISTANT Google Searched: '+query)
+
+        # search Google in a warm pooled browser, then find and consolidate page text. repeated queries are served from the cache
+        pool, limit = self.backends.browserPool, self.searchLength
+        pageText = self.backends.searchCache.lookup(query, self.tracer.wrap('search.browser', lambda: googleSearch(pool, query, limit, structured=searchStructured)), variant=f'{limit}:{searchStructured}')
+
+        timestamp = time.time()
+        timestring = str(datetime.fromtimestamp(timestamp))
+        return 'Here is the HTML of the results page of your Google search for "'+query+'"" at '+timestring+'. You can read through it to infer information, then respond to the ChatUser: '+str(pageText)
+
+    def sendMailAei(self, recipient, subject, content):
+        # the email is only sent after the user confirms it, and the agent is not asked for a follow-up
+        self.show('\nDraft email TO ',recipient,', SUBJECT: ', subject, ', CONTENT: ', content)
+        if self.ask('Send this email?'):
+            sendMail(recipient, subject, content, show=self.show)
+
+    def calendarAei(self, **args):
+        self.show('\nParsed calendar command: ',args)
+        return calendar(confirm=self.ask, show=self.show, **args)
+
+    def inboxAei(self, query):
+        # agent passes an optional Gmail search query, and reads a summary of the matching threads
+        return loadInbox(query=query or None, show=self.show)
+
+    def turn(self, userIn):
+        # answer one user message: store it and retrieve memories, complete, run any AEI calls and answer their
+        # results, then store the response. streamed responses and AEI notices are written to the session's output
+        # takes: user message
+        # returns: response text
+
+        self.lastUsed = time.time()
+        self.tracer.startTurn(model=self.model, session=self.id)
+        backends, trace, settings, owner = self.backends, self.tracer, self.generation(), self.owner
+
+        # swap in the summary of the oldest messages, if one finished since the last turn
+        if self.compactor is not None and self.compactor.apply(self.currentConvo):
+            trace.count('compactions')
+
+        # store user input to LTM database
+        timestamp = time.time()
+        timestring = str(datetime.fromtimestamp(timestamp))
+        message = 'USER at '+timestring+': '+userIn
+
+        self.currentConvo.append({'role':'user', 'content':message})
+        self.currentText.append(userIn)
+
+        identifier = str(uuid4())
+        self.ids.append(identifier)
+        self.unsaved.append(identifier)
+
+        def storeUser():
+            chatStore.insert(identifier, message, 'USER', timestamp, timestring, owner)
+            backends.upserts.put(identifier, userIn, owner) # upserted records do not include timestamp and speaker
+
+        # embed recent messages and query Pinecone for relevant LTM data
+        window = '\n\n'.join(self.currentText[-4:])
+        sessionIds = set(self.ids)
+
+        def vectorSearch():
+            with trace.span('embed'):
+                vector = embedAda(window)
+            # loadRes only needs match ids, so do not ship the stored vectors back. this session's messages already
+            # upserted are skipped by retrieve, so ask for enough matches to still have top_k without them. each user's
+            # messages are in their own namespace
+            with trace.span('vector.query'):
+                matches = backends.vecdb.query(vector=vector, top_k=self.top_k + len(sessionIds), include_values=False, include_metadat=True, namespace=owner)['matches']
+            trace.count('retrieval.vector', len(matches))
+            return matches
+
+        def loadMemory():
+            # fuse with full-text matches for the newest message, or fall back to them if the vector search is slow,
+            # then load the matched messages as soon as their ids arrive
+            with trace.span('retrieve', mode=retrievalMode):
+                results = retrieve(chatStore, userIn, vectorSearch, self.top_k, mode=retrievalMode, timeout=vectorTimeout, exclude=sessionIds,
+                                   executor=backends.retrievalExecutor, owner=owner)
+            trace.count('retrieval.matches', len(results['matches']))
+            return loadRes(results, exclude=sessionIds, maxTokens=self.prompt.memoryBudget(self.model, self.max_tokens), model=self.model, trace=trace, owner=owner)
+
+        # the storage write does not block retrieval. without memories in time, complete without them
+        stages = self.turns.run({'store': (trace.wrap('store', storeUser), REQUIRED), 'memory': (trace.wrap('memory', loadMemory), self.noMemory)})
+        memory = stages['memory']
+
+        # create final GPT prompt, packing memories and as many recent messages as fit the model's context window.
+        # completions after AEI calls in this turn reuse its memories and prefix
+        with trace.span('prompt'):
+            turn = TurnContext(self.prompt, memory, model=self.model, max_tokens=self.max_tokens)
+            conversation = turn.build(self.currentConvo, makePostPrompt())
+
+        # start AEI setup early from the streamed response prefix
+        def prewarmAei(name):
+            if name == '/;GOOGSEARCH':
+                backends.browserPool.prewarm()
+
+        # create GPT chat completion
+        responseText, shown = respond(conversation, onAei=prewarmAei, trace=trace, out=self.out, owner=owner, **settings)
+
+        # check for AEI calls in the response: one at its start, and any more each at the start of a line
+        calls, errors = self.aeis.parseAll(responseText)
+        for e in errors:
+            self.show(f'\nError parsing AEI command: {e}')
+
+        # independent AEIs run concurrently, the ones asking for confirmation one at a time
+        if calls:
+            trace.count('aei.calls', len(calls))
+            with trace.span('aei', calls=[call.name for call in calls]):
+                aeiResults = self.aeis.runAll(calls)
+        else:
+            aeiResults = []
+
+        # feed the results back to the agent, kept in the conversation or only shown for this completion
+        extra = []
+        for call, aeiResult in zip(calls, aeiResults):
+            if aeiResult is None:
+                continue
+            if self.aeis.remembers(call.name):
+                self.currentConvo.append({'role':'system', 'content':aeiResult})
+            else:
+                extra.append({'role':'system', 'content':aeiResult})
+
+        if any(aeiResult is not None for aeiResult in aeiResults):
+            conversation = turn.build(self.currentConvo, makePostPrompt(), extra=extra)
+
+            # create one new response to user incorporating all the AEI results. not cached, since tool results change
+            responseText, shown = respond(conversation, cache=False, traceAs='followup', trace=trace, out=self.out, owner=owner, **settings)
+
+        timestamp = time.time()
+        timestring = str(datetime.fromtimestamp(timestamp))
+
+        # create final assistant response from GPT completion by adding speaker and timestamp. This version will be stored in LTM, but such metadata is omitted from the vectorized versions
+        formResponse = 'ASSISTANT at '+timestring+': '+responseText
+
+        # store final assistant response in LTM database
+        self.currentConvo.append({'role':'assistant', 'content':formResponse})
+        self.currentText.append(responseText)
+        identifier = str(uuid4())
+        self.ids.append(identifier)
+        self.unsaved.append(identifier)
+        with trace.span('persist'):
+            chatStore.insert(identifier, formResponse, 'ASSISTANT', timestamp, timestring, owner)
+            backends.upserts.put(identifier, responseText, owner)
+
+        # print assistant response, unless it was streamed as it was generated
+        if not shown:
+            self.show('\nASSISTANT: '+responseText)
+
+        self.trim()
+        if self.compactor is not None:
+            self.compactor.check(self.currentConvo, self.prompt.tokens(self.currentConvo, 0, self.model), self.model)
+        self.lastTrace = trace.endTurn(fellBack=self.turns.fellBack)
+        self.lastUsed = time.time()
+        return responseText
+
+    def trim(self):
+        # drop the oldest messages past maxMessages. they stay in chat.db and the vector index, and since they are
+        # no longer in the prompt, retrieval stops excluding them
+
+        if self.maxMessages is None:
+            return
+        excess = len(self.currentConvo) - self.maxMessages
+        if excess > 0:
+            del self.currentConvo[:excess]
+        excess = len(self.currentText) - self.maxMessages
+        if excess > 0:
+            del self.currentText[:excess]
+            del self.ids[:excess]
+
+    def deleteLast(self):
+        # remove the most recent message from the session, chat.db and the upsert queue
+        # returns: the removed message dict
+
+        self.currentText.pop()
+        identifier = self.ids.pop()
+        if self.unsaved and self.unsaved[-1] == identifier:
+            self.unsaved.pop()
+        self.backends.upserts.discard([identifier], namespace=self.owner)
+        chatStore.delete([identifier])
+        return self.currentConvo.pop()
+
+    def upsert(self):
+        # embed and upsert everything queued now. the session's messages so far are saved, so a later discard()
+        # keeps them
+        # returns: number of messages upserted
+
+        done = self.backends.upserts.flush()
+        self.unsaved = []
+        return done
+
+    def discard(self):
+        # drop the messages added since the last upsert() from the upsert queue, from the vector index if the
+        # worker already upserted them, and from retrieval
+
+        self.backends.upserts.discard(self.unsaved, namespace=self.owner)
+        # they stay in chat.db, but are no longer found by full-text search or summarized
+        chatStore.discard(self.unsaved)
+        self.unsaved = []
+
+    def close(self):
+        # release the session's event loop. its messages stay in chat.db and the upsert queue
+
+        self.turns.close()
+        self.aeis.close()
+
+
 if __name__ == '__main__':
 
-    # start Pinecone service
-    pinecone.init(api_key=pinecone_key, environment='us-west1-gcp-free')
-    vecdb = pinecone.Index('chat-test-1')
+    backends = Backends()
+    atexit.register(backends.browserPool.close)
+    backends.prewarm()
 
-    # initialize conversation lists
-    ids = [] # stores chat/vector IDs
-    currentConvo = [] # conversation snippet containing entire session
-    currentText = [] # same as currentConvo, but with timestamps removed for embedding
+    # the email and calendar AEIs ask before sending mail or deleting events
+    session = ChatSession(backends, confirm=lambda question: input('\n'+question+' Y to confirm, any other input to cancel: ') == 'Y')
 
     while True:
         # main loop
@@ -186,23 +776,19 @@ if __name__ == '__main__':
 
         # check for special instructions from user
         if userIn == '/q/':
-            # upsert current session to Pinecone then quit chat
-            # entire session is upserted only upon nominal exit for efficiency, to avoid recalling recent messages in semantic search, and to enable the current session to be easily discarded unsaved
+            # flush whatever the write-behind queue has not upserted yet, then quit chat
 
             print('\nUpserting current conversation...')
-
-            for i in range(len(ids)):
-                identifier = ids[i]
-                chat = currentText[i] # upserted records do not include timestamp and speaker
-                vector = embedAda(chat)
-                payload = []
-                payload.append((identifier, vector))
-                vecdb.upsert(payload)
+            # stops the day summaries first, so none is queued after the queue has stopped
+            backends.close(flush=True)
             print('\nDone\n')
             exit()
 
         elif userIn == '/qd/':
             if input('\nExit without upserting current session? (y/n) ').lower() == 'y':
+                # drop this session's pending messages and remove any the worker already upserted
+                session.discard()
+                backends.close(flush=False)
                 print('\nExited without upsert.\n')
                 exit()
             else:
@@ -211,8 +797,8 @@ if __name__ == '__main__':
         elif userIn.lower() == '/m/':
             # select GPT model. refer to openAI documentation for acceptable values
 
-            model = input('\nSelect GPT Model: ')
-            print('Done. model = '+str(model))
+            session.model = input('\nSelect GPT Model: ')
+            print('Done. model = '+str(session.model))
 
         elif userIn == '/e/':
             # execute next user input as python
@@ -227,7 +813,7 @@ if __name__ == '__main__':
             # set max GPT response tokens
 
             try:
-                max_tokens = int(input('\nSet max response tokens: '))
+                session.max_tokens = int(input('\nSet max response tokens: '))
                 print('\nDone')
             except:
                 print('\nError: max_tokens must be an int.')
@@ -236,7 +822,7 @@ if __name__ == '__main__':
             # set GPT temperature
 
             try:
-                temperature=float(input('\nSet temperature: '))
+                session.temperature=float(input('\nSet temperature: '))
                 print('\nDone')
             except:
                 print('Error: temperature must be an int.')
@@ -245,7 +831,7 @@ if __name__ == '__main__':
             # set GPT frequency penalty
 
             try:
-                freq_p=float(input('\nSet frequency penalty: '))
+                session.freq_p=float(input('\nSet frequency penalty: '))
                 print('\nDone')
             except:
                 print('Error: freq_p must be an int.')
@@ -254,7 +840,7 @@ if __name__ == '__main__':
             # set max number of characters to read in Google AEI call
 
             try:
-                searchLength = int(input('\nSet search page text max length: '))
+                session.searchLength = int(input('\nSet search page text max length: '))
                 print('\nDone')
             except:
                 print('\nError')
@@ -263,213 +849,48 @@ if __name__ == '__main__':
             # set number of vectors to return in Pinecone query
 
             try:
-                top_k = int(input('\nSet top_k: '))
-                print('\nDone. top_k = '+str(top_k))
+                session.top_k = int(input('\nSet top_k: '))
+                print('\nDone. top_k = '+str(session.top_k))
             except:
                 print('\nError')
 
         elif userIn == '/d/':
             try:
-                currentText.pop()
-                ids.pop()
-                print(f'\nDeleted most recent message: ', currentConvo.pop())
+                print(f'\nDeleted most recent message: ', session.deleteLast())
             except:
                 print('\nError: could not delete recent message.')
 
-        elif userIn == '/upsert/':
-            print('\nUpserting current conversation...')
-
-            for i in range(len(ids)):
-                identifier = ids[i]
-                chat = currentText[i] # upserted records do not include timestamp and speaker
-                vector = embedAda(chat)
-                payload = []
-                payload.append((identifier, vector))
-                vecdb.upsert(payload)
-            # reset the list so that messages are not upserted twice
-            currentText = []
-            ids = []
-            print('\nDone')
+        elif userIn == '/cache/':
+            # show completion cache hit rate and the completion time it saved
 
-        else:
-            # store user input to LTM database
-
-            timestamp = time.time()
-            timestring = str(datetime.fromtimestamp(timestamp))
-            message = 'USER at '+timestring+': '+userIn
-
-            currentConvo.append({'role':'user', 'content':message})
-            currentText.append(userIn)
-
-            identifier = str(uuid4())
-            ids.append(identifier)
-
-            conn = connect('chat.db')
-            cur = conn.cursor()
-            cur.execute('''
-                CREATE TABLE IF NOT EXISTS ChatHistory (
-                    id TEXT,
-                    message TEXT,
-                    speaker TEXT,
-                    timestamp TEXT,
-                    timestring TEXT
-                )
-            ''')
-            cur.execute('INSERT INTO ChatHistory (id, message, speaker, timestamp, timestring) VALUES (?, ?, ?, ?, ?)', (identifier, message, 'USER', timestamp, timestring))
-            conn.commit()
-
-            # embed user message and query Pinecone for relevant LTM data
-            if len(currentText) >= 4:
-                vector = embedAda('\n\n'.join([item for item in currentText[-4:]]))
+            if completionCache is None:
+                print('\nThe completion cache is off. Set completionCacheOn at the top of chat.py.')
             else:
-                vector = embedAda('\n\n'.join([item for item in currentText[-len(currentText):]]))
+                print('\nCompletion cache: ', completionCache.stats())
 
-            results = vecdb.query(vector=vector, top_k=top_k, include_values=True, include_metadat=True)
+        elif userIn == '/stats/':
+            # show where this session's turns spent their time
 
-            # create final GPT prompt
-            if len(currentConvo) >= 200:
-                conversation = alignmentPrompt + loadRes(results) + currentConvo[-200:] + makePostPrompt()
+            if not session.tracer.enabled:
+                print('\nTracing is off. Set traceOn at the top of chat.py.')
             else:
-                conversation = alignmentPrompt + loadRes(results) + currentConvo + makePostPrompt()
-
-            # create GPT chat completion
-            chatResponse = chatComplete(conversation, model=model, max_tokens=max_tokens, temperature=temperature, top_p=top_p, freq_p=freq_p, pres_p=pres_p)
-            responseText = chatResponse.choices[0].message.content
-
-            # check for AEI call in GPT response by parsing response string
-            responseCheck = responseText.split(';/', maxsplit=1)
-            if responseCheck[0] == '/;GOOGSEARCH':
-                # Google search AEI
-                # agent passes a query string, then reads the first searchLength characters of text ripped from the first page of results
-
-                print('\nASSISTANT Google Searched: '+responseCheck[1])
-                
-                # configure selenium
-                chromeOptions = Options()
-                chromeOptions.add_argument("--headless")
-
-                # start a headless chrome browser and search Google
-                driver = webdriver.Chrome(options=chromeOptions)
-                driver.get("https://www.google.com")
-
-                WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.NAME, "q")))
-
-                searchBox = driver.find_element("name","q")
-                searchBox.send_keys(responseCheck[1])
-                searchBox.send_keys(Keys.RETURN)
-
-                time.sleep(2)
-
-                # find and consolidate page text
-                htmlElement = driver.find_element('id','rcnt')
-                pageText = getElementText(htmlElement)
-                # print(str(pageText))
-                driver.quit()
-
-                timestamp = time.time()
-                timestring = str(datetime.fromtimestamp(timestamp))
-
-                # create conversation snippet with result page text
-                searchResult = 'Here is the HTML of the results page of your Google search for "'+responseCheck[1]+'"" at '+timestring+'. You can read through it to infer information, then respond to the ChatUser: '+str(pageText)
-                resultSnippet = [{'role':'system', 'content':searchResult}]
-
-
-                # update completion prompt to include the search results
-                conversation = alignmentPrompt + loadRes(results) + currentConvo + resultSnippet + makePostPrompt() # try oring current_convo with something to handle when its an empty list
-
-                # create new response to user incorporating google search knowledge
-                chatResponse = chatComplete(conversation, model=model, max_tokens=max_tokens, temperature=temperature, top_p=top_p, freq_p=freq_p, pres_p=pres_p)
-                responseText = chatResponse.choices[0].message.content
-
-            elif responseCheck[0] == '/;SENDMAIL':
-                # Gmail AEI
-                # agent passes formatted a string with arguments for recipient, subject, and content of email, which are then extracted and passed to Gmail API
-
-                try:
-                    # parse AEI command and extract args
-
-                    mailRecipient = responseCheck[1].split(';/', maxsplit=1)[1].split('/;', maxsplit=1)
-                    mailSubject = mailRecipient[1].split(';/', maxsplit=1)[1].split('/;', maxsplit=1)
-                    mailContent = mailSubject[1].split(';/', maxsplit=1)[1].split('/;', maxsplit=1)
-
-
-                    print('\nDraft email TO ',mailRecipient[0],', SUBJECT: ', mailSubject[0], ', CONTENT: ', mailContent[0])
-                    if input('\nSend this email? Y to confirm, any other input to cancel: ') == 'Y':
-                        sendMail(mailRecipient[0], mailSubject[0], mailContent[0])
-                except:
-                    print('\nError parsing sendmail command.')
-
-            elif responseCheck[0] == '/;CALENDAR':
-                # Google calendar AEI
-                # parse AEI command, extract args, call Google calendar API to view or create events
-
-                # parse args
-                args = calParse(responseCheck[1])
-
-                # call AEI
-                cal = calendar(action=args['action'], start=args['start'], end=args['end'], maxResults=args['max'], loc=args['loc'], name=args['name'], desc=args['description'], eventId=args['eventid'])
-
-                # update completion prompt to include the search results
-                calSnippet = [{'role':'system', 'content':cal}]
-                currentConvo += calSnippet
-                conversation = alignmentPrompt + loadRes(results) + currentConvo + makePostPrompt()
-                #print(conversation)
-
-                # create new response to user incorporating google search knowledge
-                chatResponse = chatComplete(conversation, model=model, max_tokens=max_tokens, temperature=temperature, top_p=top_p, freq_p=freq_p, pres_p=pres_p)
-                responseText = chatResponse.choices[0].message.content
-
-            elif responseCheck[0] == '/;WTEXT':
-                wtext = responseCheck[1].split('/;', maxsplit=1)[0]
-                wfid = responseCheck[1].split(';/', maxsplit=1)[-1]
-                wtext = wtxt(wtext, wfid)
-
-                wtxtSnippet = [{'role':'system', 'content':wtext}]
-                currentConvo += wtxtSnippet
-                conversation = alignmentPrompt + loadRes(results) + currentConvo + makePostPrompt()
-                #print(conversation)
-
-                # create new response to user incorporating google search knowledge
-                chatResponse = chatComplete(conversation, model=model, max_tokens=max_tokens, temperature=temperature, top_p=top_p, freq_p=freq_p, pres_p=pres_p)
-                responseText = chatResponse.choices[0].message.content
-
-
-            elif responseCheck[0] == '/;RTEXT':
-                wfid = responseCheck[-1]
-                rtext = rtxt(wfid)
-
-                #don't append file to currentConvo
-                rtxtSnippet = [{'role':'system', 'content':rtext}]
-                conversation = alignmentPrompt + loadRes(results) + currentConvo + rtxtSnippet + makePostPrompt()
-                #print(conversation)
-
-                # create new response to user incorporating google search knowledge
-                chatResponse = chatComplete(conversation, model=model, max_tokens=max_tokens, temperature=temperature, top_p=top_p, freq_p=freq_p, pres_p=pres_p)
-                responseText = chatResponse.choices[0].message.content
-
-            timestamp = time.time()
-            timestring = str(datetime.fromtimestamp(timestamp))
-
-            # create final assistant response from GPT completion by adding speaker and timestamp. This version will be stored in LTM, but such metadata is omitted from the vectorized versions
-            formResponse = 'ASSISTANT at '+timestring+': '+responseText
-
-            # store final assistant response in LTM database
-            currentConvo.append({'role':'assistant', 'content':formResponse})
-            currentText.append(responseText)
-            identifier = str(uuid4())
-            ids.append(identifier)
-            cur.execute('INSERT INTO ChatHistory (id, message, speaker, timestamp, timestring) VALUES (?, ?, ?, ?, ?)', (identifier, formResponse, 'ASSISTANT', timestamp, timestring))
-            conn.commit()
-            cur.close()
-            conn.close()
-
-            # print assistant response
-            print('\nASSISTANT: '+formResponse.split(sep=': ', maxsplit=1)[1])
-
-
-
-
-
+                stats = session.tracer.summary()
+                print(f"\nTurns: {stats['turns']}")
+                for name, s in stats['spans'].items():
+                    print(f"{name:<22} {s['count']:>5} calls  total {s['total']:8.2f} s  mean {s['mean']*1000:8.1f} ms  p50 {s['p50']*1000:8.1f} ms  p95 {s['p95']*1000:8.1f} ms")
+                print('Tokens: ', stats['tokens'])
+                print('Counts: ', stats['counts'])
+                print('Embedding cache: ', embedCache.stats())
+                print('Search cache: ', backends.searchCache.stats())
+                if completionCache is not None:
+                    print('Completion cache: ', completionCache.stats())
 
+        elif userIn == '/upsert/':
+            print('\nUpserting current conversation...')
 
+            # the journal removes upserted messages, so nothing is upserted twice
+            session.upsert()
+            print('\nDone')
 
+        else:
+            session.turn(userIn)
@@ -0,0 +1,269 @@
+""" Rolling summarization of sessions and long-term memory
+Two background stages keep prompts roughly the same size however long the
+history grows. ConversationCompactor folds the oldest part of a session's
+conversation into one summary message once the conversation passes a token
+threshold; the summary is part of the next span folded, so summaries roll.
+MemoryCompactor summarizes finished days of chat.db: a day is split into
+topics at long pauses, every topic with enough messages gets a summary, and
+the topic summaries (with short topics verbatim) are summarized into a day
+summary. Each user's messages of a day are summarized on their own, and
+their summaries belong to that user. Summaries are stored as SUMMARY rows of
+ChatHistory and queued for embedding like messages, so retrieval finds them,
+and loadRes prefers them to the messages they cover."""
+
+import threading
+import time
+from datetime import datetime, date
+from sqlite3 import connect
+from uuid import NAMESPACE_URL, uuid5
+
+from prompt import countTokens
+
+conversationInstruction = ('Summarize the following earlier part of a conversation between a user and an AI assistant, '
+                           'including any earlier summary it starts with. Keep names, dates, numbers, decisions, open questions '
+                           'and anything the user asked to be remembered. Write a compact third-person summary.')
+topicInstruction = ('Summarize the following conversation between a user and an AI assistant. Keep names, dates, numbers, '
+                    'decisions and anything the user asked to be remembered. Start with a short topic title.')
+dayInstruction = ('Summarize the following summaries and messages from one day of conversations between a user and an AI '
+                  'assistant into one summary of the day, organized by topic.')
+
+# what a conversation summary message starts with
+summaryPrefix = 'Summary of the earlier part of this conversation: '
+
+
+def fit(texts, maxTokens, model='gpt-4'):
+    # join texts, oldest first, up to a token budget. the first text is always included
+    # takes: list of strings, max tokens, model whose tokenizer to count with
+    # returns: string
+
+    parts = []
+    used = 0
+    for text in texts:
+        n = countTokens({'role': 'user', 'content': text}, model)
+        if parts and used + n > maxTokens:
+            break
+        parts.append(text)
+        used += n
+    return '\n\n'.join(parts)
+
+
+class ConversationCompactor:
+    # background compaction of one session's conversation
+    # takes: function (instruction, text) -> summary text, executor the summaries run on, conversation tokens that
+    #        start a compaction, newest messages always kept verbatim, max tokens summarized at once,
+    #        function writing a notice to the user, such as a failed summary (None: print)
+
+    def __init__(self, summarize, executor, threshold=3000, keep=8, maxInput=6000, show=None):
+        self.summarize = summarize
+        self.show = show or print
+        self.executor = executor
+        self.threshold = threshold
+        self.keep = keep
+        self.maxInput = maxInput
+        # the compaction running, and the messages it summarizes
+        self.future = None
+        self.span = None
+
+    def check(self, conversation, tokens, model='gpt-4'):
+        # start summarizing the oldest messages if the conversation is over the threshold and no compaction is running
+        # takes: session conversation (list of message dicts), its token count, model whose tokenizer to count with
+        # returns: whether a compaction started
+
+        if self.future is not None or tokens <= self.threshold or len(conversation) <= self.keep:
+            return False
+        span = []
+        used = 0
+        for message in conversation[:len(conversation) - self.keep]:
+            n = countTokens(message, model)
+            if span and used + n > self.maxInput:
+                break
+            span.append(message)
+            used += n
+        # folding a single message (e.g. only the last summary) gains nothing
+        if len(span) < 2:
+            return False
+        self.span = span
+        self.future = self.executor.submit(self.summarize, conversationInstruction, '\n\n'.join(m['content'] for m in span))
+        return True
+
+    def apply(self, conversation):
+        # replace the summarized messages with their summary, if the compaction has finished and they are still the
+        # start of the conversation (a deleted or trimmed message drops the result)
+        # takes: session conversation, changed in place
+        # returns: whether the conversation changed
+
+        if self.future is None or not self.future.done():
+            return False
+        future, span = self.future, self.span
+        self.future = self.span = None
+        try:
+            summary = future.result()
+        except Exception as e:
+            self.show(f'\nAn error occurred while summarizing the conversation: {e}')
+            return False
+        n = len(span)
+        if len(conversation) < n or any(a is not b for a, b in zip(conversation, span)):
+            return False
+        conversation[:n] = [{'role':'system', 'content':summaryPrefix + summary}]
+        return True
+
+
+class MemoryCompactor:
+    # background summarizer of finished days of chat history
+    # takes: ChatStore, function (instruction, text) -> summary text, function queueing (id, text, owner) for embedding
+    #        and upsert, path to sqlite db, seconds between runs, seconds of silence that start a new topic, min messages
+    #        for a topic summary, max days summarized per run, max tokens summarized at once, model to count with,
+    #        function reporting a failed run (None: print)
+
+    def __init__(self, store, summarize, queue, dbPath='chat.db', interval=3600, topicGap=1800, minMessages=4, maxDays=7, maxInput=6000, model='gpt-4', show=None):
+        self.store = store
+        self.show = show or print
+        self.summarize = summarize
+        self.queue = queue
+        self.interval = interval
+        self.topicGap = topicGap
+        self.minMessages = minMessages
+        self.maxDays = maxDays
+        self.maxInput = maxInput
+        self.model = model
+        self.stopping = threading.Event()
+        self.thread = None
+
+        # rows are read on an own connection, and summaries written through the store
+        self.conn = connect(dbPath, check_same_thread=False)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS CompactionCheckpoint (
+                name TEXT PRIMARY KEY,
+                lastRowid INTEGER,
+                updated REAL
+            )
+        ''')
+        self.conn.commit()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='MemoryCompactor', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        # stop the worker. a day being summarized is finished first
+
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.conn.close()
+
+    def _run(self):
+        while not self.stopping.is_set():
+            try:
+                self.runOnce()
+            except Exception as e:
+                self.show(f'\nAn error occurred while summarizing chat history: {e}')
+            self.stopping.wait(self.interval)
+
+    def _rows(self, afterRowid, batchSize=1000):
+        # messages after a rowid, oldest first, read in batches so no read transaction stays open. discarded
+        # messages are skipped
+        while True:
+            rows = self.conn.execute("SELECT rowid, id, message, timestamp, owner FROM ChatHistory WHERE rowid > ? AND speaker != 'SUMMARY' AND discarded = 0 ORDER BY rowid LIMIT ?",
+                                     (afterRowid, batchSize)).fetchall()
+            if not rows:
+                return
+            yield from rows
+            afterRowid = rows[-1][0]
+
+    def runOnce(self, today=None):
+        # summarize the days before today that have not been summarized yet, up to maxDays
+        # takes: date to stop at (None: today)
+        # returns: number of days summarized
+
+        today = (today or date.today()).isoformat()
+        row = self.conn.execute("SELECT lastRowid FROM CompactionCheckpoint WHERE name = 'days'").fetchone()
+        lastRowid = row[0] if row else 0
+
+        done = 0
+        day, rows = None, []
+        for r in self._rows(lastRowid):
+            rowDay = date.fromtimestamp(float(r[3])).isoformat()
+            if rowDay != day:
+                if rows:
+                    self.summarizeDay(day, rows)
+                    self._checkpoint(rows[-1][0])
+                    done += 1
+                day, rows = rowDay, []
+                # today is still going on, and so is a run that has done its share
+                if day >= today or done >= self.maxDays or self.stopping.is_set():
+                    return done
+            rows.append(r)
+        # the last day read is over unless it is today
+        if rows and day < today:
+            self.summarizeDay(day, rows)
+            self._checkpoint(rows[-1][0])
+            done += 1
+        return done
+
+    def _checkpoint(self, lastRowid):
+        self.conn.execute("INSERT OR REPLACE INTO CompactionCheckpoint (name, lastRowid, updated) VALUES ('days', ?, ?)", (lastRowid, time.time()))
+        self.conn.commit()
+
+    def topics(self, rows):
+        # split a day's messages at pauses longer than topicGap, and where a topic would not fit maxInput
+        # takes: list of (rowid, id, message, timestamp, owner) rows, oldest first
+        # returns: list of lists of rows
+
+        topics = [[rows[0]]]
+        used = countTokens({'role': 'user', 'content': rows[0][2]}, self.model)
+        for previous, r in zip(rows, rows[1:]):
+            n = countTokens({'role': 'user', 'content': r[2]}, self.model)
+            if float(r[3]) - float(previous[3]) > self.topicGap or used + n > self.maxInput:
+                topics.append([])
+                used = 0
+            topics[-1].append(r)
+            used += n
+        return topics
+
+    def summarizeDay(self, day, rows):
+        # store topic summaries and a day summary for one day's messages, for each user separately. a user's day with
+        # one short topic is left as is
+        # takes: date string, list of (rowid, id, message, timestamp, owner) rows
+        # returns: number of summaries stored
+
+        owners = {}
+        for r in rows:
+            owners.setdefault(r[4], []).append(r)
+        return sum(self._summarizeOwner(day, ownRows, owner) for owner, ownRows in owners.items())
+
+    def _summarizeOwner(self, day, rows, owner):
+        parts = []
+        members = []
+        stored = 0
+        topics = self.topics(rows)
+        for topic in topics:
+            if len(topic) < self.minMessages:
+                parts += [r[2] for r in topic]
+                members += [r[1] for r in topic]
+                continue
+            summary = self.summarize(topicInstruction, fit([r[2] for r in topic], self.maxInput, self.model))
+            first, last = datetime.fromtimestamp(float(topic[0][3])), datetime.fromtimestamp(float(topic[-1][3]))
+            message = f'SUMMARY at {day} {first:%H:%M} to {last:%H:%M}: {summary}'
+            identifier = self._add(message, float(topic[-1][3]), 'topic', day, [r[1] for r in topic], summary, owner)
+            parts.append(message)
+            members.append(identifier)
+            stored += 1
+
+        if len(topics) > 1:
+            summary = self.summarize(dayInstruction, fit(parts, self.maxInput, self.model))
+            self._add(f'SUMMARY at {day}: {summary}', float(rows[-1][3]), 'day', day, members, summary, owner)
+            stored += 1
+        return stored
+
+    def _add(self, message, timestamp, level, day, members, text, owner):
+        # the id follows from what the summary covers, so a day summarized again after an interrupted run replaces
+        # its summaries instead of adding copies
+        identifier = str(uuid5(NAMESPACE_URL, f'summary:{level}:{day}:{members[0]}:{members[-1]}'))
+        # like messages, summaries are embedded without speaker and timestamp. queued first, so a summary that
+        # cannot be queued (e.g. the queue has stopped) is not stored either, and its day stays unchecked
+        self.queue(identifier, text, owner)
+        self.store.addSummary(identifier, message, timestamp, str(datetime.fromtimestamp(timestamp)), level, day, members, owner)
+        return identifier
@@ -0,0 +1,191 @@
+""" Completion cache for deterministic completions
+At temperature 0 the same prompt gives the same completion, so responses are
+stored in SQLite keyed by a hash of the model, the sampling parameters and the
+message list with speaker timestamps stripped. An optional semantic tier also
+serves a cached response when the newest user message is a near-duplicate
+(cosine similarity above a threshold) of one already answered with the same
+parameters. Entries expire after a TTL, least recently used entries are
+evicted past maxEntries, and hits, misses and the completion time saved are
+counted."""
+
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+from array import array
+from sqlite3 import connect
+
+import plugins
+
+
+def loadNumpy():
+    # numpy, imported by the first semantic lookup
+    # returns: numpy module, or None without numpy, in which case the semantic tier compares vectors in pure python
+
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+plugins.register('numpy', loadNumpy)
+
+# the speaker and timestamp tag chat.py puts in front of stored messages, e.g. 'USER at 2023-05-02 10:11:12.345678: '
+_speakerTag = re.compile(r'^(USER|ASSISTANT) at \d{4}-\d\d-\d\d \d\d:\d\d:\d\d(?:\.\d+)?: ')
+
+
+def normalizeContent(content):
+    # drop the speaker timestamp, which changes every turn without changing what is asked
+    # takes: string
+    # returns: string
+
+    return _speakerTag.sub(r'\1: ', content)
+
+
+def promptKey(messages, params):
+    # takes: list of message dicts, dict of model and sampling parameters
+    # returns: hex digest identifying the completion request
+
+    normalized = [(m['role'], normalizeContent(m['content'])) for m in messages]
+    return hashlib.sha256(json.dumps([sorted(params.items()), normalized]).encode()).hexdigest()
+
+
+def paramsKey(params):
+    return json.dumps(sorted(params.items()))
+
+
+def lastQuestion(messages):
+    # returns: normalized content of the newest user message, or None
+
+    for m in reversed(messages):
+        if m['role'] == 'user':
+            return normalizeContent(m['content'])
+    return None
+
+
+class CompletionCache:
+    # persistent cache of completion texts, safe to share between threads
+    # takes: path to sqlite db, seconds an entry stays valid, max number of entries,
+    #        function embedding a string (enables the semantic tier), min cosine similarity for a semantic hit
+
+    def __init__(self, path='chat.db', ttl=24*3600, maxEntries=1000, embed=None, threshold=0.95):
+        self.ttl = ttl
+        self.maxEntries = maxEntries
+        self.embed = embed
+        self.threshold = threshold
+        self.counts = {'hits': 0, 'semanticHits': 0, 'misses': 0, 'bypassed': 0}
+        self.savedSeconds = 0.0
+        self.lock = threading.Lock()
+
+        self.conn = connect(path, check_same_thread=False)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS CompletionCache (
+                key TEXT PRIMARY KEY,
+                params TEXT,
+                question TEXT,
+                vector BLOB,
+                response TEXT,
+                latency REAL,
+                created REAL,
+                lastUsed REAL,
+                hits INTEGER DEFAULT 0
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS CompletionCacheLastUsed ON CompletionCache (lastUsed)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS CompletionCacheParams ON CompletionCache (params, created)')
+        self.conn.commit()
+
+    def lookup(self, messages, params):
+        # find a cached response for a completion request, by exact prompt or, with the semantic tier, by a
+        # near-duplicate newest user message
+        # takes: list of message dicts, dict of model and sampling parameters
+        # returns: (response text, embedding of the newest user message or None); the text is None on a miss
+
+        key = promptKey(messages, params)
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute('SELECT key, response, latency FROM CompletionCache WHERE key = ? AND created > ?', (key, now - self.ttl)).fetchone()
+        if row:
+            self._hit(row, now, 'hits')
+            return row[1], None
+
+        vector = None
+        question = lastQuestion(messages)
+        if self.embed is not None and question:
+            vector = self.embed(question)
+            row = self._nearest(vector, paramsKey(params), now)
+            if row:
+                self._hit(row, now, 'semanticHits')
+                return row[1], vector
+
+        self.counts['misses'] += 1
+        return None, vector
+
+    def _hit(self, row, now, kind):
+        self.counts[kind] += 1
+        self.savedSeconds += row[2] or 0.0
+        with self.lock:
+            self.conn.execute('UPDATE CompletionCache SET lastUsed = ?, hits = hits + 1 WHERE key = ?', (now, row[0]))
+            self.conn.commit()
+
+    def _nearest(self, vector, params, now):
+        # most similar cached question under the same parameters, if it is similar enough
+        # returns: (key, response, latency) row, or None
+
+        with self.lock:
+            rows = self.conn.execute('SELECT key, response, latency, vector FROM CompletionCache WHERE params = ? AND created > ? AND vector IS NOT NULL',
+                                     (params, now - self.ttl)).fetchall()
+        if not rows:
+            return None
+        np = plugins.load('numpy')
+        if np is not None:
+            matrix = np.frombuffer(b''.join(r[3] for r in rows), dtype=np.float32).reshape(len(rows), -1)
+            query = np.asarray(vector, dtype=np.float32)
+            scores = matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query) + 1e-12)
+            best = int(np.argmax(scores))
+            score = float(scores[best])
+        else:
+            norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+            score, best = -1.0, 0
+            for i, r in enumerate(rows):
+                cached = array('f', r[3])
+                s = sum(a * b for a, b in zip(cached, vector)) / ((math.sqrt(sum(a * a for a in cached)) or 1.0) * norm)
+                if s > score:
+                    score, best = s, i
+        return rows[best][:3] if score >= self.threshold else None
+
+    def store(self, messages, params, response, latency, vector=None):
+        # cache a completion
+        # takes: list of message dicts, dict of model and sampling parameters, response text,
+        #        seconds the completion took, embedding of the newest user message from lookup (or None)
+
+        if self.embed is not None and vector is None:
+            question = lastQuestion(messages)
+            vector = self.embed(question) if question else None
+        blob = array('f', vector).tobytes() if vector is not None else None
+
+        now = time.time()
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO CompletionCache (key, params, question, vector, response, latency, created, lastUsed) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                              (promptKey(messages, params), paramsKey(params), lastQuestion(messages), blob, response, latency, now, now))
+            count = self.conn.execute('SELECT COUNT(*) FROM CompletionCache').fetchone()[0]
+            if count > self.maxEntries:
+                self.conn.execute('DELETE FROM CompletionCache WHERE key IN (SELECT key FROM CompletionCache ORDER BY lastUsed LIMIT ?)', (count - self.maxEntries,))
+            self.conn.commit()
+
+    def bypass(self):
+        # count a completion that was not eligible for the cache (e.g. one answering AEI results)
+
+        self.counts['bypassed'] += 1
+
+    def stats(self):
+        # returns: dict of hit/miss counters, hit rate, completion seconds saved and number of entries
+
+        lookups = self.counts['hits'] + self.counts['semanticHits'] + self.counts['misses']
+        with self.lock:
+            entries = self.conn.execute('SELECT COUNT(*) FROM CompletionCache').fetchone()[0]
+        return dict(self.counts, hitRate=(lookups - self.counts['misses']) / lookups if lookups else 0.0,
+                    savedSeconds=self.savedSeconds, entries=entries)
@@ -0,0 +1,232 @@
+""" AEI command parsing and dispatch
+Responses call AEIs with the /;NAME;/value tag grammar, e.g.
+/;SENDMAIL;/ /;TO;/a@b.c/;SUBJECT;/Hi/;CONTENT;/Hello. tokenize splits a
+response into its tags in one pass of a compiled pattern, and AeiRegistry maps
+command names (the keys of aeiCommands) to handlers and argument schemas, so a
+command is looked up in one dict access and its arguments are validated once
+before the handler runs. A response may call several AEIs, one per line; the
+independent ones run concurrently on a worker pool while those that ask the
+user for confirmation run one at a time. New AEIs are added by giving them a
+schema in aeiCommands and registering a handler."""
+
+import re
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# a tag: '/;', its name up to the first ';/', then its value up to the next '/;' or the end
+_tagPattern = re.compile(r'/;([^;]*(?:;(?!/)[^;]*)*);/([^/]*(?:/(?!;)[^/]*)*)', re.S)
+
+# one argument of an AEI command
+# takes: handler keyword, where to read it from, function converting the text, value when absent, whether it must be present
+#   source is one of
+#     'rest'   the raw text after the command tag
+#     'value'  the text after the command tag, up to the next tag
+#     'after'  the raw text after the first tag following the command
+#     'action' the name of the first tag following the command, lowercased
+#     int n    the value of the nth tag following the command, whatever its name
+#     'NAME'   the value of the tag named NAME (case-insensitive) after the action tag. the last one wins
+Arg = namedtuple('Arg', 'name source type default required', defaults=(str, None, False))
+
+# a parsed AEI command, ready to dispatch
+AeiCall = namedtuple('AeiCall', 'name args')
+
+
+class AeiError(ValueError):
+    # an AEI command whose arguments are missing or invalid
+    pass
+
+
+def tokenize(text):
+    # split text into its /;NAME;/value tags in one pass of a compiled pattern. a name runs to the next ';/'
+    # and a value to the next '/;', so a value may start with ';' or end with '/'
+    # takes: string
+    # returns: list of (name, value) tuples
+
+    return _tagPattern.findall(text)
+
+
+def commandName(text):
+    # returns: the leading command tag of text, e.g. '/;CALENDAR;/', or None if text does not start with one
+
+    if not text.startswith('/;'):
+        return None
+    end = text.find(';/')
+    if end == -1:
+        return None
+    return text[:end+2]
+
+
+# argument sources that are not tag names
+_sources = ('rest', 'value', 'after', 'action')
+
+
+def _getter(command, arg):
+    # compile where an argument is read from into a function of (text, tags, named tag values)
+
+    source = arg.source
+    if source == 'rest':
+        skip = len(command)
+        return lambda text, tags, named: text[skip:]
+    if source == 'value':
+        return lambda text, tags, named: tags[0][1]
+    if source == 'after':
+        # the first following tag starts where the command's value ends
+        skip = len(command)
+        return lambda text, tags, named: text[text.find(';/', text.find('/;', skip) + 2) + 2:] if len(tags) > 1 else None
+    if source == 'action':
+        return lambda text, tags, named: tags[1][0].lower() if len(tags) > 1 else None
+    if isinstance(source, int):
+        index = source + 1
+        return lambda text, tags, named: tags[index][1] if len(tags) > index else None
+    key = source.lower()
+    return lambda text, tags, named: named.get(key)
+
+
+class AeiRegistry:
+    # command name -> (handler, schema) table. schemas are compiled once, so parsing a command is one dict
+    # lookup, at most one tokenizing pass and one step per argument
+    # takes: dict of command name -> tuple of Arg, like aeiCommands, max AEIs of this registry run at once, also on a
+    #        shared executor,
+    #        executor to run them on instead of an own worker pool (e.g. one shared by several registries),
+    #        function writing a notice to the user, such as a handler's error (None: print)
+
+    def __init__(self, commands, workers=4, executor=None, show=None):
+        self.schemas = dict(commands)
+        self.show = show or print
+        self.handlers = {}
+        self.remembered = set()
+        self.confirmed = {}
+        self.workers = workers
+        # slots taken by calls on the executor, so one registry cannot fill a pool it shares with others
+        self.slots = threading.BoundedSemaphore(workers)
+        self.executor = executor
+        self.ownExecutor = executor is None
+        self.lineStart = None
+        self.binders = {}
+        for name, schema in self.schemas.items():
+            sources = [arg.source for arg in schema]
+            steps = [(arg.name, _getter(name, arg), None if arg.type is str else arg.type, arg.default, arg.required) for arg in schema]
+            # (steps, whether any argument comes from a tag, whether any is looked up by tag name)
+            self.binders[name] = (steps, any(source != 'rest' for source in sources),
+                                  any(isinstance(source, str) and source not in _sources for source in sources))
+
+    def register(self, name, handler, remember=False, confirm=False):
+        # set the function called for a command, with the command's arguments as keywords
+        # takes: command name such as '/;INBOX;/', function returning the result text for the agent (None for no
+        #        follow-up completion), whether the result is kept in the conversation or only shown for one completion,
+        #        whether the handler asks the user to confirm: True, or a function of the args dict for some calls only
+
+        if name not in self.schemas:
+            raise KeyError(f'{name} has no schema in aeiCommands')
+        self.handlers[name] = handler
+        if remember:
+            self.remembered.add(name)
+        else:
+            self.remembered.discard(name)
+        self.confirmed[name] = confirm
+        # a line starting with a registered command starts a new call
+        names = '|'.join(re.escape(n) for n in sorted(self.handlers, key=len, reverse=True))
+        self.lineStart = re.compile(r'\n(?=' + names + ')')
+
+    def remembers(self, name):
+        return name in self.remembered
+
+    def confirms(self, call):
+        # returns: whether running call asks the user for confirmation
+
+        confirm = self.confirmed.get(call.name)
+        return confirm(call.args) if callable(confirm) else bool(confirm)
+
+    def parse(self, text):
+        # find and validate the AEI command a response starts with
+        # takes: response text
+        # returns: AeiCall, or None if the response is not a registered command. raises AeiError on bad arguments
+
+        name = commandName(text)
+        if name not in self.handlers:
+            return None
+        return AeiCall(name, self.bind(name, text))
+
+    def parseAll(self, text):
+        # find every AEI command in a response: one at its start, and any more each at the start of a line
+        # takes: response text
+        # returns: list of AeiCall (empty if the response does not start with a command), list of AeiError
+        #          for commands that could not be parsed
+
+        if commandName(text) not in self.handlers:
+            return [], []
+        calls = []
+        errors = []
+        for part in self.lineStart.split(text):
+            try:
+                calls.append(self.parse(part))
+            except AeiError as e:
+                errors.append(e)
+        return calls, errors
+
+    def bind(self, name, text):
+        # read the arguments of command name from text according to its schema
+        # returns: dict of handler keyword -> value
+
+        steps, needsTags, needsNames = self.binders[name]
+        # only commands with tagged arguments pay for tokenizing
+        tags = tokenize(text) if needsTags else None
+        named = {tag[0].lower(): tag[1] for tag in tags[2:]} if needsNames else None
+
+        args = {}
+        for key, get, convert, default, required in steps:
+            raw = get(text, tags, named)
+            if raw is None:
+                if required:
+                    raise AeiError(f'{name} is missing {key}')
+                args[key] = default
+            elif convert is None:
+                args[key] = raw
+            else:
+                try:
+                    args[key] = convert(raw)
+                except (TypeError, ValueError) as e:
+                    raise AeiError(f'{name} got an invalid {key}: {raw!r}') from e
+        return args
+
+    def run(self, call):
+        # call the handler of a parsed command
+        # returns: the handler's result
+
+        return self.handlers[call.name](**call.args)
+
+    def runAll(self, calls):
+        # run parsed commands. the independent ones run concurrently on the worker pool, while the ones that ask
+        # for confirmation run one at a time on the calling thread, so prompts never interleave. a handler that
+        # raises gets its error as its result, so the other results are not lost
+        # takes: list of AeiCall
+        # returns: list of handler results, in the order of calls
+
+        if len(calls) == 1:
+            return [self._attempt(calls[0])]
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='aei')
+        futures = {}
+        for i, call in enumerate(calls):
+            if not self.confirms(call):
+                # waits on the calling thread, not on a pool thread, for one of this registry's slots
+                self.slots.acquire()
+                futures[i] = self.executor.submit(self._attempt, call)
+                futures[i].add_done_callback(lambda future: self.slots.release())
+        results = [None if i in futures else self._attempt(call) for i, call in enumerate(calls)]
+        for i, future in futures.items():
+            results[i] = future.result()
+        return results
+
+    def _attempt(self, call):
+        try:
+            return self.run(call)
+        except Exception as e:
+            self.show(f'\nAn error occurred in {call.name}: {e}')
+            return f'An error occurred in {call.name}: {e}'
+
+    def close(self):
+        # shuts down the worker pool, unless it was passed in
+        if self.executor is not None and self.ownExecutor:
+            self.executor.shutdown(wait=False)
@@ -0,0 +1,113 @@
+""" Content-addressed embedding cache
+Persists embedding vectors on disk keyed by a hash of the embedding model and
+the ASCII-normalized text, so repeated text never costs an API round trip.
+Least recently used entries are evicted once the cache holds maxEntries."""
+
+import hashlib
+import threading
+import time
+from array import array
+from sqlite3 import connect
+
+
+def normalize(text):
+    # the same ASCII normalization embedAda applies before calling the API
+    # takes: string
+    # returns: string
+
+    return text.encode(encoding='ASCII', errors='ignore').decode()
+
+
+def cacheKey(text, model):
+    # takes: string, embedding model name
+    # returns: hex digest identifying this text under this model
+
+    return hashlib.sha256((model + '\x00' + normalize(text)).encode()).hexdigest()
+
+
+class EmbeddingCache:
+    # disk-backed LRU cache of embedding vectors, safe to share between threads
+    # takes: path to sqlite file, max number of cached vectors
+
+    def __init__(self, path='embeddings.db', maxEntries=100000):
+        self.maxEntries = maxEntries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.conn = connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS Embedding (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                vector BLOB,
+                lastUsed REAL
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS EmbeddingLastUsed ON Embedding (lastUsed)')
+        self.conn.commit()
+        self.entries = self.conn.execute('SELECT COUNT(*) FROM Embedding').fetchone()[0]
+
+    def getMany(self, texts, model):
+        # look up several texts at once, refreshing the recency of every hit
+        # takes: list of strings, embedding model name
+        # returns: list of vectors (lists of floats), None where the text is not cached
+
+        keys = [cacheKey(t, model) for t in texts]
+        with self.lock:
+            found = {key: array('f', blob).tolist() for key, blob in self._select('key, vector', set(keys))}
+            if found:
+                now = time.time()
+                self.conn.executemany('UPDATE Embedding SET lastUsed = ? WHERE key = ?', [(now, k) for k in found])
+                self.conn.commit()
+            out = [found.get(k) for k in keys]
+            hits = sum(1 for v in out if v is not None)
+            self.hits += hits
+            self.misses += len(out) - hits
+        return out
+
+    def get(self, text, model):
+        # returns: cached vector for text under model, or None
+
+        return self.getMany([text], model)[0]
+
+    def putMany(self, texts, vectors, model):
+        # store vectors for texts, evicting the least recently used entries past maxEntries
+        # takes: list of strings, list of vectors in the same order, embedding model name
+
+        now = time.time()
+        rows = {cacheKey(t, model): (model, array('f', v).tobytes(), now) for t, v in zip(texts, vectors)}
+        with self.lock:
+            existing = len(self._select('key', rows))
+            self.conn.executemany('INSERT OR REPLACE INTO Embedding (key, model, vector, lastUsed) VALUES (?, ?, ?, ?)', [(k,) + r for k, r in rows.items()])
+            self.entries += len(rows) - existing
+            if self.entries > self.maxEntries:
+                # evict down to 90% so eviction runs once per batch of inserts, not on every insert
+                excess = self.entries - int(self.maxEntries * 0.9)
+                self.conn.execute('DELETE FROM Embedding WHERE key IN (SELECT key FROM Embedding ORDER BY lastUsed LIMIT ?)', (excess,))
+                self.entries = self.conn.execute('SELECT COUNT(*) FROM Embedding').fetchone()[0]
+            self.conn.commit()
+
+    def _select(self, columns, keys):
+        # fetch rows for keys, chunked to stay under sqlite's bound parameter limit
+        # takes: column list, iterable of keys
+        # returns: list of row tuples
+
+        keys = list(keys)
+        rows = []
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i+500]
+            marks = ','.join('?' * len(chunk))
+            rows += self.conn.execute(f'SELECT {columns} FROM Embedding WHERE key IN ({marks})', chunk).fetchall()
+        return rows
+
+    def put(self, text, vector, model):
+        self.putMany([text], [vector], model)
+
+    def stats(self):
+        # returns: dict of hit/miss counters and cache size
+
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hitRate': self.hits / total if total else 0.0, 'entries': self.entries}
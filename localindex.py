@@ -0,0 +1,381 @@
+""" Local in-process vector index
+A drop-in alternative to the Pinecone index with the same upsert/query/delete
+surface. Unit-normalized float32 vectors live in a memory-mapped file with an id
+sidecar, so the index persists across restarts without being loaded into RAM,
+and queries are a vectorized cosine top-k. Large corpora can be partitioned
+IVF-style so a query only scans the nprobe closest partitions.
+
+With quantize='float16' or 'int8' the first pass scans compact codes instead
+(2x or 4x less memory touched per query), and the best rerank * top_k
+candidates are re-scored exactly against the full-precision vectors on disk.
+
+Like a Pinecone index, upsert, query and delete take a namespace. The default
+namespace '' is the index directory itself, and every other namespace is an
+index of its own under namespaces/, opened on first use.
+
+Files in the index directory:
+    meta.json     dimensions, row count, capacity and quantization mode
+    vectors.f32   capacity x dim float32 matrix
+    ids.txt       one id per row, append-only (rewritten on delete)
+    assign.i32    partition of each row, -1 while unpartitioned
+    centroids.npy partition centroids, once the index is partitioned
+    codes.f16     float16 codes (quantize='float16')
+    codes.i8      int8 codes (quantize='int8')
+    scales.f32    per-row int8 dequantization scale (quantize='int8')
+    namespaces/   one index directory like this one per other namespace, named by the namespace's hex-encoded UTF-8
+"""
+
+import json
+import os
+import threading
+
+import numpy as np
+
+# rows scored per block when scanning, to bound temporary memory on large indexes
+scanBlock = 65536
+
+
+class LocalIndex:
+    # persistent single-process vector index
+    # takes: index directory, vector dimensions, row count at which to partition automatically (0 = never),
+    #        number of partitions (0 = sqrt of row count), partitions scanned per query,
+    #        quantization mode ('none', 'float16', 'int8', or None to keep the stored mode),
+    #        candidates re-ranked exactly per requested match when quantized
+
+    def __init__(self, path='vectors', dim=1536, partitionAt=100000, nlist=0, nprobe=8, quantize=None, rerank=4):
+        self.path = path
+        self.partitionAt = partitionAt
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.rerank = rerank
+        self.lock = threading.RLock()
+        self.codes = None
+        self.scales = None
+        # namespace -> LocalIndex, for the namespaces used so far other than ''
+        self.spaces = {}
+        os.makedirs(path, exist_ok=True)
+
+        meta = self._file('meta.json')
+        if os.path.exists(meta):
+            with open(meta, 'r') as f:
+                m = json.load(f)
+            self.dim, self.count, self.capacity = m['dim'], m['count'], m['capacity']
+            self.quantize = m.get('quantize', 'none')
+        else:
+            self.dim, self.count, self.capacity = dim, 0, 1024
+            self.quantize = quantize or 'none'
+            self._allocate(self.capacity)
+            self._saveMeta()
+        self._open()
+
+        # ids past the persisted count belong to an interrupted write and are ignored
+        self.ids = []
+        if os.path.exists(self._file('ids.txt')):
+            with open(self._file('ids.txt'), 'r') as f:
+                self.ids = [line.rstrip('\n') or None for line in f]
+            if len(self.ids) > self.count:
+                self.ids = self.ids[:self.count]
+                self._saveIds()
+        self.rows = {identifier: row for row, identifier in enumerate(self.ids) if identifier}
+
+        self.centroids = None
+        if os.path.exists(self._file('centroids.npy')):
+            self.centroids = np.load(self._file('centroids.npy'))
+
+        if quantize and quantize != self.quantize:
+            self.requantize(quantize)
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _saveMeta(self):
+        tmp = self._file('meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'dim': self.dim, 'count': self.count, 'capacity': self.capacity, 'quantize': self.quantize}, f)
+        os.replace(tmp, self._file('meta.json'))
+
+    def _saveIds(self):
+        tmp = self._file('ids.txt.tmp')
+        with open(tmp, 'w') as f:
+            f.write(''.join((identifier or '') + '\n' for identifier in self.ids))
+        os.replace(tmp, self._file('ids.txt'))
+
+    def _layout(self):
+        # backing files for the current quantization mode
+        # returns: dict of attribute -> (file name, dtype, row shape, fill value for new rows)
+
+        layout = {'vectors': ('vectors.f32', np.float32, (self.dim,), 0), 'assign': ('assign.i32', np.int32, (), -1)}
+        if self.quantize == 'float16':
+            layout['codes'] = ('codes.f16', np.float16, (self.dim,), 0)
+        elif self.quantize == 'int8':
+            layout['codes'] = ('codes.i8', np.int8, (self.dim,), 0)
+            layout['scales'] = ('scales.f32', np.float32, (), 0)
+        return layout
+
+    def _allocate(self, capacity):
+        # create or grow the backing files to hold capacity rows
+
+        for name, dtype, shape, fill in self._layout().values():
+            rowBytes = np.dtype(dtype).itemsize * int(np.prod(shape))
+            old = os.path.getsize(self._file(name)) // rowBytes if os.path.exists(self._file(name)) else 0
+            with open(self._file(name), 'ab') as f:
+                f.truncate(capacity * rowBytes)
+            if fill and capacity > old:
+                m = np.memmap(self._file(name), dtype=dtype, mode='r+', shape=(capacity,) + shape)
+                m[old:] = fill
+                m.flush()
+                del m
+
+    def _open(self):
+        for attr, (name, dtype, shape, fill) in self._layout().items():
+            setattr(self, attr, np.memmap(self._file(name), dtype=dtype, mode='r+', shape=(self.capacity,) + shape))
+
+    def _flush(self):
+        for attr in self._layout():
+            getattr(self, attr).flush()
+
+    def _grow(self, needed):
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        self._flush()
+        for attr in self._layout():
+            setattr(self, attr, None)
+        self._allocate(capacity)
+        self.capacity = capacity
+        self._open()
+
+    def _encode(self, rows, values):
+        # write the compact codes for unit-normalized values at rows
+
+        if self.quantize == 'float16':
+            self.codes[rows] = values.astype(np.float16)
+        elif self.quantize == 'int8':
+            # symmetric per-row scale, so each row uses the full int8 range
+            scale = np.maximum(np.abs(values).max(axis=1), 1e-12) / 127.0
+            self.codes[rows] = np.round(values / scale[:, None]).astype(np.int8)
+            self.scales[rows] = scale
+
+    def requantize(self, quantize):
+        # switch quantization mode, rebuilding codes from the full-precision vectors
+        # takes: 'none', 'float16' or 'int8'
+
+        with self.lock:
+            old = [name for name, dtype, shape, fill in self._layout().values()]
+            self._flush()
+            self.codes = self.scales = None
+            self.quantize = quantize
+            self._allocate(self.capacity)
+            self._open()
+            for start in range(0, self.count, scanBlock):
+                stop = min(start + scanBlock, self.count)
+                self._encode(slice(start, stop), np.asarray(self.vectors[start:stop]))
+            self._flush()
+            self._saveMeta()
+            current = [name for name, dtype, shape, fill in self._layout().values()]
+            for name in old:
+                if name not in current:
+                    os.remove(self._file(name))
+
+    def namespace(self, name):
+        # returns: the index holding a namespace's vectors: this one for '', an index of its own for any other
+
+        if not name:
+            return self
+        with self.lock:
+            space = self.spaces.get(name)
+            if space is None:
+                # hex keeps any user id a safe directory name
+                space = LocalIndex(os.path.join(self.path, 'namespaces', name.encode().hex()), dim=self.dim, partitionAt=self.partitionAt,
+                                   nlist=self.nlist, nprobe=self.nprobe, quantize=self.quantize, rerank=self.rerank)
+                self.spaces[name] = space
+        return space
+
+    def upsert(self, vectors, namespace='', **kwargs):
+        # insert or overwrite vectors, like pinecone.Index.upsert
+        # takes: list of (id, values) tuples. extra tuple fields (metadata) are ignored, namespace
+        # returns: dict with the upserted count
+
+        if namespace:
+            return self.namespace(namespace).upsert(vectors)
+        items = list(vectors)
+        if not items:
+            return {'upserted_count': 0}
+        values = np.asarray([item[1] for item in items], dtype=np.float32).reshape(len(items), self.dim)
+        values /= np.maximum(np.linalg.norm(values, axis=1, keepdims=True), 1e-12)
+
+        with self.lock:
+            rows = []
+            appended = []
+            for item in items:
+                row = self.rows.get(item[0])
+                if row is None:
+                    row = self.count + len(appended)
+                    appended.append(item[0])
+                    self.rows[item[0]] = row
+                rows.append(row)
+            if self.count + len(appended) > self.capacity:
+                self._grow(self.count + len(appended))
+
+            rows = np.asarray(rows)
+            self.vectors[rows] = values
+            self._encode(rows, values)
+            self.assign[rows] = self._nearest(values) if self.centroids is not None else -1
+            self._flush()
+
+            # sidecar and count are written last so an interrupted upsert leaves a consistent index
+            if appended:
+                with open(self._file('ids.txt'), 'a') as f:
+                    f.write(''.join(identifier + '\n' for identifier in appended))
+                self.ids += appended
+                self.count += len(appended)
+                self._saveMeta()
+
+            if self.partitionAt and self.centroids is None and self.count >= self.partitionAt:
+                self.partition()
+        return {'upserted_count': len(items)}
+
+    def delete(self, ids=None, namespace='', **kwargs):
+        # remove vectors by id, like pinecone.Index.delete. rows are tombstoned, not compacted
+
+        if namespace:
+            return self.namespace(namespace).delete(ids)
+        with self.lock:
+            removed = [self.rows.pop(i) for i in (ids or []) if i in self.rows]
+            if not removed:
+                return {}
+            for row in removed:
+                self.ids[row] = None
+                self.vectors[row] = 0.0
+                if self.codes is not None:
+                    self.codes[row] = 0
+            self._flush()
+            self._saveIds()
+        return {}
+
+    def _scan(self, rows, q, exact):
+        # first-pass scores for rows (None = every row): from the float32 vectors when exact or unquantized,
+        # approximate from the codes otherwise
+        # returns: float32 array of scores
+
+        if rows is None:
+            blocks = [slice(start, min(start + scanBlock, self.count)) for start in range(0, self.count, scanBlock)]
+        else:
+            blocks = [rows[start:start + scanBlock] for start in range(0, len(rows), scanBlock)]
+
+        out = []
+        for block in blocks:
+            if exact or self.quantize == 'none':
+                out.append(self.vectors[block] @ q)
+            elif self.quantize == 'float16':
+                out.append(self.codes[block].astype(np.float32) @ q)
+            else:
+                out.append((self.codes[block].astype(np.float32) @ q) * self.scales[block])
+        return np.concatenate(out) if out else np.zeros(0, dtype=np.float32)
+
+    def query(self, vector, top_k=10, include_values=False, exact=False, namespace='', **kwargs):
+        # cosine top-k, like pinecone.Index.query
+        # takes: query vector, number of matches, whether to return the stored vectors,
+        #        whether to bypass partitions and quantization (full-precision brute force), namespace to search
+        # returns: dict with a 'matches' list of {'id', 'score'(, 'values')} dicts, best first
+
+        if namespace:
+            return self.namespace(namespace).query(vector, top_k=top_k, include_values=include_values, exact=exact)
+        q = np.asarray(vector, dtype=np.float32)
+        q /= max(float(np.linalg.norm(q)), 1e-12)
+
+        with self.lock:
+            if not self.count or top_k <= 0:
+                return {'matches': []}
+            candidates = None if exact else self._candidates(q)
+            scores = self._scan(candidates, q, exact)
+            rerank = self.quantize != 'none' and not exact
+
+            # over-fetch by the number of tombstoned rows so deletions never shorten the result
+            k = min((top_k * self.rerank if rerank else top_k) + self.count - len(self.rows), len(scores))
+            if k <= 0:
+                return {'matches': []}
+            best = np.argpartition(-scores, k - 1)[:k]
+            rows = best if candidates is None else candidates[best]
+            if rerank:
+                # exact re-rank of the shortlist against the full-precision vectors, read in row order
+                rows = np.sort(rows)
+                scores = self.vectors[rows] @ q
+            else:
+                scores = scores[best]
+            order = np.argsort(-scores)
+
+            matches = []
+            for row, score in zip(rows[order], scores[order]):
+                identifier = self.ids[row]
+                if identifier is None:
+                    continue
+                match = {'id': identifier, 'score': float(score)}
+                if include_values:
+                    match['values'] = self.vectors[row].tolist()
+                matches.append(match)
+                if len(matches) == top_k:
+                    break
+        return {'matches': matches}
+
+    def measureRecall(self, queries, top_k=20):
+        # recall@top_k of the configured search (partitions + quantization) against exact brute force
+        # takes: list of query vectors, number of matches
+        # returns: mean fraction of the exact top_k ids that the configured search also returned
+
+        recalls = []
+        for q in queries:
+            truth = {m['id'] for m in self.query(q, top_k=top_k, exact=True)['matches']}
+            if truth:
+                found = {m['id'] for m in self.query(q, top_k=top_k)['matches']}
+                recalls.append(len(truth & found) / len(truth))
+        return sum(recalls) / len(recalls) if recalls else 1.0
+
+    def _candidates(self, q):
+        # rows to scan for q: everything when unpartitioned, else the nprobe closest partitions plus unassigned rows
+        # returns: array of row numbers, or None for a full scan
+
+        if self.centroids is None:
+            return None
+        probe = np.argsort(-(self.centroids @ q))[:self.nprobe]
+        assign = self.assign[:self.count]
+        return np.nonzero(np.isin(assign, probe) | (assign < 0))[0]
+
+    def _nearest(self, values):
+        return np.argmax(values @ self.centroids.T, axis=1).astype(np.int32)
+
+    def partition(self, nlist=None, iterations=10, sample=50000, seed=0):
+        # cluster the index into nlist partitions with spherical k-means over a sample, then assign every row
+        # takes: number of partitions (default sqrt of row count), k-means iterations, sample size, random seed
+
+        with self.lock:
+            nlist = nlist or self.nlist or max(1, int(np.sqrt(self.count)))
+            rng = np.random.default_rng(seed)
+            live = np.asarray([row for row, identifier in enumerate(self.ids) if identifier])
+            if len(live) < nlist:
+                return
+            train = np.asarray(self.vectors[np.sort(rng.choice(live, size=min(sample, len(live)), replace=False))])
+
+            centroids = train[rng.choice(len(train), size=nlist, replace=False)].copy()
+            for _ in range(iterations):
+                labels = np.argmax(train @ centroids.T, axis=1)
+                for c in range(nlist):
+                    members = train[labels == c]
+                    if len(members):
+                        centroids[c] = members.sum(axis=0)
+                centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+            self.centroids = centroids
+            # assign in blocks so partitioning a large index does not pull it all into memory
+            for start in range(0, self.count, scanBlock):
+                stop = min(start + scanBlock, self.count)
+                self.assign[start:stop] = self._nearest(np.asarray(self.vectors[start:stop]))
+            self.assign.flush()
+            np.save(self._file('centroids.npy'), centroids)
+
+    def describe_index_stats(self):
+        # returns: dict with vector count, partitions, and the bytes per vector scanned in the first pass
+
+        scanned = {'none': 4, 'float16': 2, 'int8': 1}[self.quantize] * self.dim
+        return {'dimension': self.dim, 'total_vector_count': len(self.rows), 'partitions': 0 if self.centroids is None else len(self.centroids),
+                'quantize': self.quantize, 'scan_bytes_per_vector': scanned}
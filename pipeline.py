@@ -0,0 +1,55 @@
+""" Concurrent turn pipeline
+Runs the independent stages of a chat turn (storing the user message,
+retrieving memories, ...) concurrently on an asyncio event loop, each in a
+worker thread with its own deadline. A stage that misses its deadline or
+fails is replaced by its fallback value so the turn can still complete."""
+
+import asyncio
+import time
+
+# fallback marker for stages whose errors must propagate instead of being replaced
+REQUIRED = object()
+
+
+class TurnPipeline:
+    # asyncio executor for the stages of a turn
+    # takes: dict of stage name -> timeout seconds (stages not listed have no deadline),
+    #        thread pool the stages run on (None: the event loop's own), e.g. one shared by several pipelines
+
+    def __init__(self, timeouts=None, executor=None):
+        self.timeouts = dict(timeouts or {})
+        self.executor = executor
+        self.loop = asyncio.new_event_loop()
+        # seconds each stage of the last run took, and the stages that fell back
+        self.timings = {}
+        self.fellBack = []
+
+    async def _stage(self, name, func, fallback):
+        start = time.perf_counter()
+        try:
+            return await asyncio.wait_for(self.loop.run_in_executor(self.executor, func), self.timeouts.get(name))
+        except Exception:
+            # a timed-out stage keeps running in its thread; its result is simply not waited for
+            if fallback is REQUIRED:
+                raise
+            self.fellBack.append(name)
+            return fallback
+        finally:
+            self.timings[name] = time.perf_counter() - start
+
+    async def _run(self, stages):
+        names = list(stages)
+        results = await asyncio.gather(*[self._stage(name, *stages[name]) for name in names])
+        return dict(zip(names, results))
+
+    def run(self, stages):
+        # run stages concurrently and wait for all of them (or their deadlines)
+        # takes: dict of stage name -> (function taking no args, fallback value or REQUIRED)
+        # returns: dict of stage name -> result
+
+        self.timings = {}
+        self.fellBack = []
+        return self.loop.run_until_complete(self._run(stages))
+
+    def close(self):
+        self.loop.close()
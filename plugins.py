@@ -0,0 +1,97 @@
+""" Plugins loaded on first use
+The heavy client libraries behind the chat loop (OpenAI, Pinecone, Selenium,
+the Google API client) are registered here by name with a function that
+imports and sets them up, and are only loaded when something first uses them.
+The modules that own them register them (chat.py the OpenAI client and the
+vector index, browser.py Selenium, aei.py the Google API client) and keep a
+Lazy stand-in under the name they used before, so importing chat.py and
+reaching the first prompt costs none of their import time or memory, and a
+process only ever loads the tools it uses. Each plugin is loaded once per
+process, by whichever thread asks for it first."""
+
+import threading
+import time
+
+# plugin name -> function returning the loaded plugin
+_loaders = {}
+# plugin name -> loaded plugin, and seconds its loading took
+_plugins = {}
+_seconds = {}
+_locks = {}
+_lock = threading.Lock()
+# what an unloaded Lazy holds
+_missing = object()
+
+
+def register(name, loader):
+    # register a plugin. registering a name again replaces its loader, unless it is already loaded
+    # takes: plugin name, function taking no arguments and returning the plugin (e.g. an imported module)
+
+    with _lock:
+        _loaders[name] = loader
+        _locks.setdefault(name, threading.Lock())
+
+
+def load(name):
+    # returns: the plugin, loaded on the first call. raises KeyError for an unknown plugin, and whatever its loader
+    #          raises (e.g. ImportError for a missing library), in which case the next call tries again
+
+    plugin = _plugins.get(name, _missing)
+    if plugin is not _missing:
+        return plugin
+    with _lock:
+        loader, lock = _loaders[name], _locks[name]
+    # loading one plugin does not wait for another one loading in a different thread
+    with lock:
+        if name not in _plugins:
+            start = time.perf_counter()
+            _plugins[name] = loader()
+            _seconds[name] = time.perf_counter() - start
+    return _plugins[name]
+
+
+def loaded():
+    # returns: dict of the names of the plugins loaded so far -> seconds each took to load
+
+    return dict(_seconds)
+
+
+def resolve(obj):
+    # returns: the object a Lazy stands in for, loading it now, or obj itself if it is not a Lazy
+
+    return obj._load() if isinstance(obj, Lazy) else obj
+
+
+class Lazy:
+    # stands in for a plugin, loading it on first attribute access: openai = Lazy('openai'); openai.Embedding...
+    # takes: plugin name, or a function taking no arguments and returning the object (loaded once, like a plugin)
+
+    def __init__(self, target):
+        object.__setattr__(self, '_target', target)
+        object.__setattr__(self, '_object', _missing)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def _load(self):
+        target = self._object
+        if target is not _missing:
+            return target
+        if isinstance(self._target, str):
+            target = load(self._target)
+        else:
+            with self._lock:
+                if self._object is _missing:
+                    object.__setattr__(self, '_object', self._target())
+                target = self._object
+        object.__setattr__(self, '_object', target)
+        return target
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        if self._object is _missing:
+            return f'<lazy {self._target if isinstance(self._target, str) else "object"}, not loaded>'
+        return repr(self._object)
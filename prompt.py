@@ -0,0 +1,164 @@
+""" Token-budget-aware prompt assembly
+Packs the alignment prompt, retrieved memories, recent conversation and the
+post prompt into the context window of the selected model. Token counts are
+computed once per message text and cached, and the running totals over the
+conversation are extended incrementally as messages are appended. A
+TurnContext keeps the prompt of one turn, so completions that follow AEI
+calls reuse its memory block and message prefix instead of rebuilding them."""
+
+from bisect import bisect_left
+
+try:
+    import tiktoken
+except ImportError:
+    # without tiktoken, token counts are estimated from text length
+    tiktoken = None
+
+# context window sizes in tokens. unknown models fall back to defaultWindow
+contextWindow = {
+    'gpt-4': 8192,
+    'gpt-4-0314': 8192,
+    'gpt-4-0613': 8192,
+    'gpt-4-32k': 32768,
+    'gpt-3.5-turbo': 4096,
+    'gpt-3.5-turbo-0613': 4096,
+    'gpt-3.5-turbo-16k': 16384,
+}
+defaultWindow = 4096
+
+# fraction of the prompt budget retrieved memories may use
+memoryShare = 0.35
+
+# per-message overhead of the chat format, and tokens priming the reply
+messageOverhead = 4
+replyOverhead = 3
+
+_encodings = {}
+_tokenCache = {}
+_tokenCacheSize = 50000
+
+
+def _encoding(model):
+    if tiktoken is None:
+        return None
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encodings[model] = tiktoken.get_encoding('cl100k_base')
+    return _encodings[model]
+
+
+def countTokens(message, model='gpt-4'):
+    # tokens a chat message costs in the prompt, cached by text
+    # takes: message dict with 'role' and 'content', model name
+    # returns: int
+
+    content = message['content']
+    key = (model, content)
+    count = _tokenCache.get(key)
+    if count is None:
+        encoding = _encoding(model)
+        count = (len(encoding.encode(content)) if encoding else len(content) // 4 + 1) + messageOverhead
+        if len(_tokenCache) >= _tokenCacheSize:
+            _tokenCache.clear()
+        _tokenCache[key] = count
+    return count
+
+
+def promptBudget(model, max_tokens):
+    # returns: tokens available to the prompt, leaving room for the response
+
+    return contextWindow.get(model, defaultWindow) - max_tokens - replyOverhead
+
+
+class PromptBuilder:
+    # assembles completion prompts within the model's token budget
+    # takes: alignment prompt messages, fraction of the budget memories may use
+
+    def __init__(self, alignmentPrompt, memoryShare=memoryShare):
+        self.alignmentPrompt = alignmentPrompt
+        self.memoryShare = memoryShare
+        self.model = None
+        # conversation messages already counted, and cumulative token counts over them (cum[i] = tokens in the first i)
+        self.tracked = []
+        self.cum = [0]
+
+    def _sync(self, conversation, model):
+        # extend the running totals to cover conversation. appends are counted incrementally;
+        # anything else (a deleted message, a model change) recounts from scratch
+
+        n = len(self.tracked)
+        if model != self.model or n > len(conversation) or (n and conversation[n-1] is not self.tracked[-1]):
+            self.model = model
+            self.tracked = []
+            self.cum = [0]
+        for message in conversation[len(self.tracked):]:
+            self.tracked.append(message)
+            self.cum.append(self.cum[-1] + countTokens(message, model))
+
+    def memoryBudget(self, model, max_tokens):
+        # returns: max tokens for the retrieved memory block
+
+        return int(promptBudget(model, max_tokens) * self.memoryShare)
+
+    def build(self, conversation, memory, postPrompt, extra=(), model='gpt-4', max_tokens=512):
+        # assemble a prompt: alignment + memory + as many recent messages as fit + extra + post prompt
+        # takes: session conversation (list of message dicts), memory messages from loadRes, post prompt messages,
+        #        messages to place after the conversation (e.g. tool results), model name, max response tokens
+        # returns: list of message dicts
+
+        start = self.window(conversation, self.alignmentPrompt + list(memory) + list(extra) + postPrompt, model, max_tokens)
+        return self.alignmentPrompt + list(memory) + conversation[start:] + list(extra) + postPrompt
+
+    def window(self, conversation, fixed, model='gpt-4', max_tokens=512):
+        # oldest conversation index whose suffix fits the budget next to the fixed messages; always keeps the newest message
+        # returns: int
+
+        self._sync(conversation, model)
+        available = promptBudget(model, max_tokens) - sum(countTokens(m, model) for m in fixed)
+        total = self.cum[-1]
+        start = bisect_left(self.cum, total - available) if available > 0 else len(conversation)
+        return min(start, max(len(conversation) - 1, 0))
+
+    def tokens(self, conversation, start, model='gpt-4'):
+        # returns: tokens of conversation[start:], from the running totals
+
+        self._sync(conversation, model)
+        return self.cum[-1] - self.cum[start]
+
+
+class TurnContext:
+    # the prompt of one turn. the first build fixes a prefix (alignment + memory + the conversation window); later
+    # builds in the turn, after AEI calls, send the identical prefix followed only by what was appended since, so
+    # memories are not retrieved again and provider-side prompt caching can match the prefix
+    # takes: PromptBuilder, memory messages from loadRes, model name, max response tokens
+
+    def __init__(self, builder, memory, model='gpt-4', max_tokens=512):
+        self.builder = builder
+        self.memory = list(memory)
+        self.model = model
+        self.max_tokens = max_tokens
+        # prefix messages, how many conversation messages they cover, and their token count
+        self.prefix = None
+        self.covered = 0
+        self.prefixTokens = 0
+
+    def build(self, conversation, postPrompt, extra=()):
+        # takes: session conversation, post prompt messages, messages to place after the conversation (e.g. tool results)
+        # returns: list of message dicts
+
+        model, extra = self.model, list(extra)
+        if self.prefix is not None and len(conversation) >= self.covered:
+            appended = conversation[self.covered:]
+            tail = sum(countTokens(m, model) for m in appended + extra + postPrompt)
+            if self.prefixTokens + tail <= promptBudget(model, self.max_tokens):
+                return self.prefix + appended + extra + postPrompt
+
+        # first build, or the appended messages no longer fit next to the old prefix: fix a new one
+        fixed = self.builder.alignmentPrompt + self.memory
+        start = self.builder.window(conversation, fixed + extra + postPrompt, model, self.max_tokens)
+        self.prefix = fixed + conversation[start:]
+        self.covered = len(conversation)
+        self.prefixTokens = sum(countTokens(m, model) for m in fixed) + self.builder.tokens(conversation, start, model)
+        return self.prefix + extra + postPrompt
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" Bulk reindex/backfill of chat.db ChatHistory into the vector index
+Streams every ChatHistory row with a cursor, strips the speaker and timestamp
+prefix (vectors are built from message text only, like currentText in chat.py),
+and sends multi-input embedding requests and multi-vector upserts with bounded
+concurrency. Each message goes to the index namespace of its owner. Progress is checkpointed in chat.db so an interrupted run resumes.
+
+    python reindex.py [--backend pinecone|local] [--index chat-test-1] [--batch 128] [--workers 4] [--restart]
+"""
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from sqlite3 import connect
+
+# max vectors per upsert request
+upsertChunk = 100
+
+
+def stripPrefix(message):
+    # remove the 'SPEAKER at timestring: ' prefix stored with each ChatHistory message
+    # takes: string
+    # returns: string
+
+    parts = message.split(': ', maxsplit=1)
+    if len(parts) == 2 and ' at ' in parts[0]:
+        return parts[1]
+    return message
+
+
+def streamRows(conn, afterRowid, batchSize):
+    # yield batches of ChatHistory rows in rowid order, without loading the table into memory. discarded messages are skipped
+    # takes: sqlite connection, rowid to resume after, rows per batch
+    # returns: generator of lists of (rowid, id, text, owner) tuples
+
+    cur = conn.cursor()
+    cur.execute('SELECT rowid, id, message, owner FROM ChatHistory WHERE rowid > ? AND discarded = 0 ORDER BY rowid', (afterRowid,))
+    while True:
+        rows = cur.fetchmany(batchSize)
+        if not rows:
+            break
+        yield [(r[0], r[1], stripPrefix(r[2] or ''), r[3]) for r in rows if r[1]]
+    cur.close()
+
+
+def loadCheckpoint(conn, name):
+    # returns: (last contiguous rowid done, rows done) for this index, or (0, 0)
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ReindexCheckpoint (
+            name TEXT PRIMARY KEY,
+            lastRowid INTEGER,
+            rows INTEGER,
+            updated REAL
+        )
+    ''')
+    conn.commit()
+    row = conn.execute('SELECT lastRowid, rows FROM ReindexCheckpoint WHERE name = ?', (name,)).fetchone()
+    return row if row else (0, 0)
+
+
+def saveCheckpoint(conn, name, lastRowid, rows):
+    conn.execute('INSERT OR REPLACE INTO ReindexCheckpoint (name, lastRowid, rows, updated) VALUES (?, ?, ?, ?)', (name, lastRowid, rows, time.time()))
+    conn.commit()
+
+
+def indexBatch(batch, embedBatch, vecdb, retries=3):
+    # embed one batch in a single request and upsert it in chunks, retrying with backoff
+    # takes: list of (rowid, id, text, owner), batch embedding function, vector index
+    # returns: number of vectors upserted
+
+    for attempt in range(retries):
+        try:
+            vectors = embedBatch([b[2] for b in batch])
+            spaces = {}
+            for b, v in zip(batch, vectors):
+                spaces.setdefault(b[3], []).append((b[1], v))
+            for namespace, payload in spaces.items():
+                for i in range(0, len(payload), upsertChunk):
+                    vecdb.upsert(payload[i:i+upsertChunk], namespace=namespace)
+            return len(batch)
+        except Exception:
+            if attempt == retries - 1:
+                raise
+            time.sleep(2 ** attempt)
+
+
+def reindex(embedBatch, vecdb, name, dbPath='chat.db', batchSize=128, workers=4, restart=False, report=10.0):
+    # reindex all ChatHistory rows into vecdb, keeping at most `workers` batches in flight
+    # takes: batch embedding function, vector index, checkpoint name, db path, rows per embedding request,
+    #        max concurrent batches, start over instead of resuming, seconds between progress reports
+    # returns: number of rows upserted in this run
+
+    conn = connect(dbPath)
+    lastRowid, doneTotal = loadCheckpoint(conn, name)
+    if restart:
+        lastRowid, doneTotal = 0, 0
+    total = conn.execute('SELECT COUNT(*) FROM ChatHistory WHERE rowid > ? AND discarded = 0', (lastRowid,)).fetchone()[0]
+    print(f'\nReindexing {total} messages into "{name}"' + (f' (resuming after rowid {lastRowid})' if lastRowid else ''))
+
+    started = time.time()
+    lastReport = started
+    done = 0
+    # batches complete out of order; the checkpoint only advances past a contiguous prefix of them
+    inflight = {}
+    finished = {}
+    order = []
+
+    def settle(futures):
+        nonlocal lastRowid, doneTotal, done
+        for f in futures:
+            first, last = inflight.pop(f)
+            finished[first] = (last, f.result())
+        while order and order[0] in finished:
+            last, count = finished.pop(order.pop(0))
+            lastRowid = last
+            done += count
+            doneTotal += count
+        saveCheckpoint(conn, name, lastRowid, doneTotal)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for batch in streamRows(conn, lastRowid, batchSize):
+            if not batch:
+                continue
+            while len(inflight) >= workers:
+                completed, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                settle(completed)
+            f = pool.submit(indexBatch, batch, embedBatch, vecdb)
+            inflight[f] = (batch[0][0], batch[-1][0])
+            order.append(batch[0][0])
+
+            now = time.time()
+            if now - lastReport >= report:
+                lastReport = now
+                print(f'{done}/{total} rows, {done / (now - started):.1f} rows/sec')
+        while inflight:
+            completed, _ = wait(inflight, return_when=FIRST_COMPLETED)
+            settle(completed)
+
+    elapsed = max(time.time() - started, 1e-9)
+    print(f'\nDone. {done} rows in {elapsed:.1f}s, {done / elapsed:.1f} rows/sec\n')
+    conn.close()
+    return done
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Reindex chat.db ChatHistory into the vector index.')
+    parser.add_argument('--backend', default=None, help='vector index backend, pinecone or local (default: vectorBackend in chat.py)')
+    parser.add_argument('--index', default=None, help='Pinecone index name (default: pineconeIndex in chat.py)')
+    parser.add_argument('--db', default='chat.db', help='path to the chat database')
+    parser.add_argument('--batch', type=int, default=128, help='messages per embedding request')
+    parser.add_argument('--workers', type=int, default=4, help='max concurrent embedding/upsert batches')
+    parser.add_argument('--restart', action='store_true', help='ignore the checkpoint and reindex everything')
+    args = parser.parse_args()
+
+    # reuse the keys and embedding model configured in chat.py
+    from chat import embedAdaBatch, openIndex, vectorBackend, pineconeIndex, localIndexPath
+
+    backend = args.backend or vectorBackend
+    name = args.index or pineconeIndex
+    vecdb = openIndex(backend, name)
+
+    # checkpoints are kept per target index
+    checkpoint = localIndexPath if backend == 'local' else name
+    reindex(embedAdaBatch, vecdb, backend + ':' + checkpoint, dbPath=args.db, batchSize=args.batch, workers=args.workers, restart=args.restart)
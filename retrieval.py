@@ -0,0 +1,49 @@
+""" Long-term memory retrieval
+Combines vector search with BM25 full-text search over ChatHistory using
+reciprocal-rank fusion. Lexical search is local, so when the vector service is
+slow or unavailable retrieval falls back to lexical results alone instead of
+stalling the turn."""
+
+from concurrent.futures import ThreadPoolExecutor
+
+# runs vector searches so a slow one can be abandoned at its deadline
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='retrieval')
+
+
+def fuseRanks(rankings, limit, k=60):
+    # reciprocal-rank fusion: each list contributes 1 / (k + rank) for every id it ranks
+    # takes: list of ranked id lists (best first), number of ids to return, rank damping constant
+    # returns: list of (id, fused score) tuples, best first
+
+    scores = {}
+    for ranking in rankings:
+        for rank, identifier in enumerate(ranking):
+            scores[identifier] = scores.get(identifier, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: -item[1])[:limit]
+
+
+def retrieve(store, query, vectorSearch, top_k, mode='hybrid', timeout=2.0, exclude=(), executor=None, owner=''):
+    # find the most relevant past messages for the newest user message
+    # takes: ChatStore, text for lexical search, function returning vector matches (dicts or Pinecone matches with 'id' and 'score'),
+    #        number of results, 'vector', 'hybrid' or 'lexical', seconds to wait for the vector search in hybrid mode,
+    #        collection of IDs to skip (e.g. the current session's), left out of both rankings before they are fused so
+    #        they do not take the place of other results, thread pool for the vector search (None: the module's),
+    #        user whose messages the lexical search looks in (vectorSearch must only search theirs as well)
+    # returns: dict with a 'matches' list of {'id', 'score'} dicts, the same shape as a vector query result
+
+    exclude = set(exclude)
+    if mode == 'vector':
+        return {'matches': [{'id': m['id'], 'score': m['score']} for m in vectorSearch() if m['id'] not in exclude][:top_k]}
+
+    if mode == 'lexical':
+        return {'matches': [{'id': i, 'score': s} for i, s in store.search(query, limit=top_k, exclude=exclude, owner=owner)]}
+
+    # hybrid: the vector search runs in the background while the lexical search runs here
+    future = (executor or _executor).submit(vectorSearch)
+    lexical = [i for i, s in store.search(query, limit=top_k, exclude=exclude, owner=owner)]
+    try:
+        vector = [m['id'] for m in future.result(timeout=timeout) if m['id'] not in exclude]
+    except Exception:
+        # slow or failing vector service: answer from the local index alone
+        vector = []
+    return {'matches': [{'id': i, 'score': s} for i, s in fuseRanks([vector, lexical], top_k)]}
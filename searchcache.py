@@ -0,0 +1,118 @@
+""" Search result cache for the search AEI
+Stores extracted result text in SQLite keyed by the normalized query, so
+repeated or near-identical searches within and across sessions skip the
+browser. Entries expire after a TTL; optionally an expired entry is served
+while a fresh copy is fetched in the background. Least recently used entries
+are evicted past maxEntries, and hits and misses are counted for tuning."""
+
+import re
+import threading
+import time
+import unicodedata
+from sqlite3 import connect
+
+
+def normalizeQuery(query):
+    # fold case, unicode forms, punctuation and whitespace so near-identical queries share an entry
+    # takes: string
+    # returns: string
+
+    query = unicodedata.normalize('NFKC', query).lower()
+    query = re.sub(r'[^\w\s:.+#@$%&/-]', ' ', query)
+    query = query.strip(' .')
+    return ' '.join(query.split())
+
+
+class SearchCache:
+    # persistent TTL cache of search results, safe to share between threads
+    # takes: path to sqlite db, seconds an entry stays fresh, whether to serve expired entries while refreshing,
+    #        seconds past the TTL an expired entry may still be served, max number of entries
+
+    def __init__(self, path='chat.db', ttl=6*3600, serveStale=True, staleFor=7*24*3600, maxEntries=1000):
+        self.ttl = ttl
+        self.serveStale = serveStale
+        self.staleFor = staleFor
+        self.maxEntries = maxEntries
+        self.counts = {'hits': 0, 'staleHits': 0, 'misses': 0, 'refreshes': 0, 'errors': 0}
+        self.refreshing = set()
+        self.lock = threading.Lock()
+
+        self.conn = connect(path, check_same_thread=False)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS SearchCache (
+                key TEXT PRIMARY KEY,
+                query TEXT,
+                result TEXT,
+                fetched REAL,
+                lastUsed REAL,
+                hits INTEGER DEFAULT 0
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS SearchCacheLastUsed ON SearchCache (lastUsed)')
+        self.conn.commit()
+
+    def lookup(self, query, fetch, variant=''):
+        # return the cached result for query, fetching (and caching) it when missing or expired
+        # takes: query string, function taking no args that returns fresh result text,
+        #        string identifying extraction settings that change the result (e.g. length)
+        # returns: result text
+
+        key = variant + '\x00' + normalizeQuery(query)
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute('SELECT result, fetched FROM SearchCache WHERE key = ?', (key,)).fetchone()
+            if row:
+                self.conn.execute('UPDATE SearchCache SET lastUsed = ?, hits = hits + 1 WHERE key = ?', (now, key))
+                self.conn.commit()
+
+        if row:
+            age = now - row[1]
+            if age < self.ttl:
+                self.counts['hits'] += 1
+                return row[0]
+            if self.serveStale and age < self.ttl + self.staleFor:
+                self.counts['staleHits'] += 1
+                self._refresh(key, query, fetch)
+                return row[0]
+
+        self.counts['misses'] += 1
+        result = fetch()
+        self._store(key, query, result)
+        return result
+
+    def _store(self, key, query, result):
+        now = time.time()
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO SearchCache (key, query, result, fetched, lastUsed, hits) VALUES (?, ?, ?, ?, ?, COALESCE((SELECT hits FROM SearchCache WHERE key = ?), 0))', (key, query, result, now, now, key))
+            count = self.conn.execute('SELECT COUNT(*) FROM SearchCache').fetchone()[0]
+            if count > self.maxEntries:
+                self.conn.execute('DELETE FROM SearchCache WHERE key IN (SELECT key FROM SearchCache ORDER BY lastUsed LIMIT ?)', (count - self.maxEntries,))
+            self.conn.commit()
+
+    def _refresh(self, key, query, fetch):
+        # fetch a fresh copy in the background, at most one refresh per key at a time
+
+        with self.lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+
+        def run():
+            try:
+                self._store(key, query, fetch())
+                self.counts['refreshes'] += 1
+            except Exception:
+                self.counts['errors'] += 1
+            finally:
+                with self.lock:
+                    self.refreshing.discard(key)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def stats(self):
+        # returns: dict of hit/miss counters, hit rate and number of entries
+
+        lookups = self.counts['hits'] + self.counts['staleHits'] + self.counts['misses']
+        with self.lock:
+            entries = self.conn.execute('SELECT COUNT(*) FROM SearchCache').fetchone()[0]
+        return dict(self.counts, hitRate=(lookups - self.counts['misses']) / lookups if lookups else 0.0, entries=entries)
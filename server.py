@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+""" Multi-user chat server
+Hosts many ChatSessions in one process over HTTP and WebSocket. Sessions share
+one set of Backends (vector index, upsert queue, browser pool, caches and
+worker threads) and the module-level chat store, so each extra user costs only
+their conversation. Turns run on a bounded thread pool, one at a time per
+session. Sessions keep at most maxMessages messages in memory, and sessions
+idle for longer than idleTimeout, or the least recently used ones past
+maxSessions, are closed; their messages stay in chat.db.
+
+Users are listed in a JSON file of user id -> access token, and every request
+needs one of the tokens, as 'Authorization: Bearer <token>' or, for WebSockets,
+whose browser clients cannot set headers, as ?token=<token>. A user only sees
+their own sessions, and their sessions only remember their own messages and
+summaries. The mail, calendar, inbox and file AEIs act on the Google account
+in token.json and the files of the host, so only the user named with --owner
+gets them; their memories are the ones the terminal chat keeps.
+
+    python server.py --users users.json [--owner NAME] [--host 127.0.0.1] [--port 8080] [--max-sessions 100] [--idle 1800] [--max-messages 200] [--workers 32]
+
+HTTP, JSON bodies:
+    POST   /sessions                  new session, optionally with settings, e.g. {"model": "gpt-4"} -> {"session": id}
+    POST   /sessions/{id}/messages    {"text": ...} -> {"response": ..., "output": ..., "seconds": ...}. turns over
+                                      HTTP cannot ask for confirmation, so sending mail and deleting events is declined
+    GET    /sessions/{id}/stats       the session's latency breakdown, like /stats/
+    DELETE /sessions/{id}             close a session. 409 while it runs a turn or has a WebSocket attached
+    GET    /metrics                   OpenMetrics totals of every session, for the owner only
+
+WebSocket, JSON messages:
+    GET /sessions/{id}/ws, or /ws for a new session. the server first sends {"type": "session", "session": id}.
+    the client sends {"type": "message", "text": ...}. the server streams {"type": "text", "text": ...} fragments
+    of the response and AEI notices, asks {"type": "confirm", "id": n, "question": ...}, answered with
+    {"type": "confirm", "id": n, "answer": true}, and ends each turn with {"type": "response", "text": ..., "seconds": ...}.
+"""
+
+import argparse
+import asyncio
+import hmac
+import io
+import itertools
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web, WSMsgType
+
+import chat
+
+# seconds a WebSocket client has to answer a confirmation before it counts as declined
+confirmTimeout = 120.0
+# where the id of the user a request authenticated as is kept. aiohttp before 3.12 keys requests by plain strings
+userKey = web.RequestKey('user', str) if hasattr(web, 'RequestKey') else 'user'
+
+
+class _SocketOutput:
+    # file-like stream that forwards a session's output to a WebSocket from the turn's worker thread
+
+    def __init__(self, loop, queue):
+        self.loop = loop
+        self.queue = queue
+
+    def write(self, text):
+        if text:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, {'type': 'text', 'text': text})
+
+    def flush(self):
+        pass
+
+
+def loadUsers(path):
+    # read the users file, a JSON object of user id -> access token
+    # returns: dict. raises ValueError if it is not one, or has an empty id or token
+
+    with open(path, 'r') as f:
+        users = json.load(f)
+    if not isinstance(users, dict) or not all(isinstance(u, str) and u and isinstance(t, str) and t for u, t in users.items()):
+        raise ValueError(f'{path} must be a JSON object of user id -> access token, neither of them empty')
+    return users
+
+
+class ChatServer:
+    # the sessions of one process, and the aiohttp application serving them
+    # takes: Backends, dict of user id -> access token, id of the user who owns the install's Google account, files
+    #        and terminal memories (None: nobody), max open sessions, seconds an idle session is kept, max messages a
+    #        session keeps in memory, max turns running at once
+
+    def __init__(self, backends, users, owner=None, maxSessions=100, idleTimeout=1800, maxMessages=200, workers=32):
+        if owner is not None and owner not in users:
+            raise ValueError(f'the owner {owner} is not a user')
+        self.backends = backends
+        self.users = dict(users)
+        self.owner = owner
+        self.maxSessions = maxSessions
+        self.idleTimeout = idleTimeout
+        self.maxMessages = maxMessages
+        # session id -> ChatSession, least recently used first
+        self.sessions = OrderedDict()
+        # session id -> id of the user it belongs to
+        self.sessionUsers = {}
+        self.locks = {}
+        self.sockets = {}
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='turn')
+
+        self.app = web.Application(middlewares=[self._authenticate])
+        self.app.add_routes([
+            web.post('/sessions', self.createHandler),
+            web.post('/sessions/{id}/messages', self.messageHandler),
+            web.get('/sessions/{id}/stats', self.statsHandler),
+            web.delete('/sessions/{id}', self.deleteHandler),
+            web.get('/sessions/{id}/ws', self.socketHandler),
+            web.get('/ws', self.socketHandler),
+            web.get('/metrics', self.metricsHandler),
+        ])
+        self.app.on_startup.append(self._startEviction)
+        self.app.on_cleanup.append(self._cleanup)
+
+    def authenticate(self, token):
+        # returns: id of the user token belongs to, or None. every token is compared, in constant time
+
+        user = None
+        for name, expected in self.users.items():
+            if token and hmac.compare_digest(token.encode(), expected.encode()):
+                user = name
+        return user
+
+    @web.middleware
+    async def _authenticate(self, request, handler):
+        header = request.headers.get('Authorization', '')
+        token = header[len('Bearer '):] if header.startswith('Bearer ') else None
+        if token is None and request.path.endswith('/ws'):
+            token = request.query.get('token')
+        request[userKey] = self.authenticate(token)
+        if request[userKey] is None:
+            raise web.HTTPUnauthorized(text='a valid access token is required', headers={'WWW-Authenticate': 'Bearer'})
+        return await handler(request)
+
+    def busy(self, sessionId):
+        # returns: whether a session is running a turn or has a WebSocket attached
+
+        return self.locks[sessionId].locked() or self.sockets.get(sessionId, 0) > 0
+
+    def create(self, user, settings=None):
+        # open a session, first closing the least recently used idle sessions past maxSessions
+        # takes: id of the user it belongs to, dict of ChatSession settings
+        # returns: ChatSession. raises web.HTTPServiceUnavailable when every session is busy
+
+        # the owner's memories are the install's (owner ''), every other user's are kept under their id
+        owner = '' if user == self.owner else user
+        try:
+            session = chat.ChatSession(self.backends, maxMessages=self.maxMessages, owner=owner, **(settings or {}))
+        except TypeError as e:
+            raise web.HTTPBadRequest(text=str(e))
+        while len(self.sessions) >= self.maxSessions:
+            idle = next((i for i in self.sessions if not self.busy(i)), None)
+            if idle is None:
+                session.close()
+                raise web.HTTPServiceUnavailable(text='too many active sessions')
+            self.close(idle)
+        self.sessions[session.id] = session
+        self.sessionUsers[session.id] = user
+        self.locks[session.id] = asyncio.Lock()
+        return session
+
+    def get(self, sessionId, user):
+        # returns: ChatSession, marked as most recently used. raises web.HTTPNotFound, also for another user's session
+
+        session = self.sessions.get(sessionId)
+        if session is None or self.sessionUsers[sessionId] != user:
+            raise web.HTTPNotFound(text='no such session')
+        self.sessions.move_to_end(sessionId)
+        return session
+
+    def close(self, sessionId):
+        session = self.sessions.pop(sessionId, None)
+        self.sessionUsers.pop(sessionId, None)
+        self.locks.pop(sessionId, None)
+        if session is not None:
+            session.close()
+
+    async def turn(self, session, text, out, confirm):
+        # run one turn of a session on the worker pool, after any turn of the session already running
+        # returns: response text, seconds the turn took
+
+        async with self.locks[session.id]:
+            session.out, session.confirm = out, confirm
+            start = time.perf_counter()
+            response = await asyncio.get_running_loop().run_in_executor(self.executor, session.turn, text)
+            return response, time.perf_counter() - start
+
+    def evictIdle(self):
+        # close sessions idle for longer than idleTimeout
+        # returns: number of sessions closed
+
+        cutoff = time.time() - self.idleTimeout
+        stale = [i for i, s in self.sessions.items() if s.lastUsed < cutoff and not self.busy(i)]
+        for sessionId in stale:
+            self.close(sessionId)
+        return len(stale)
+
+    async def _evictLoop(self):
+        while True:
+            await asyncio.sleep(max(self.idleTimeout / 4, 1.0))
+            self.evictIdle()
+
+    async def _startEviction(self, app):
+        self.evictor = asyncio.create_task(self._evictLoop())
+
+    async def _cleanup(self, app):
+        self.evictor.cancel()
+        for sessionId in list(self.sessions):
+            self.close(sessionId)
+        self.executor.shutdown(wait=False)
+
+    async def _body(self, request):
+        if not request.can_read_body:
+            return {}
+        try:
+            body = await request.json()
+        except ValueError:
+            raise web.HTTPBadRequest(text='body must be JSON')
+        if not isinstance(body, dict):
+            raise web.HTTPBadRequest(text='body must be a JSON object')
+        return body
+
+    async def createHandler(self, request):
+        session = self.create(request[userKey], await self._body(request))
+        return web.json_response({'session': session.id})
+
+    async def messageHandler(self, request):
+        session = self.get(request.match_info['id'], request[userKey])
+        text = (await self._body(request)).get('text')
+        if not isinstance(text, str) or not text:
+            raise web.HTTPBadRequest(text='text is required')
+        out = io.StringIO()
+        response, seconds = await self.turn(session, text, out, None)
+        return web.json_response({'response': response, 'output': out.getvalue(), 'seconds': seconds})
+
+    async def statsHandler(self, request):
+        session = self.get(request.match_info['id'], request[userKey])
+        return web.json_response(dict(session.tracer.summary(), messages=len(session.currentConvo)))
+
+    async def deleteHandler(self, request):
+        self.get(request.match_info['id'], request[userKey])
+        # a session running a turn (or serving a WebSocket) cannot be closed under it
+        if self.busy(request.match_info['id']):
+            raise web.HTTPConflict(text='the session is busy')
+        self.close(request.match_info['id'])
+        return web.json_response({'closed': True})
+
+    async def metricsHandler(self, request):
+        # the totals cover every user's sessions
+        if self.owner is None or request[userKey] != self.owner:
+            raise web.HTTPForbidden(text='only the owner can read the metrics')
+        return web.Response(text=chat.tracer.openMetrics(), content_type='application/openmetrics-text')
+
+    async def socketHandler(self, request):
+        user = request[userKey]
+        session = self.get(request.match_info['id'], user) if 'id' in request.match_info else self.create(user)
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        out = _SocketOutput(loop, queue)
+        answers = {}
+        ids = itertools.count(1)
+        tasks = set()
+        # set once the client is gone, so no turn waits confirmTimeout for an answer that cannot come
+        gone = threading.Event()
+
+        def confirm(question):
+            # called from the turn's worker thread: ask the client and wait for its answer
+            if gone.is_set():
+                return False
+            future = asyncio.run_coroutine_threadsafe(ask(question), loop)
+            try:
+                return bool(future.result(timeout=confirmTimeout))
+            except Exception:
+                future.cancel()
+                return False
+
+        async def ask(question):
+            if gone.is_set() or ws.closed:
+                return False
+            n = next(ids)
+            answers[n] = loop.create_future()
+            queue.put_nowait({'type': 'confirm', 'id': n, 'question': question})
+            try:
+                return await answers[n]
+            finally:
+                answers.pop(n, None)
+
+        async def send():
+            # one sender keeps streamed text, questions and responses in order
+            while True:
+                await ws.send_json(await queue.get())
+
+        async def runTurn(text):
+            try:
+                response, seconds = await self.turn(session, text, out, confirm)
+                queue.put_nowait({'type': 'response', 'text': response, 'seconds': seconds})
+            except Exception as e:
+                queue.put_nowait({'type': 'error', 'error': str(e)})
+
+        self.sockets[session.id] = self.sockets.get(session.id, 0) + 1
+        sender = asyncio.create_task(send())
+        queue.put_nowait({'type': 'session', 'session': session.id})
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+                try:
+                    data = msg.json()
+                    kind = data.get('type')
+                except (ValueError, AttributeError):
+                    queue.put_nowait({'type': 'error', 'error': 'messages must be JSON objects'})
+                    continue
+                if kind == 'message' and isinstance(data.get('text'), str) and data['text']:
+                    task = asyncio.create_task(runTurn(data['text']))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                elif kind == 'confirm' and data.get('id') in answers:
+                    if not answers[data['id']].done():
+                        answers[data['id']].set_result(bool(data.get('answer')))
+                else:
+                    queue.put_nowait({'type': 'error', 'error': 'unknown message'})
+        finally:
+            # turns still running finish, declining what they still ask; their responses are dropped with the connection
+            gone.set()
+            for future in answers.values():
+                if not future.done():
+                    future.set_result(False)
+            self.sockets[session.id] -= 1
+            if not self.sockets[session.id]:
+                del self.sockets[session.id]
+            sender.cancel()
+        return ws
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Serve chat sessions over HTTP and WebSocket.')
+    parser.add_argument('--users', required=True, help='JSON file of user id -> access token')
+    parser.add_argument('--owner', default=None, help='user who gets the mail, calendar, inbox and file AEIs, and the terminal chat\'s memories')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-sessions', type=int, default=100, help='max open sessions; the least recently used idle ones are closed first')
+    parser.add_argument('--idle', type=float, default=1800, help='seconds an idle session is kept')
+    parser.add_argument('--max-messages', type=int, default=200, help='max messages a session keeps in memory')
+    parser.add_argument('--workers', type=int, default=32, help='max turns running at once')
+    args = parser.parse_args()
+    users = loadUsers(args.users)
+    if args.owner is not None and args.owner not in users:
+        parser.error(f'--owner {args.owner} is not in {args.users}')
+
+    # every turn running at once may run its AEI calls, each session at most aeiWorkers of them
+    backends = chat.Backends(aeiThreads=args.workers * chat.aeiWorkers)
+    server = ChatServer(backends, users, owner=args.owner, maxSessions=args.max_sessions, idleTimeout=args.idle, maxMessages=args.max_messages, workers=args.workers)
+    try:
+        web.run_app(server.app, host=args.host, port=args.port)
+    finally:
+        # upsert whatever the sessions left in the queue
+        backends.close(flush=True)
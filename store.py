@@ -0,0 +1,220 @@
+""" Chat history storage
+Keeps one long-lived WAL-mode connection to chat.db, owns the ChatHistory
+schema (id primary key, timestamp index), migrates databases created by older
+versions, and fetches all matches for a vector query in a single lookup.
+An FTS5 index over the message text (speaker and timestamp prefix stripped)
+is kept in sync by triggers for lexical search. Summaries of older messages
+are stored as ChatHistory rows with speaker SUMMARY, so they are embedded,
+indexed and retrieved like messages; the Summary and SummaryMember tables
+record their level and which messages (or summaries) each one covers.
+Messages of a session the user discarded stay in ChatHistory marked as
+discarded, and are never found or loaded as memories again. Every row has an
+owner, the user whose memory it is ('' for the owner of the install), and
+searches and lookups only ever return the rows of one owner."""
+
+import re
+import threading
+from sqlite3 import connect
+
+# max bound parameters per IN (...) query
+chunkSize = 500
+
+
+def _strippedSql(row):
+    # message text without the 'SPEAKER at timestring: ' prefix, as an SQL expression. matches reindex.stripPrefix
+    # takes: table or trigger row alias, e.g. 'new'
+    # returns: string
+
+    return (f"CASE WHEN instr(substr({row}.message, 1, instr({row}.message, ': ')), ' at ') > 0 "
+            f"THEN substr({row}.message, instr({row}.message, ': ') + 2) ELSE {row}.message END")
+
+
+class ChatStore:
+    # long-lived connection to the chat database, safe to share between threads
+    # takes: path to sqlite db
+
+    def __init__(self, path='chat.db'):
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        # INSERT OR REPLACE must fire the delete trigger so the FTS index drops the replaced row
+        self.conn.execute('PRAGMA recursive_triggers=ON')
+        self.migrate()
+
+    def migrate(self):
+        # create ChatHistory, or rebuild a table from before it had a primary key. duplicate ids keep their first row
+
+        with self.lock:
+            columns = self.conn.execute('PRAGMA table_info(ChatHistory)').fetchall()
+            if columns and not any(c[1] == 'id' and c[5] for c in columns):
+                print('\nMigrating ChatHistory to an indexed schema...')
+                with self.conn:
+                    self.conn.execute('ALTER TABLE ChatHistory RENAME TO ChatHistoryOld')
+                    self._create()
+                    self.conn.execute('''
+                        INSERT OR IGNORE INTO ChatHistory (id, message, speaker, timestamp, timestring)
+                        SELECT id, message, speaker, timestamp, timestring FROM ChatHistoryOld WHERE id IS NOT NULL ORDER BY rowid
+                    ''')
+                    self.conn.execute('DROP TABLE ChatHistoryOld')
+                    # rowids changed, so reindex checkpoints no longer point at the right rows
+                    for checkpoints in ('ReindexCheckpoint', 'CompactionCheckpoint'):
+                        if self.conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (checkpoints,)).fetchone():
+                            self.conn.execute(f'DELETE FROM {checkpoints}')
+                print('Done')
+            else:
+                with self.conn:
+                    self._create()
+
+    def _create(self):
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS ChatHistory (
+                id TEXT PRIMARY KEY,
+                message TEXT,
+                speaker TEXT,
+                timestamp TEXT,
+                timestring TEXT,
+                discarded INTEGER NOT NULL DEFAULT 0,
+                owner TEXT NOT NULL DEFAULT ''
+            )
+        ''')
+        columns = [c[1] for c in self.conn.execute('PRAGMA table_info(ChatHistory)')]
+        if 'discarded' not in columns:
+            self.conn.execute('ALTER TABLE ChatHistory ADD COLUMN discarded INTEGER NOT NULL DEFAULT 0')
+        # rows from before there were several users belong to the owner of the install
+        if 'owner' not in columns:
+            self.conn.execute("ALTER TABLE ChatHistory ADD COLUMN owner TEXT NOT NULL DEFAULT ''")
+        self.conn.execute('CREATE INDEX IF NOT EXISTS ChatHistoryTimestamp ON ChatHistory (timestamp)')
+
+        # summary rows in ChatHistory: their level ('topic' or 'day') and day, and the rows each one covers
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS Summary (
+                id TEXT PRIMARY KEY,
+                level TEXT,
+                day TEXT,
+                members INTEGER
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS SummaryMember (
+                memberId TEXT PRIMARY KEY,
+                summaryId TEXT
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS SummaryMemberSummary ON SummaryMember (summaryId)')
+
+        exists = self.conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='ChatHistoryFts'").fetchone()
+        if not exists:
+            # fts rowids mirror ChatHistory rowids, so the triggers can keep them in sync without a lookup
+            self.conn.execute('CREATE VIRTUAL TABLE ChatHistoryFts USING fts5(id UNINDEXED, text)')
+            self.conn.execute(f'INSERT INTO ChatHistoryFts (rowid, id, text) SELECT rowid, id, {_strippedSql("ChatHistory")} FROM ChatHistory')
+        self.conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS ChatHistoryFtsInsert AFTER INSERT ON ChatHistory BEGIN
+                INSERT INTO ChatHistoryFts (rowid, id, text) VALUES (new.rowid, new.id, {_strippedSql("new")});
+            END
+        ''')
+        self.conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS ChatHistoryFtsDelete AFTER DELETE ON ChatHistory BEGIN
+                DELETE FROM ChatHistoryFts WHERE rowid = old.rowid;
+            END
+        ''')
+        self.conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS ChatHistoryFtsUpdate AFTER UPDATE OF message ON ChatHistory BEGIN
+                UPDATE ChatHistoryFts SET text = {_strippedSql("new")} WHERE rowid = old.rowid;
+            END
+        ''')
+
+    def insert(self, identifier, message, speaker, timestamp, timestring, owner=''):
+        # store one message
+        # takes: chat/vector ID, message with speaker and timestamp, speaker, unix timestamp, formatted timestamp,
+        #        user whose memory it is ('': the owner of the install)
+
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO ChatHistory (id, message, speaker, timestamp, timestring, owner) VALUES (?, ?, ?, ?, ?, ?)', (identifier, message, speaker, timestamp, timestring, owner))
+
+    def fetch(self, ids, owner=''):
+        # load messages by id with primary key lookups, one query per chunkSize ids
+        # takes: list of chat/vector IDs, e.g. in match score order, user whose messages to load
+        # returns: list of ChatHistory rows (id, message, speaker, timestamp, timestring) in the order of ids. missing and
+        #          discarded ids, and those of other users, are skipped
+
+        ids = list(dict.fromkeys(ids))
+        found = {}
+        with self.lock:
+            for i in range(0, len(ids), chunkSize):
+                chunk = ids[i:i+chunkSize]
+                marks = ','.join('?' * len(chunk))
+                for row in self.conn.execute(f'SELECT id, message, speaker, timestamp, timestring FROM ChatHistory WHERE id IN ({marks}) AND discarded = 0 AND owner = ?', chunk + [owner]):
+                    found[row[0]] = row
+        return [found[i] for i in ids if i in found]
+
+    def addSummary(self, identifier, message, timestamp, timestring, level, day, members, owner=''):
+        # store a summary as a SUMMARY message, with the ids of the messages or summaries it covers
+        # takes: chat/vector ID, summary with speaker and timestamp, unix timestamp, formatted timestamp,
+        #        'topic' or 'day', date string, list of covered IDs, user whose messages it summarizes
+
+        members = list(members)
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO ChatHistory (id, message, speaker, timestamp, timestring, owner) VALUES (?, ?, ?, ?, ?, ?)', (identifier, message, 'SUMMARY', timestamp, timestring, owner))
+            self.conn.execute('INSERT OR REPLACE INTO Summary (id, level, day, members) VALUES (?, ?, ?, ?)', (identifier, level, day, len(members)))
+            self.conn.executemany('INSERT OR REPLACE INTO SummaryMember (memberId, summaryId) VALUES (?, ?)', [(m, identifier) for m in members])
+
+    def summaryOf(self, ids):
+        # find the summaries covering messages (or covering topic summaries)
+        # takes: list of chat/vector IDs
+        # returns: dict of ID -> ID of the summary covering it, for the IDs that have one
+
+        ids = list(dict.fromkeys(ids))
+        found = {}
+        with self.lock:
+            for i in range(0, len(ids), chunkSize):
+                chunk = ids[i:i+chunkSize]
+                marks = ','.join('?' * len(chunk))
+                found.update(self.conn.execute(f'SELECT memberId, summaryId FROM SummaryMember WHERE memberId IN ({marks})', chunk).fetchall())
+        return found
+
+    def search(self, query, limit=20, exclude=(), owner=''):
+        # BM25 full-text search over one user's message text, leaving out discarded messages. any term may match; rarer
+        # terms weigh more
+        # takes: free text, max number of results, collection of IDs to skip, user whose messages to search
+        # returns: list of (id, score) tuples, best first. score is the negated bm25 rank, higher is better
+
+        terms = re.findall(r'\w+', query.lower())
+        if not terms:
+            return []
+        match = ' OR '.join('"' + t + '"' for t in dict.fromkeys(terms))
+        exclude = set(exclude)
+        with self.lock:
+            rows = self.conn.execute('''
+                SELECT f.id, bm25(ChatHistoryFts) FROM ChatHistoryFts f JOIN ChatHistory h ON h.rowid = f.rowid
+                WHERE ChatHistoryFts MATCH ? AND h.discarded = 0 AND h.owner = ? ORDER BY bm25(ChatHistoryFts) LIMIT ?
+            ''', (match, owner, limit + len(exclude))).fetchall()
+        return [(r[0], -r[1]) for r in rows if r[0] not in exclude][:limit]
+
+    def discard(self, ids):
+        # mark messages as discarded, e.g. those of a session quit with /qd/. they stay in chat.db, but are no
+        # longer searched, loaded, reindexed or summarized
+        # takes: list of chat/vector IDs
+
+        ids = list(ids)
+        with self.lock, self.conn:
+            for i in range(0, len(ids), chunkSize):
+                chunk = ids[i:i+chunkSize]
+                marks = ','.join('?' * len(chunk))
+                self.conn.execute(f'UPDATE ChatHistory SET discarded = 1 WHERE id IN ({marks})', chunk)
+
+    def delete(self, ids):
+        # remove messages and their full-text entries
+        # takes: list of chat/vector IDs
+
+        ids = list(ids)
+        with self.lock, self.conn:
+            for i in range(0, len(ids), chunkSize):
+                chunk = ids[i:i+chunkSize]
+                marks = ','.join('?' * len(chunk))
+                self.conn.execute(f'DELETE FROM ChatHistory WHERE id IN ({marks})', chunk)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,32 @@
+""" Shared fixtures
+chat.py opens chat.db and its caches in the working directory when it is
+imported, so every test runs in its own directory with a fresh store and the
+fake OpenAI client from benchmarks/fakes.py."""
+
+import os
+import shutil
+import sys
+
+import pytest
+
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, here)
+
+
+@pytest.fixture
+def chat(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    shutil.copy(os.path.join(here, 'alignmentPrompt.txt'), tmp_path)
+    import chat
+    from benchmarks import fakes
+    from embedcache import EmbeddingCache
+    from store import ChatStore
+
+    monkeypatch.setattr(chat, 'chatStore', ChatStore('chat.db'))
+    monkeypatch.setattr(chat, 'embedCache', EmbeddingCache('embeddings.db'))
+    monkeypatch.setattr(chat, 'openai', fakes.FakeOpenAI())
+    monkeypatch.setattr(chat, 'stream', False)
+    monkeypatch.setattr(chat, 'compactAt', None)
+    monkeypatch.setattr(chat, 'memoryCompactInterval', None)
+    yield chat
+    chat.chatStore.close()
@@ -0,0 +1,42 @@
+from benchmarks import fakes
+from calcache import CalendarCache
+
+
+class Service(fakes.FakeGoogleService):
+    # calendar service whose list responses carry the calendar's time zone, like the Calendar API's
+    def __init__(self, items, timeZone):
+        super().__init__(events=0)
+        self.items = items
+        self.timeZone = timeZone
+
+    def events(self):
+        events = super().events()
+        listed = events.list
+
+        def list(**kwargs):
+            request = listed(**kwargs)
+            request.result = dict(request.result, timeZone=self.timeZone)
+            return request
+        events.list = list
+        return events
+
+
+def test_all_day_event_uses_calendar_time_zone(tmp_path):
+    allDay = {'id': 'holiday', 'summary': 'Day off', 'start': {'date': '2023-04-05'}, 'end': {'date': '2023-04-06'}}
+    service = Service([allDay], 'America/Los_Angeles')
+    cache = CalendarCache(lambda: service, path=str(tmp_path / 'chat.db'))
+
+    # Apr 4 local time, ending just before local midnight: Apr 5 00:00 UTC falls inside it, the event does not
+    assert cache.view('2023-04-04T00:00:00-07:00', '2023-04-04T23:59:59-07:00') == []
+    assert [e['id'] for e in cache.view('2023-04-05T00:00:00-07:00', '2023-04-05T23:59:59-07:00')] == ['holiday']
+    # the last evening hour of the event is still Apr 5 locally
+    assert [e['id'] for e in cache.view('2023-04-05T23:00:00-07:00', '2023-04-06T01:00:00-07:00')] == ['holiday']
+    assert cache.view('2023-04-06T00:00:00-07:00', '2023-04-06T12:00:00-07:00') == []
+
+
+def test_cached_all_day_events_move_when_time_zone_is_learned(tmp_path):
+    allDay = {'id': 'holiday', 'summary': 'Day off', 'start': {'date': '2023-04-05'}, 'end': {'date': '2023-04-06'}}
+    cache = CalendarCache(lambda: Service([], 'America/Los_Angeles'), path=str(tmp_path / 'chat.db'))
+    # written through before any sync, so placed at UTC midnight
+    cache.put(allDay)
+    assert cache.view('2023-04-04T00:00:00-07:00', '2023-04-04T23:59:59-07:00') == []
@@ -0,0 +1,88 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from compaction import MemoryCompactor
+from store import ChatStore
+
+
+def fill(store, day, owner=''):
+    # two topics of four messages each on one day
+    start = datetime.combine(day, datetime.min.time()).timestamp() + 9 * 3600
+    for i in range(8):
+        timestamp = start + i * 60 + (i >= 4) * 7200
+        store.insert(f'{owner}m{i}', f'USER at x: message {i}', 'USER', timestamp, 'x', owner)
+
+
+def summaries(store):
+    return store.conn.execute("SELECT id FROM ChatHistory WHERE speaker = 'SUMMARY' ORDER BY id").fetchall()
+
+
+def test_summary_is_not_stored_when_queueing_fails(tmp_path):
+    store = ChatStore(str(tmp_path / 'chat.db'))
+    yesterday = date.today() - timedelta(days=1)
+    fill(store, yesterday)
+
+    def stopped(identifier, text, owner):
+        raise RuntimeError('queue stopped')
+
+    compactor = MemoryCompactor(store, lambda instruction, text: 'summary', stopped, dbPath=str(tmp_path / 'chat.db'))
+    with pytest.raises(RuntimeError):
+        compactor.runOnce()
+    assert summaries(store) == []
+    assert compactor.conn.execute('SELECT * FROM CompactionCheckpoint').fetchall() == []
+
+    # the next run summarizes the day, and a day summarized twice keeps one set of summaries
+    queued = []
+    compactor.queue = lambda identifier, text, owner: queued.append(identifier)
+    assert compactor.runOnce() == 1
+    stored = summaries(store)
+    assert len(stored) == 3 and sorted(queued) == [s[0] for s in stored]
+    with compactor.conn:
+        compactor.conn.execute('DELETE FROM CompactionCheckpoint')
+    assert compactor.runOnce() == 1
+    assert summaries(store) == stored
+
+    compactor.stop()
+    store.close()
+
+
+def test_each_user_gets_their_own_summaries(tmp_path):
+    store = ChatStore(str(tmp_path / 'chat.db'))
+    yesterday = date.today() - timedelta(days=1)
+    fill(store, yesterday)
+    fill(store, yesterday, owner='bob')
+
+    queued = []
+    compactor = MemoryCompactor(store, lambda instruction, text: 'summary', lambda *args: queued.append(args), dbPath=str(tmp_path / 'chat.db'))
+    assert compactor.runOnce() == 1
+    owners = store.conn.execute("SELECT owner, COUNT(*) FROM ChatHistory WHERE speaker = 'SUMMARY' GROUP BY owner").fetchall()
+    assert sorted(owners) == [('', 3), ('bob', 3)]
+    assert sorted(owner for identifier, text, owner in queued) == [''] * 3 + ['bob'] * 3
+    # a topic summary only covers messages of its own user
+    for summaryId, owner in store.conn.execute("SELECT id, owner FROM ChatHistory WHERE speaker = 'SUMMARY'").fetchall():
+        members = [m for m, s in store.conn.execute('SELECT memberId, summaryId FROM SummaryMember WHERE summaryId = ?', (summaryId,))]
+        assert members and len(store.fetch(members, owner=owner)) == len(members)
+
+    compactor.stop()
+    store.close()
+
+
+def test_a_failed_conversation_summary_is_reported_to_the_session():
+    from concurrent.futures import ThreadPoolExecutor
+
+    from compaction import ConversationCompactor
+
+    def failing(instruction, text):
+        raise RuntimeError('rate limited')
+
+    shown = []
+    executor = ThreadPoolExecutor(max_workers=1)
+    compactor = ConversationCompactor(failing, executor, threshold=10, keep=1, show=shown.append)
+    conversation = [{'role': 'user', 'content': f'USER at x: message {i}'} for i in range(4)]
+    assert compactor.check(conversation, 100)
+    compactor.future.exception()
+    assert not compactor.apply(conversation)
+    assert len(conversation) == 4
+    assert shown == ['\nAn error occurred while summarizing the conversation: rate limited']
+    executor.shutdown()
@@ -0,0 +1,64 @@
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dispatch import AeiRegistry, Arg
+
+
+def test_handler_errors_go_to_the_session_output(capsys):
+    out = io.StringIO()
+    registry = AeiRegistry({'/;FAIL;/': (Arg('text', 'rest'),), '/;ECHO;/': (Arg('text', 'rest'),)}, show=out.write)
+
+    def fail(text):
+        raise RuntimeError('quota exceeded')
+    registry.register('/;FAIL;/', fail)
+    registry.register('/;ECHO;/', lambda text: text)
+
+    calls, errors = registry.parseAll('/;FAIL;/a\n/;ECHO;/b')
+    results = registry.runAll(calls)
+    registry.close()
+
+    assert results == ['An error occurred in /;FAIL;/: quota exceeded', 'b']
+    assert 'An error occurred in /;FAIL;/: quota exceeded' in out.getvalue()
+    assert capsys.readouterr().out == ''
+
+
+def test_a_registry_runs_at_most_workers_calls_on_a_shared_pool():
+    shared = ThreadPoolExecutor(max_workers=8)
+    running, most = [0], [0]
+    lock = threading.Lock()
+
+    def slow(text):
+        with lock:
+            running[0] += 1
+            most[0] = max(most[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        return text
+
+    registry = AeiRegistry({'/;SLOW;/': (Arg('text', 'rest'),)}, workers=2, executor=shared)
+    other = AeiRegistry({'/;SLOW;/': (Arg('text', 'rest'),)}, workers=2, executor=shared)
+    registry.register('/;SLOW;/', slow)
+    other.register('/;SLOW;/', lambda text: text)
+
+    calls, errors = registry.parseAll('\n'.join(f'/;SLOW;/{i}' for i in range(6)))
+    pending = shared.submit(registry.runAll, calls)
+    # the other registry still gets pool threads while the first one is busy
+    assert other.runAll(other.parseAll('/;SLOW;/a\n/;SLOW;/b')[0]) == ['a', 'b']
+    assert pending.result() == [str(i) for i in range(6)]
+    assert most[0] == 2
+    shared.shutdown()
+
+
+def test_file_aeis_report_to_the_session_output(tmp_path, monkeypatch, capsys):
+    from aei import rtxt, wtxt
+
+    monkeypatch.chdir(tmp_path)
+    out = io.StringIO()
+    assert wtxt('hello', 'note', show=out.write) == 'You successfully wrote the text file.'
+    assert rtxt('note', show=out.write).endswith('hello')
+    rtxt('missing', show=out.write)
+    assert out.getvalue() == '\nText written to note.txt.\nAssistant read note.txt.\nAn error occurred in reading missing.txt.'
+    assert capsys.readouterr().out == ''
@@ -0,0 +1,52 @@
+import json
+import uuid
+
+from googleapiclient.discovery import build
+from googleapiclient.http import HttpMockSequence
+
+import aei
+
+boundary = 'batch_boundary'
+
+
+def batchResponse(parts):
+    # multipart batch response body from (thread id, status, json body) parts
+    body = ''
+    for threadId, status, content in parts:
+        body += (f'--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-base + {threadId}>\r\n\r\n'
+                 f'HTTP/1.1 {status} {"OK" if status == 200 else "Error"}\r\nContent-Type: application/json\r\n\r\n{json.dumps(content)}\r\n')
+    return ({'status': '200', 'content-type': f'multipart/mixed; boundary={boundary}'}, body + f'--{boundary}--')
+
+
+def thread(threadId, subject):
+    return {'id': threadId, 'messages': [{'payload': {'headers': [{'name': 'Subject', 'value': subject}]}}]}
+
+
+def test_failed_batch_parts_are_retried_and_reported(monkeypatch):
+    # batch content ids are built from a random base; fix it so the canned responses match
+    monkeypatch.setattr(uuid, 'uuid4', lambda: 'base')
+    error = {'error': {'code': 500, 'message': 'backend error'}}
+    listing = {'threads': [{'id': t, 'snippet': 'snippet ' + t} for t in ('t1', 't2', 't3', 't4')]}
+    http = HttpMockSequence([
+        ({'status': '200'}, json.dumps(listing)),
+        # t2 and t3 fail in the first batch; t2 loads on the retry, t3 fails again
+        batchResponse([('t1', 200, thread('t1', 'First')), ('t2', 500, error), ('t3', 500, error), ('t4', 200, thread('t4', 'Fourth'))]),
+        batchResponse([('t2', 200, thread('t2', 'Second')), ('t3', 500, error)]),
+    ])
+    service = build('gmail', 'v1', http=http, static_discovery=True, cache_discovery=False)
+
+    failed = []
+    threads = list(aei.iterInbox(maxThreads=4, service=service, failed=failed))
+    assert [t['subject'] for t in threads] == ['First', 'Second', 'Fourth']
+    assert failed == ['t3']
+
+
+def test_inbox_summary_reports_unloaded_threads(monkeypatch):
+    def iterInbox(query=None, maxThreads=None, failed=None):
+        failed.extend(['t3', 't5'])
+        yield {'id': 't1', 'subject': 'First', 'snippet': 'hello', 'messages': 2}
+
+    monkeypatch.setattr(aei, 'iterInbox', iterInbox)
+    summary = aei.loadInbox()
+    assert 'threadId: t1' in summary
+    assert summary.endswith('2 matching threads could not be loaded.')
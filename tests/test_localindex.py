@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from localindex import LocalIndex
+
+
+def vectors(n, dim=32, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+
+
+def ids(result):
+    return [m['id'] for m in result['matches']]
+
+
+def test_reopened_index_answers_the_same(tmp_path):
+    data = vectors(200)
+    index = LocalIndex(str(tmp_path / 'v'), dim=32, partitionAt=0, quantize='int8')
+    index.upsert([(f'v{i}', data[i]) for i in range(len(data))])
+    index.delete(ids=['v0', 'v1'])
+    before = [index.query(q, top_k=5) for q in data[:10]]
+
+    reopened = LocalIndex(str(tmp_path / 'v'))
+    assert reopened.quantize == 'int8'
+    assert reopened.describe_index_stats()['total_vector_count'] == 198
+    after = [reopened.query(q, top_k=5) for q in data[:10]]
+    assert [ids(r) for r in after] == [ids(r) for r in before]
+    assert [m['score'] for r in after for m in r['matches']] == pytest.approx([m['score'] for r in before for m in r['matches']], abs=1e-6)
+    # tombstoned rows stay gone, and never shorten a result
+    assert not {'v0', 'v1'} & set(ids(reopened.query(data[0], top_k=198)))
+    assert len(ids(reopened.query(data[0], top_k=198))) == 198
+
+
+def test_upsert_overwrites_an_existing_id(tmp_path):
+    data = vectors(3)
+    index = LocalIndex(str(tmp_path / 'v'), dim=32, partitionAt=0)
+    index.upsert([('a', data[0]), ('b', data[1])])
+    index.upsert([('a', data[2])])
+
+    assert index.describe_index_stats()['total_vector_count'] == 2
+    best = index.query(data[2], top_k=1, include_values=True)['matches'][0]
+    assert best['id'] == 'a' and best['score'] == pytest.approx(1.0, abs=1e-5)
+    assert np.allclose(best['values'], data[2] / np.linalg.norm(data[2]), atol=1e-6)
+    reopened = LocalIndex(str(tmp_path / 'v')).query(data[2], top_k=1)['matches']
+    assert ids({'matches': reopened}) == ['a'] and reopened[0]['score'] == pytest.approx(1.0, abs=1e-5)
+
+
+@pytest.mark.parametrize('quantize', ['none', 'float16', 'int8'])
+def test_recall_against_brute_force(tmp_path, quantize):
+    data = vectors(3000)
+    queries = list(vectors(50, seed=1))
+    index = LocalIndex(str(tmp_path / quantize), dim=32, partitionAt=0, quantize=quantize)
+    index.upsert([(f'v{i}', data[i]) for i in range(len(data))])
+
+    # quantized first passes are re-ranked exactly, so an unpartitioned index finds the exact top k
+    assert index.measureRecall(queries, top_k=10) >= 0.99
+    index.partition(nlist=16)
+    index.nprobe = 16
+    assert index.measureRecall(queries, top_k=10) >= 0.99
+    # scanning half the partitions of unclustered data still finds most of it
+    index.nprobe = 8
+    assert index.measureRecall(queries, top_k=10) >= 0.8
+
+
+def test_namespaces_are_separate(tmp_path):
+    data = vectors(4)
+    index = LocalIndex(str(tmp_path / 'v'), dim=32, partitionAt=0)
+    index.upsert([('a', data[0])])
+    index.upsert([('b', data[1])], namespace='bob')
+    index.upsert([('c', data[2])], namespace='../carol')
+
+    assert ids(index.query(data[1], top_k=5)) == ['a']
+    assert ids(index.query(data[0], top_k=5, namespace='bob')) == ['b']
+    assert ids(index.query(data[0], top_k=5, namespace='../carol')) == ['c']
+    # a delete only reaches its own namespace
+    index.delete(ids=['a', 'b'], namespace='bob')
+    assert ids(index.query(data[0], top_k=5)) == ['a']
+    assert ids(index.query(data[0], top_k=5, namespace='bob')) == []
+
+    # every namespace is kept under the index directory
+    reopened = LocalIndex(str(tmp_path / 'v'))
+    assert ids(reopened.query(data[0], top_k=5, namespace='../carol')) == ['c']
+    assert sorted(p.name for p in (tmp_path / 'v' / 'namespaces').iterdir()) == sorted(n.encode().hex() for n in ('bob', '../carol'))
@@ -0,0 +1,56 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from pipeline import REQUIRED, TurnPipeline
+
+
+def test_a_stage_past_its_deadline_falls_back():
+    release = threading.Event()
+    pipeline = TurnPipeline({'memory': 0.05})
+    try:
+        start = time.perf_counter()
+        results = pipeline.run({'store': (lambda: 'stored', REQUIRED), 'memory': (lambda: release.wait(5) and 'memories', 'none')})
+        assert time.perf_counter() - start < 1
+        assert results == {'store': 'stored', 'memory': 'none'}
+        assert pipeline.fellBack == ['memory']
+        assert set(pipeline.timings) == {'store', 'memory'}
+
+        # a failing stage falls back too, and the next run starts with a clean record
+        def fail():
+            raise RuntimeError('vector service down')
+        assert pipeline.run({'memory': (fail, 'none')}) == {'memory': 'none'}
+        assert pipeline.run({'memory': (lambda: 'memories', 'none')}) == {'memory': 'memories'}
+        assert pipeline.fellBack == []
+    finally:
+        release.set()
+        pipeline.close()
+
+
+def test_a_required_stage_raises():
+    release = threading.Event()
+    pipeline = TurnPipeline({'store': 0.05})
+    try:
+        def fail():
+            raise RuntimeError('disk full')
+        with pytest.raises(RuntimeError, match='disk full'):
+            pipeline.run({'store': (fail, REQUIRED), 'memory': (lambda: 'memories', 'none')})
+        with pytest.raises(asyncio.TimeoutError):
+            pipeline.run({'store': (lambda: release.wait(5), REQUIRED)})
+    finally:
+        release.set()
+        pipeline.close()
+
+
+def test_stages_run_concurrently():
+    pipeline = TurnPipeline()
+    try:
+        start = time.perf_counter()
+        results = pipeline.run({name: (lambda name=name: time.sleep(0.2) or name, REQUIRED) for name in ('a', 'b', 'c')})
+        assert results == {'a': 'a', 'b': 'b', 'c': 'c'}
+        assert time.perf_counter() - start < 0.5
+    finally:
+        pipeline.close()
+
@@ -0,0 +1,69 @@
+import random
+
+from prompt import PromptBuilder, TurnContext, countTokens, promptBudget
+
+alignment = [{'role': 'system', 'content': 'You are a helpful assistant.'}]
+post = [{'role': 'assistant', 'content': 'ASSISTANT at 2023-05-02 10:00:00: '}]
+
+
+def linearWindow(conversation, fixed, model, max_tokens):
+    # the trim PromptBuilder replaces: drop the oldest message until the rest fits, keeping at least the newest
+    available = promptBudget(model, max_tokens) - sum(countTokens(m, model) for m in fixed)
+    start = 0
+    while start < len(conversation) - 1 and sum(countTokens(m, model) for m in conversation[start:]) > available:
+        start += 1
+    return start
+
+
+def conversation(n, seed=0):
+    rng = random.Random(seed)
+    return [{'role': 'user' if i % 2 == 0 else 'assistant', 'content': f'message {i} ' + 'word ' * rng.randint(1, 400)} for i in range(n)]
+
+
+def test_bisect_window_matches_the_linear_trim():
+    builder = PromptBuilder(alignment)
+    convo = []
+    for i, message in enumerate(conversation(300)):
+        # appended one at a time, like a session, so the running totals are extended incrementally
+        convo.append(message)
+        for model, max_tokens in (('gpt-4', 512), ('gpt-3.5-turbo', 1024), ('gpt-4-32k', 256)):
+            fixed = alignment + post
+            assert builder.window(convo, fixed, model, max_tokens) == linearWindow(convo, fixed, model, max_tokens), (i, model)
+
+
+def test_window_recounts_after_a_deletion():
+    builder = PromptBuilder(alignment)
+    convo = conversation(120, seed=1)
+    builder.window(convo, alignment, 'gpt-4', 512)
+    del convo[-1]
+    convo.append({'role': 'user', 'content': 'word ' * 2000})
+    assert builder.window(convo, alignment, 'gpt-4', 512) == linearWindow(convo, alignment, 'gpt-4', 512)
+    # a newest message over the budget by itself is still kept
+    assert builder.window(convo, alignment, 'gpt-4', 7000) == len(convo) - 1
+
+
+def test_follow_ups_reuse_the_prefix_of_the_turn():
+    builder = PromptBuilder(alignment)
+    memory = [{'role': 'system', 'content': 'These are the most semantically similar past messages: a, b'}]
+    convo = conversation(10, seed=2)
+    turn = TurnContext(builder, memory, model='gpt-4', max_tokens=512)
+    first = turn.build(convo, post)
+    assert first == builder.build(convo, memory, post, model='gpt-4', max_tokens=512)
+
+    result = {'role': 'system', 'content': 'Here is the HTML of the results page of your Google search'}
+    convo.append(result)
+    second = turn.build(convo, post, extra=[{'role': 'system', 'content': 'file contents'}])
+    prefix = first[:-len(post)]
+    assert second[:len(prefix)] == prefix
+    assert second[len(prefix):] == [result, {'role': 'system', 'content': 'file contents'}] + post
+
+
+def test_follow_ups_that_no_longer_fit_get_a_new_window():
+    builder = PromptBuilder(alignment)
+    convo = conversation(200, seed=3)
+    turn = TurnContext(builder, [], model='gpt-4', max_tokens=512)
+    turn.build(convo, post)
+    convo.append({'role': 'system', 'content': 'word ' * 3000})
+    second = turn.build(convo, post)
+    assert second == builder.build(convo, [], post, model='gpt-4', max_tokens=512)
+    assert sum(countTokens(m, 'gpt-4') for m in second) <= promptBudget('gpt-4', 512)
@@ -0,0 +1,37 @@
+from retrieval import retrieve
+from store import ChatStore
+
+
+def fill(store, n, word='locker'):
+    ids = [f'{word}{i}' for i in range(n)]
+    for i, identifier in enumerate(ids):
+        store.insert(identifier, f'USER at 2023-05-02 10:00:{i:02d}: my {word} code is {i}', 'USER', 1683000000 + i, '')
+    return ids
+
+
+def test_discarded_messages_are_not_retrieved(tmp_path):
+    store = ChatStore(str(tmp_path / 'chat.db'))
+    kept = fill(store, 3, 'locker')
+    dropped = fill(store, 3, 'lockers')
+    store.insert('gone', 'USER at 2023-05-02 11:00:00: my locker code is secret', 'USER', 1683003600, '')
+    store.discard(['gone'])
+
+    found = [i for i, score in store.search('locker code', limit=20)]
+    assert 'gone' not in found
+    assert set(kept) <= set(found)
+    assert store.fetch(['gone'] + kept) == store.fetch(kept)
+    assert len(store.fetch(dropped)) == 3
+    store.close()
+
+
+def test_excluded_ids_do_not_shrink_fused_results(tmp_path):
+    store = ChatStore(str(tmp_path / 'chat.db'))
+    ids = fill(store, 10)
+    session = set(ids[:4])
+    # the vector ranking puts the session's own messages first
+    matches = [{'id': i, 'score': 1.0 - n / 10} for n, i in enumerate(ids)]
+    for mode in ('vector', 'hybrid', 'lexical'):
+        result = retrieve(store, 'locker code', lambda: matches, 5, mode=mode, exclude=session)['matches']
+        assert len(result) == 5, mode
+        assert not session & {m['id'] for m in result}, mode
+    store.close()
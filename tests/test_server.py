@@ -0,0 +1,112 @@
+import asyncio
+import threading
+import time
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from benchmarks import fakes
+
+users = {'alice': 'alice-token', 'bob': 'bob-token'}
+
+
+def auth(user):
+    return {'Authorization': 'Bearer ' + users[user]}
+
+
+def test_every_route_needs_a_token_and_sessions_belong_to_their_user(chat):
+    import server
+
+    backends = chat.Backends(fakes.FakeIndex(), browserFactory=fakes.FakeDriver)
+
+    async def run():
+        chatServer = server.ChatServer(backends, users, owner='alice')
+        async with TestClient(TestServer(chatServer.app)) as client:
+            for method, path in (('POST', '/sessions'), ('GET', '/metrics'), ('GET', '/ws')):
+                assert (await client.request(method, path)).status == 401
+                assert (await client.request(method, path, headers={'Authorization': 'Bearer wrong'})).status == 401
+
+            alice = (await (await client.post('/sessions', headers=auth('alice'))).json())['session']
+            bob = (await (await client.post('/sessions', headers=auth('bob'))).json())['session']
+            assert chatServer.sessions[alice].owner == ''
+            assert chatServer.sessions[bob].owner == 'bob'
+
+            assert (await client.get(f'/sessions/{alice}/stats', headers=auth('alice'))).status == 200
+            assert (await client.get(f'/sessions/{alice}/stats', headers=auth('bob'))).status == 404
+            assert (await client.post(f'/sessions/{alice}/messages', json={'text': 'hi'}, headers=auth('bob'))).status == 404
+            assert (await client.delete(f'/sessions/{alice}', headers=auth('bob'))).status == 404
+            assert (await client.get('/metrics', headers=auth('bob'))).status == 403
+            assert (await client.get('/metrics', headers=auth('alice'))).status == 200
+
+            # browser WebSocket clients pass the token in the query string
+            ws = await client.ws_connect(f'/sessions/{bob}/ws?token=bob-token')
+            assert await ws.receive_json() == {'type': 'session', 'session': bob}
+            await ws.close()
+
+    try:
+        asyncio.run(run())
+    finally:
+        backends.close(flush=False)
+
+
+def test_a_busy_session_is_not_deleted(chat, monkeypatch):
+    import server
+
+    backends = chat.Backends(fakes.FakeIndex(), browserFactory=fakes.FakeDriver)
+    started, release = threading.Event(), threading.Event()
+    respond = chat.respond
+
+    def blocked(messages, **kwargs):
+        started.set()
+        release.wait(10)
+        return respond(messages, **kwargs)
+
+    monkeypatch.setattr(chat, 'respond', blocked)
+
+    async def run():
+        chatServer = server.ChatServer(backends, users, owner='alice')
+        async with TestClient(TestServer(chatServer.app)) as client:
+            session = (await (await client.post('/sessions', headers=auth('alice'))).json())['session']
+            turn = asyncio.create_task(client.post(f'/sessions/{session}/messages', json={'text': 'hi'}, headers=auth('alice')))
+            await asyncio.get_running_loop().run_in_executor(None, started.wait, 10)
+
+            assert (await client.delete(f'/sessions/{session}', headers=auth('alice'))).status == 409
+            assert session in chatServer.sessions
+            release.set()
+            assert (await turn).status == 200
+            assert (await client.delete(f'/sessions/{session}', headers=auth('alice'))).status == 200
+
+    try:
+        asyncio.run(run())
+    finally:
+        release.set()
+        backends.close(flush=False)
+
+
+def test_closing_the_socket_declines_a_pending_confirmation(chat, monkeypatch):
+    import server
+
+    backends = chat.Backends(fakes.FakeIndex(), browserFactory=fakes.FakeDriver)
+    sent = []
+    monkeypatch.setattr(chat, 'sendMail', lambda *args: sent.append(args))
+
+    async def run():
+        chatServer = server.ChatServer(backends, users, owner='alice')
+        async with TestClient(TestServer(chatServer.app)) as client:
+            ws = await client.ws_connect('/ws?token=alice-token')
+            session = (await ws.receive_json())['session']
+            await ws.send_json({'type': 'message', 'text': 'email bob that the build is fixed'})
+            while (await ws.receive_json())['type'] != 'confirm':
+                pass
+            await ws.close()
+
+            # the turn ends long before confirmTimeout
+            start = time.perf_counter()
+            while chatServer.locks[session].locked():
+                assert time.perf_counter() - start < 5
+                await asyncio.sleep(0.01)
+
+    try:
+        asyncio.run(run())
+    finally:
+        backends.close(flush=False)
+    assert sent == []
@@ -0,0 +1,61 @@
+from benchmarks import fakes
+
+
+def test_discard_after_upsert_keeps_saved_vectors(chat):
+    index = fakes.FakeIndex()
+    backends = chat.Backends(index, browserFactory=fakes.FakeDriver)
+    session = chat.ChatSession(backends)
+    try:
+        session.turn('remember that my locker code is 1234')
+        saved = list(session.ids)
+        # /upsert/
+        session.upsert()
+        assert set(saved) <= index.known
+
+        session.turn('and my bike lock is 5678')
+        later = session.ids[len(saved):]
+        # let the worker upsert the later messages too, so discard has to delete them from the index
+        backends.upserts.flush()
+        assert set(later) <= index.known
+
+        # /qd/
+        session.discard()
+        assert set(saved) <= index.known
+        assert not set(later) & index.known
+        # nor are they found by full-text search
+        found = [i for i, score in chat.chatStore.search('bike lock')]
+        assert not set(later) & set(found)
+    finally:
+        session.close()
+        backends.close(flush=False)
+
+
+def test_users_only_remember_their_own_messages(chat, monkeypatch):
+    index = fakes.FakeIndex()
+    backends = chat.Backends(index, browserFactory=fakes.FakeDriver)
+    owner = chat.ChatSession(backends)
+    guest = chat.ChatSession(backends, owner='bob')
+    prompts = []
+    respond = chat.respond
+    monkeypatch.setattr(chat, 'respond', lambda messages, **kwargs: prompts.append(messages) or respond(messages, **kwargs))
+    try:
+        guest.turn('my bike lock code is 5678')
+        backends.upserts.flush()
+        assert set(guest.ids) <= index.namespace('bob').known
+        assert not set(guest.ids) & index.known
+
+        prompts.clear()
+        owner.turn('what is my bike lock code?')
+        assert not any('5678' in m['content'] for m in prompts[0])
+        assert chat.chatStore.search('bike lock code') == chat.chatStore.search('bike lock code', owner='')
+        assert not set(guest.ids) & {i for i, score in chat.chatStore.search('bike lock code')}
+        assert chat.chatStore.fetch(guest.ids) == []
+        assert len(chat.chatStore.fetch(guest.ids, owner='bob')) == 2
+
+        # the Google account and the files of the host are the owner's
+        assert set(owner.aeis.handlers) == set(chat.aeiCommands)
+        assert set(guest.aeis.handlers) == {'/;GOOGSEARCH;/'}
+    finally:
+        owner.close()
+        guest.close()
+        backends.close(flush=False)
@@ -0,0 +1,26 @@
+from completioncache import CompletionCache
+from tracing import Tracer
+
+
+def test_cached_completions_are_traced_per_session(chat, monkeypatch):
+    monkeypatch.setattr(chat, 'completionCache', CompletionCache('chat.db'))
+    process = Tracer(counters={'completionCache': lambda: chat.completionCache.counts})
+    session = Tracer(counters=process.counters, parent=process)
+    other = Tracer(counters=process.counters, parent=process)
+    messages = [{'role': 'user', 'content': 'USER at 2023-05-02 10:00:00: hello there'}]
+
+    session.startTurn()
+    first, shown = chat.respond(messages, trace=session, temperature=0.0)
+    # another session's lookup in the middle of this turn
+    chat.respond(messages, trace=other, temperature=0.0)
+    second, shown = chat.respond(messages, trace=session, temperature=0.0)
+    turn = session.endTurn()
+
+    assert first == second
+    completions = [s for s in turn['spans'] if s['name'] == 'complete']
+    assert [s['cached'] for s in completions] == [False, True]
+    assert turn['counts'] == {'completionCache.misses': 1, 'completionCache.hits': 1}
+    # the cache's own counters moved with the other session's hit too, and are labelled as process-wide
+    assert turn['processCaches']['completionCache']['hits'] == 2
+    assert 'caches' not in turn
+    assert session.summary()['spans']['complete']['count'] == 2
@@ -0,0 +1,64 @@
+import time
+
+import pytest
+
+from benchmarks import fakes
+from upsertqueue import UpsertQueue
+
+
+def embed(texts):
+    return [[float(len(t)), 1.0] for t in texts]
+
+
+def waitFor(condition, seconds=5):
+    start = time.perf_counter()
+    while not condition():
+        assert time.perf_counter() - start < seconds
+        time.sleep(0.01)
+
+
+def test_journaled_messages_are_upserted_after_a_restart(tmp_path):
+    db = str(tmp_path / 'chat.db')
+    index = fakes.FakeIndex()
+    # a session that ends without flushing, e.g. killed before /q/
+    queue = UpsertQueue(embed, index, dbPath=db, interval=60)
+    queue.put('a', 'first')
+    queue.put('b', 'second', 'bob')
+    queue.stop(flush=False)
+    assert not index.known
+
+    # the next start drains the journal at once, without waiting for interval or a full batch
+    queue = UpsertQueue(embed, index, dbPath=db, interval=60)
+    assert queue.pending() == 2
+    queue.start()
+    waitFor(lambda: queue.pending() == 0)
+    assert index.known == {'a'}
+    assert index.namespace('bob').known == {'b'}
+    queue.stop(flush=False)
+
+
+def test_a_failed_embedding_leaves_the_batch_queued(tmp_path):
+    db = str(tmp_path / 'chat.db')
+    index = fakes.FakeIndex()
+
+    def failing(texts):
+        raise RuntimeError('embedding service down')
+
+    queue = UpsertQueue(failing, index, dbPath=db, batchSize=2, interval=60)
+    queue.put('a', 'first')
+    with pytest.raises(RuntimeError):
+        queue.flush()
+    assert queue.pending() == 1
+
+    # the worker keeps the batch journaled too, and records the error instead of dying
+    queue.start()
+    queue.put('b', 'second')
+    waitFor(lambda: queue.lastError is not None)
+    assert queue.pending() == 2
+    assert not index.known
+    queue.stop(flush=False)
+
+    queue = UpsertQueue(embed, index, dbPath=db, interval=60)
+    assert queue.flush() == 2
+    assert index.known == {'a', 'b'} and queue.pending() == 0
+    queue.stop(flush=False)
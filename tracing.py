@@ -0,0 +1,293 @@
+""" Per-turn tracing and metrics
+Times the stages of each chat turn (embedding, vector query, memory loading,
+completion, AEIs, ...) as named spans, and collects token usage, retrieval
+counts and cache counter changes alongside them. Each finished turn can be
+appended as one JSON line to a trace file and the session totals rewritten as
+an OpenMetrics text file. Spans may be opened from any thread; those that end
+after their turn are kept in the session totals only. Each chat session has
+its own tracer, whose totals also add up in a parent tracer for the whole
+process. When the tracer is disabled, span() returns a shared no-op context and
+nothing is recorded."""
+
+import json
+import threading
+import time
+from collections import deque
+
+
+def percentile(values, q):
+    # nearest-rank percentile
+    # takes: list of numbers, percentile between 0 and 100
+    # returns: number, or None for an empty list
+
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))]
+
+
+class _NoSpan:
+    # what span() returns while tracing is off
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_noSpan = _NoSpan()
+
+
+class _Span:
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.turn = self.tracer.turn
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        if kind is not None:
+            self.attrs['error'] = kind.__name__
+        self.tracer._record(self, time.perf_counter())
+        return False
+
+    def set(self, **attrs):
+        # add attributes to the span while it is open
+        self.attrs.update(attrs)
+
+
+class Tracer:
+    # span timer and counters for the turns of one chat session, safe to share between threads
+    # takes: whether to record anything, path of the JSONL file each turn is appended to (None: keep in memory only),
+    #        path of the OpenMetrics file rewritten after each turn (None: no export),
+    #        dict of name -> function returning a dict of numeric counters (e.g. a cache's hit counts) whose change
+    #        over each turn is recorded, number of recent durations per span kept for percentiles,
+    #        Tracer that also receives the totals (e.g. the process's, for sessions). the counters of a tracer with a
+    #        parent usually belong to the whole process, so their changes are stored as processCaches, not caches
+
+    def __init__(self, enabled=True, path=None, metricsPath=None, counters=None, keep=10000, parent=None):
+        self.enabled = enabled
+        self.parent = parent
+        self.path = path
+        self.metricsPath = metricsPath
+        self.counters = dict(counters or {})
+        self.keep = keep
+        self.lock = threading.Lock()
+
+        self.turn = None
+        self.turns = 0
+        # session totals: span name -> [count, seconds, recent durations]
+        self.spans = {}
+        self.tokens = {}
+        self.counts = {}
+
+    def span(self, name, **attrs):
+        # time a block: with tracer.span('embed'): ...
+        # takes: span name, attributes stored with the span
+        # returns: context manager, whose set() adds attributes
+
+        if not self.enabled:
+            return _noSpan
+        return _Span(self, name, attrs)
+
+    def record(self, name, start, **attrs):
+        # record a span that started at start and ends now, for a block whose outcome decides whether it is a span
+        # takes: span name, time.perf_counter() at its start, attributes stored with the span
+
+        if not self.enabled:
+            return
+        span = _Span(self, name, attrs)
+        span.turn, span.start = self.turn, start
+        self._record(span, time.perf_counter())
+
+    def wrap(self, name, func):
+        # returns: func, timed as a span named name on every call
+
+        def traced(*args, **kwargs):
+            with self.span(name):
+                return func(*args, **kwargs)
+        return traced
+
+    def firstItem(self, name, items):
+        # time from now until an iterable yields its first item, e.g. the first streamed token
+        # takes: span name, iterable
+        # returns: iterator over the same items
+
+        if not self.enabled:
+            return iter(items)
+        return self._firstItem(name, items)
+
+    def _firstItem(self, name, items):
+        span = self.span(name).__enter__()
+        waiting = True
+        for item in items:
+            if waiting:
+                span.__exit__(None, None, None)
+                waiting = False
+            yield item
+
+    def count(self, name, n=1):
+        # add n to a counter of this turn and of the session, e.g. retrieval matches
+
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+            if self.turn is not None:
+                self.turn['counts'][name] = self.turn['counts'].get(name, 0) + n
+        if self.parent is not None:
+            self.parent.count(name, n)
+
+    def usage(self, usage, estimated=False):
+        # add the token usage of a completion
+        # takes: dict with prompt_tokens and completion_tokens, like a completion response's usage,
+        #        whether the counts were estimated locally (streamed responses carry no usage)
+
+        if not self.enabled or not usage:
+            return
+        kinds = {'prompt': usage['prompt_tokens'], 'completion': usage['completion_tokens']}
+        with self.lock:
+            for kind, n in kinds.items():
+                self.tokens[kind] = self.tokens.get(kind, 0) + n
+                if self.turn is not None:
+                    self.turn['tokens'][kind] = self.turn['tokens'].get(kind, 0) + n
+            if estimated and self.turn is not None:
+                self.turn['tokens']['estimated'] = True
+        if self.parent is not None:
+            self.parent.usage(usage)
+
+    def _snapshot(self):
+        return {name: dict(get()) for name, get in self.counters.items()}
+
+    def startTurn(self, **attrs):
+        # open the record of a turn. spans and counts from now until endTurn belong to it
+        # takes: attributes stored with the turn, e.g. model
+
+        if not self.enabled:
+            return
+        turn = {'turn': self.turns + 1, 'time': time.time(), 'spans': [], 'tokens': {}, 'counts': {}}
+        turn.update(attrs)
+        turn['_start'] = time.perf_counter()
+        turn['_counters'] = self._snapshot()
+        with self.lock:
+            self.turn = turn
+
+    def endTurn(self, **attrs):
+        # close the current turn, write it to the trace file and refresh the metrics file
+        # takes: attributes stored with the turn, e.g. stages that fell back
+        # returns: the turn record dict, or None while tracing is off
+
+        if not self.enabled or self.turn is None:
+            return None
+        end = time.perf_counter()
+        with self.lock:
+            turn, self.turn = self.turn, None
+        start = turn.pop('_start')
+        before = turn.pop('_counters')
+        turn['seconds'] = end - start
+        turn.update(attrs)
+
+        # how much each counter moved during the turn, leaving out the ones that did not
+        changes = {}
+        for name, now in self._snapshot().items():
+            was = before.get(name, {})
+            moved = {k: v - was.get(k, 0) for k, v in now.items() if isinstance(v, (int, float)) and v != was.get(k, 0)}
+            if moved:
+                changes[name] = moved
+        # a session's view of process-wide counters also moves with other sessions' traffic, so it is labelled as such
+        turn['caches' if self.parent is None else 'processCaches'] = changes
+
+        if self.path:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(turn, default=str) + '\n')
+        self._finished(turn['seconds'])
+        return turn
+
+    def _finished(self, seconds):
+        # count a finished turn, of this tracer's session or a child's, and refresh the metrics file
+
+        with self.lock:
+            self.turns += 1
+            self._add('turn', seconds)
+        if self.metricsPath:
+            with open(self.metricsPath, 'w') as f:
+                f.write(self.openMetrics())
+        if self.parent is not None:
+            self.parent._finished(seconds)
+
+    def _record(self, span, end):
+        seconds = end - span.start
+        with self.lock:
+            self._add(span.name, seconds)
+            turn = self.turn
+            if turn is not None and turn is span.turn:
+                entry = {'name': span.name, 'start': span.start - turn['_start'], 'seconds': seconds}
+                entry.update(span.attrs)
+                turn['spans'].append(entry)
+        tracer = self.parent
+        while tracer is not None:
+            with tracer.lock:
+                tracer._add(span.name, seconds)
+            tracer = tracer.parent
+
+    def _add(self, name, seconds):
+        # caller holds the lock
+        totals = self.spans.get(name)
+        if totals is None:
+            totals = self.spans[name] = [0, 0.0, deque(maxlen=self.keep)]
+        totals[0] += 1
+        totals[1] += seconds
+        totals[2].append(seconds)
+
+    def summary(self):
+        # latency breakdown of the session so far
+        # returns: dict with the number of turns, span name -> {count, total, mean, p50, p95, max} in seconds
+        #          (slowest total first), token totals and counters
+
+        with self.lock:
+            spans = {name: (n, total, list(recent)) for name, (n, total, recent) in self.spans.items()}
+            tokens = dict(self.tokens)
+            counts = dict(self.counts)
+        breakdown = {}
+        for name, (n, total, recent) in sorted(spans.items(), key=lambda item: -item[1][1]):
+            breakdown[name] = {'count': n, 'total': total, 'mean': total / n, 'p50': percentile(recent, 50),
+                               'p95': percentile(recent, 95), 'max': max(recent)}
+        return {'turns': self.turns, 'spans': breakdown, 'tokens': tokens, 'counts': counts}
+
+    def openMetrics(self):
+        # session totals in the OpenMetrics text format
+        # returns: string
+
+        summary = self.summary()
+        lines = ['# TYPE chat_span_seconds summary', '# UNIT chat_span_seconds seconds',
+                 '# HELP chat_span_seconds Time spent in each stage of the chat loop.']
+        for name, s in summary['spans'].items():
+            label = _label(name)
+            for q in ('0.5', '0.95'):
+                lines.append(f'chat_span_seconds{{span="{label}",quantile="{q}"}} {s["p50" if q == "0.5" else "p95"]:.6f}')
+            lines.append(f'chat_span_seconds_sum{{span="{label}"}} {s["total"]:.6f}')
+            lines.append(f'chat_span_seconds_count{{span="{label}"}} {s["count"]}')
+        lines += ['# TYPE chat_turns counter', '# HELP chat_turns Completed chat turns.', f'chat_turns_total {summary["turns"]}']
+        lines += ['# TYPE chat_tokens counter', '# HELP chat_tokens Completion tokens used, by kind.']
+        lines += [f'chat_tokens_total{{kind="{_label(kind)}"}} {n}' for kind, n in summary['tokens'].items()]
+        lines += ['# TYPE chat_events counter', '# HELP chat_events Retrieval and AEI event counts.']
+        lines += [f'chat_events_total{{name="{_label(name)}"}} {n}' for name, n in summary['counts'].items()]
+        for name, get in self.counters.items():
+            metric = 'chat_' + ''.join(c if c.isalnum() else '_' for c in name)
+            lines += [f'# TYPE {metric} gauge', f'# HELP {metric} {name} counters.']
+            lines += [f'{metric}{{counter="{_label(k)}"}} {v}' for k, v in get().items() if isinstance(v, (int, float))]
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+
+def _label(value):
+    # escape a label value for the text format
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,150 @@
+""" Write-behind upsert queue
+Embeds session messages and upserts them to the vector index in batches
+on a background thread while the chat is running. Pending messages are
+journaled in chat.db, so an interrupted session resumes upserting on the
+next start and a nominal exit only has to flush what is left. Each message
+is upserted to the index namespace of the user whose memory it is, so one
+user's vector queries never find another user's messages."""
+
+import threading
+import time
+from sqlite3 import connect
+
+
+class UpsertQueue:
+    # background worker that drains the PendingUpsert journal in batches
+    # takes: batch embedding function (list of strings -> list of vectors), vector index with upsert/delete,
+    #        path to sqlite db, max messages per embedding/upsert request, seconds between idle drains
+
+    def __init__(self, embedBatch, vecdb, dbPath='chat.db', batchSize=16, interval=10.0):
+        self.embedBatch = embedBatch
+        self.vecdb = vecdb
+        self.batchSize = batchSize
+        self.interval = interval
+
+        # one connection shared by the chat loop and the worker, serialized by a lock
+        self.conn = connect(dbPath, check_same_thread=False)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS PendingUpsert (
+                id TEXT PRIMARY KEY,
+                text TEXT,
+                queued REAL,
+                namespace TEXT NOT NULL DEFAULT ''
+            )
+        ''')
+        if 'namespace' not in [c[1] for c in self.conn.execute('PRAGMA table_info(PendingUpsert)')]:
+            self.conn.execute("ALTER TABLE PendingUpsert ADD COLUMN namespace TEXT NOT NULL DEFAULT ''")
+        self.conn.commit()
+        self.lock = threading.Lock()
+        self.drainLock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.lastError = None
+
+    def start(self):
+        # start the worker. anything left in the journal by an interrupted session is drained right away
+
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='UpsertQueue', daemon=True)
+            self.thread.start()
+        if self.pending():
+            self.wake.set()
+
+    def put(self, identifier, text, namespace=''):
+        # journal one message for embedding and upsert
+        # takes: chat/vector ID, message text without speaker and timestamp, index namespace of the user whose
+        #        memory it is ('': the owner of the install)
+
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO PendingUpsert (id, text, queued, namespace) VALUES (?, ?, ?, ?)', (identifier, text, time.time(), namespace))
+            self.conn.commit()
+            count = self.conn.execute('SELECT COUNT(*) FROM PendingUpsert').fetchone()[0]
+        if count >= self.batchSize:
+            self.wake.set()
+
+    def pending(self):
+        # returns: number of journaled messages not yet upserted
+
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM PendingUpsert').fetchone()[0]
+
+    def discard(self, identifiers, deleteUpserted=True, namespace=''):
+        # remove messages from the queue, and from the vector index if the worker already upserted them
+        # takes: list of chat/vector IDs, bool, index namespace they were upserted to
+        # returns: list of IDs that were still pending
+
+        identifiers = list(identifiers)
+        if not identifiers:
+            return []
+        # hold drainLock so a batch in flight cannot upsert a message after it is discarded
+        with self.drainLock, self.lock:
+            marks = ','.join('?' * len(identifiers))
+            rows = self.conn.execute(f'SELECT id FROM PendingUpsert WHERE id IN ({marks})', identifiers).fetchall()
+            self.conn.execute(f'DELETE FROM PendingUpsert WHERE id IN ({marks})', identifiers)
+            self.conn.commit()
+        dropped = [r[0] for r in rows]
+        upserted = [i for i in identifiers if i not in dropped]
+        if deleteUpserted and upserted:
+            self.vecdb.delete(ids=upserted, namespace=namespace)
+        return dropped
+
+    def flush(self):
+        # synchronously embed and upsert everything left in the journal
+        # returns: number of messages upserted
+
+        return self._drain()
+
+    def stop(self, flush=True):
+        # stop the worker, optionally flushing the journal first
+        # returns: number of messages upserted by the final flush
+
+        self.stopping.set()
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        done = self._drain() if flush else 0
+        self.conn.close()
+        return done
+
+    def _drain(self):
+        # upsert journaled messages batch by batch, oldest first. rows are only removed from
+        # the journal after the vector index has accepted them
+
+        done = 0
+        with self.drainLock:
+            while True:
+                with self.lock:
+                    rows = self.conn.execute('SELECT id, text, namespace FROM PendingUpsert ORDER BY queued LIMIT ?', (self.batchSize,)).fetchall()
+                if not rows:
+                    return done
+                # one embedding request per batch, and one upsert per namespace in it
+                vectors = self.embedBatch([r[1] for r in rows])
+                spaces = {}
+                for r, v in zip(rows, vectors):
+                    spaces.setdefault(r[2], []).append((r[0], v))
+                for namespace, items in spaces.items():
+                    self.vecdb.upsert(items, namespace=namespace)
+                with self.lock:
+                    self.conn.executemany('DELETE FROM PendingUpsert WHERE id = ?', [(r[0],) for r in rows])
+                    self.conn.commit()
+                done += len(rows)
+
+    def _run(self):
+        # worker loop: drain when a full batch is waiting, or every interval seconds otherwise
+
+        backoff = self.interval
+        while not self.stopping.is_set():
+            self.wake.wait(timeout=backoff)
+            self.wake.clear()
+            if self.stopping.is_set():
+                break
+            try:
+                self._drain()
+                self.lastError = None
+                backoff = self.interval
+            except Exception as e:
+                # leave the batch journaled and retry later; the chat loop must never die here
+                self.lastError = e
+                backoff = min(backoff * 2, 300.0)